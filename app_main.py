@@ -33,6 +33,38 @@ A general description of the WooMessage API is as follows.
 
 There are three types of resources: user, chat, message
 
+--PAGINATION
+GETs of a whole collection (/api/user/, /api/chat/, /api/message/ and
+/api/chatrel/) return one page of rows, in id order.
+
+    limit int -- rows per page, default 100, at most 1000
+    after string -- a cursor, the page starts just after it
+    before string -- a cursor, the page ends just before it
+
+If there are more rows, the response carries the cursor of the next page in
+the X-Next-Cursor header and the URL of the next page in the Link header.
+Cursors are opaque tokens and must be passed back unchanged.
+
+To read a whole collection in one response, ask for a stream with ?stream=1
+(a JSON list) or with an Accept: application/x-ndjson header (one JSON object
+per line). Streams are written while the rows are read, without paging.
+
+$ curl -H "Accept: application/x-ndjson" http://127.0.0.1:5000/api/message/
+
+Example usage:
+$ curl -i http://127.0.0.1:5000/api/message/?limit=2
+X-Next-Cursor: WzJd
+Link: <http://127.0.0.1:5000/api/message/?limit=2&after=WzJd>; rel="next"
+
+--CONDITIONAL GETs
+Every GET of a resource or collection carries an ETag and a Last-Modified
+header. Send the ETag back in If-None-Match and, if the data has not changed
+since, the response is an empty 304 Not Modified. Checking costs one read of
+a version counter. If-Modified-Since alone always gets the full response.
+
+$ curl -i -H 'If-None-Match: "8c1f..."' http://127.0.0.1:5000/api/chat/1
+HTTP/1.0 304 NOT MODIFIED
+
 --USER
 An user resource is an individual user.
 
@@ -49,7 +81,7 @@ Description:
 Get a list of all users
 
 Parameters:
-None
+limit, before, after - optional, see PAGINATION above
 
 Example usage:
 $ curl -X GET http://127.0.0.1:5000/api/user/
@@ -142,6 +174,7 @@ An chat resource is an individual chat room data.
     Attributes:
     id int -- The unique number to represent this resource.
     time string --- The time (d/m/y HH:MM) the chat room was created.
+    time_ms int -- The creation time in milliseconds since the epoch.
     title string -- The name of the chat room.
 
 
@@ -151,7 +184,7 @@ Description:
 Get a list of all chat
 
 Parameters:
-None
+limit, before, after - optional, see PAGINATION above
 
 Example usage:
 $ curl -X GET http://127.0.0.1:5000/api/chat/
@@ -255,6 +288,77 @@ $ curl -X DELETE http://127.0.0.1:5000/api/chat/1
     "title": "cool"
 }
 
+
+GET /chat/:id/messages
+
+Description:
+Get only the messages of a chat that are newer than what the client already
+has, oldest first. Continue with since_id=next_since; more is true if the
+response was cut at limit. With wait, a request that finds nothing new is
+held until a message arrives or wait seconds (at most 30) have passed.
+
+Parameters:
+id - the id of the chat
+since_id int - optional, only messages with a greater id, default 0
+since_time int - optional, instead of since_id: only messages with a greater
+time_ms, meant for the first request
+limit int - optional, messages per response, default 100, at most 1000
+wait int - optional, seconds to long-poll for, default 0
+
+Example usage:
+$ curl "http://127.0.0.1:5000/api/chat/1/messages?since_id=4&wait=25"
+{
+    "messages": [
+        {
+            "chat_id": 1,
+            "id": 5,
+            "message": "i don't think we should do drugs",
+            "name": "Morgan",
+            "time": "04/29/2018 21:49",
+            "time_ms": 1525052940000,
+            "user_id": 5
+        }
+    ],
+    "more": false,
+    "next_since": 5
+}
+
+GET /chat/:id/read
+
+Description:
+Get the read watermark of every member of a chat: a member has read every
+message of the chat with an id up to last_read_id.
+
+Example usage:
+$ curl http://127.0.0.1:5000/api/chat/1/read
+[
+    {
+        "last_read_id": 5,
+        "name": "Jemal",
+        "user_id": 1
+    }
+]
+
+
+POST /chat/:id/read
+
+Description:
+Mark the messages of a chat as read by a member, up to message_id. A
+watermark never moves back. Opening the newest page of a chat in the web
+app does the same.
+
+Parameters:
+user_id int - the id of the member
+message_id int - optional, default the newest message of the chat
+
+Example usage:
+$ curl -X POST -d "user_id"="1" http://127.0.0.1:5000/api/chat/1/read
+{
+    "chat_id": 1,
+    "last_read_id": 5,
+    "user_id": 1
+}
+
 *******************************************************************************
 --Message
 A message resource is an individual message sent by a user in on chat room.
@@ -270,6 +374,9 @@ A message resource is an individual message sent by a user in on chat room.
     chat_id int -- The id of the chat where the message is sent
     message string -- The message content of the message
     time string -- the time the message was sent
+    time_ms int -- the time the message was sent, in milliseconds since the
+                   epoch. Parsed from time, or the current time if time can't
+                   be parsed.
 
 
 GET /message/
@@ -278,7 +385,7 @@ Description:
 Get a list of all messages
 
 Parameters:
-None
+limit, before, after - optional, see PAGINATION above
 
 Example usage:
 $ curl -X GET http://127.0.0.1:5000/api/message/
@@ -299,6 +406,35 @@ $ curl -X GET http://127.0.0.1:5000/api/message/
   }
 ]
 
+GET /message/search
+
+Description:
+Full-text search of the messages, best match first among the newest 10000
+matches. Every word of q must occur in a message, the last word may be the
+start of a word. snippet is
+the part of the message around the matches, HTML escaped, with the matched
+words in <mark> tags.
+
+Parameters:
+q string - the words to search for
+chat_id int - optional, only search the messages of this chat
+limit, after - optional, see PAGINATION above
+
+Example usage:
+$ curl "http://127.0.0.1:5000/api/message/search?q=school&chat_id=1"
+[
+  {
+    "chat_id": 1,
+    "id": 1,
+    "message": "Boy I like school",
+    "name": "Jemal",
+    "snippet": "Boy I like <mark>school</mark>",
+    "time": "4/25/18 21:49",
+    "time_ms": 1524692940000,
+    "user_id": 1
+  }
+]
+
 GET /message/:id
 
 Description:
@@ -409,9 +545,10 @@ from flask import *
 from flask_login import LoginManager, UserMixin, \
                                 login_required, login_user, logout_user
 # a hash algorithm that encrypts password
-from passlib.hash import sha256_crypt
 from functools import wraps
+from urllib.parse import urlencode
 import os
+import json
 
 # Our Scripts
 from custom_views import *
@@ -419,6 +556,10 @@ from database_class import *
 from exception_classes import *
 from queries import *
 from custom_forms import *
+from timestamps import now_ms, format_time_ms
+from password_hashing import calibrate_rounds, DEFAULT_ROUNDS
+from synthetic_data import PASSWORD as SYNTHETIC_PASSWORD, \
+    END_MS as SYNTHETIC_END_MS
 
 
 app = Flask(__name__)
@@ -427,14 +568,77 @@ app.config["SECRET_KEY"] = 'thisissecret'
 app.config.update(
     DATABASE=os.path.join(app.root_path, 'WooMessages.sqlite'),
     DEBUG=True,
-    SECRET_KEY='thisissecret'
+    SECRET_KEY='thisissecret',
+    # rows per page of the /api/* collections, and the most a ?limit= can ask
+    API_PAGE_SIZE=100,
+    API_MAX_PAGE_SIZE=1000,
+    # messages per page of a chat room, and chats per page of the dashboard
+    CHAT_PAGE_SIZE=50,
+    DASHBOARD_PAGE_SIZE=50,
+    # an open chat room stream sends a keep-alive comment after
+    # SSE_KEEPALIVE quiet seconds, and new messages SSE_BATCH_SIZE at a time
+    SSE_KEEPALIVE=15.0,
+    SSE_BATCH_SIZE=100,
+    # the longest a /api/chat/<id>/messages long-poll is held, in seconds
+    DELTA_MAX_WAIT=30,
+    # cache the user and chat lookups of queries.py (see query_cache.py),
+    # at most QUERY_CACHE_SIZE results for up to QUERY_CACHE_TTL seconds
+    QUERY_CACHE=True,
+    QUERY_CACHE_SIZE=1024,
+    QUERY_CACHE_TTL=60.0,
+    # a message search ranks only the newest SEARCH_RANK_WINDOW matches, so
+    # a common word costs the same in any size of database (None: rank all)
+    SEARCH_RANK_WINDOW=10000,
+    # `flask archive` moves the messages older than ARCHIVE_AFTER_DAYS into
+    # one archive file per ARCHIVE_PERIOD ('year' or 'month'), see archive.py
+    ARCHIVE_AFTER_DAYS=365,
+    ARCHIVE_PERIOD='year',
+    # split the chats, with their members and messages, into SHARDS files
+    # by chat_id (see shard_router.py); change it with `flask reshard`
+    SHARDS=1,
+    # rows fetched at a time when a collection GET is streamed
+    STREAM_BATCH_SIZE=500,
+    # database connections shared by all requests, and how long a request
+    # waits for a free one before failing with a 503
+    DB_POOL_SIZE=8,
+    DB_POOL_TIMEOUT=5.0,
+    # PRAGMAs of the pooled connections (see connection_pool.WAL_PROFILE),
+    # None for SQLite's defaults
+    STORAGE_PROFILE=WAL_PROFILE,
+    # seconds between checkpoints that empty the -wal file, run on a thread
+    # of each pool, None to leave them to SQLite's wal_autocheckpoint
+    WAL_CHECKPOINT_INTERVAL=60.0,
+    WAL_CHECKPOINT_MODE='TRUNCATE',
+    # commit message and chat_rel inserts in batches from one writer thread
+    # (see group_commit.py), a batch stays open for GROUP_COMMIT_WINDOW
+    # seconds or GROUP_COMMIT_MAX_BATCH inserts
+    GROUP_COMMIT=False,
+    GROUP_COMMIT_WINDOW=0.002,
+    GROUP_COMMIT_MAX_BATCH=256,
+    GROUP_COMMIT_TIMEOUT=5.0,
+    # hash and verify passwords on HASH_WORKERS processes, refusing logins
+    # with a 503 while HASH_MAX_QUEUE hashes are already admitted
+    HASH_WORKERS=2,
+    HASH_MAX_QUEUE=32,
+    HASH_TIMEOUT=10.0,
+    # new passwords are hashed with the first scheme at PASSWORD_HASH_ROUNDS,
+    # older hashes are replaced when their user logs in (flask bench_hash
+    # suggests the rounds for this machine)
+    PASSWORD_HASH_SCHEMES=['sha256_crypt'],
+    PASSWORD_HASH_ROUNDS=DEFAULT_ROUNDS
 )
 
+# give the request's database connection back to the pool
+app.teardown_appcontext(close_db)
+
 # flask-login
 login_manager = LoginManager()  # allows Flask-Login
 login_manager.init_app(app)  # Once app obj created, configures it for login
 login_manager.login_view = "login"
 
+# renders the time_ms columns as readable dates, e.g. {{ date|datetime }}
+app.add_template_filter(format_time_ms, 'datetime')
+
 
 @app.cli.command('initdb')
 def initdb_command():
@@ -446,16 +650,153 @@ def initdb_command():
     print('Database Created')
 
 
+@app.cli.command('migrate')
+def migrate_command():
+    """
+    Helper function to upgrade the DB schema in place, keeping its data
+    :return: None
+    """
+    applied = migrate_db()
+
+    for version, description in applied:
+        print('Applied migration {}: {}'.format(version, description))
+
+    print('Database is at schema version {}'.format(SCHEMA_VERSION))
+
+
+@app.cli.command('rebuild_search')
+def rebuild_search_command():
+    """
+    Helper function to rebuild the full-text index of the messages
+    :return: None
+    """
+    count = rebuild_search_index()
+
+    print('Search index rebuilt, {} messages indexed'.format(count))
+
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=None,
+              help='Archive the messages older than this many days '
+                   '(default: ARCHIVE_AFTER_DAYS).')
+def archive_command(days):
+    """
+    Helper function to move the old messages into the archive files
+    :return: None
+    """
+    archived = archive_old_messages(days)
+
+    for period, count in sorted(archived.items()):
+        print('Archived {} messages of {}'.format(count, period))
+
+    print('{} messages archived'.format(sum(archived.values())))
+
+
+@app.cli.command('reshard')
+@click.option('--shards', type=int, required=True,
+              help='The number of shards to split the database into.')
+def reshard_command(shards):
+    """
+    Helper function to move the chats into a new number of shard files, with
+    the app stopped
+    :param shards: the new number of shards
+    :return: None
+    """
+    moved = reshard(app.config['DATABASE'], app.config['SHARDS'], shards)
+
+    for shard, count in enumerate(moved):
+        print('Shard {}: {} chats'.format(shard, count))
+
+    print('Database split into {} shards, set SHARDS = {} before starting '
+          'the app'.format(shards, shards))
+
+
+@app.cli.command('bench_hash')
+@click.option('--target-ms', default=250.0, show_default=True,
+              help='Wanted time of one password verify.')
+@click.option('--scheme', default='sha256_crypt', show_default=True)
+def bench_hash_command(target_ms, scheme):
+    """
+    Helper function to pick PASSWORD_HASH_ROUNDS for this machine
+    :param target_ms: the wanted verify latency in milliseconds
+    :param scheme: the passlib scheme to calibrate
+    :return: None
+    """
+    rounds, elapsed = calibrate_rounds(target_ms, scheme)
+
+    print('{} rounds of {} take {} ms per verify'.format(rounds, scheme,
+                                                         elapsed))
+    print('Set PASSWORD_HASH_ROUNDS={} to use them'.format(rounds))
+
+
 @app.cli.command('initdb_with_csv')
 @click.argument('filename')
-def convert_csv_to_sqlite_command(filename):
+@click.option('--resume', is_flag=True,
+              help='Keep the data and continue an interrupted import.')
+@click.option('--chunk-size', default=5000, show_default=True,
+              help='Rows written per transaction.')
+@click.option('--workers', type=int, default=None,
+              help='Password hashing processes, one per CPU by default.')
+def convert_csv_to_sqlite_command(filename, resume, chunk_size, workers):
     """
-    Helper function to convert
-    :param filename:
+    Helper function to convert a CSV export into the DB
+    :param filename: the CSV file
+    :param resume: continue from the last committed chunk
+    :param chunk_size: rows written per transaction
+    :param workers: number of password hashing processes
     :return: None
     """
-    convert_csv_to_sqlite(filename)
+    def progress(stats):
+        rate = (stats['rows'] - stats['resumed_at']) / (stats['seconds'] or 1)
+        print('{rows} rows imported ({0:.0f} rows/s)'.format(rate, **stats))
+
+    stats = convert_csv_to_sqlite(filename, resume, chunk_size, workers,
+                                  progress)
     print('Inserted ' + filename)
+    print('{users} users, {chats} chats and {messages} messages added, '
+          '{skipped} rows skipped'.format(**stats))
+
+
+@app.cli.command('gen_synthetic')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--chats', default=500, show_default=True)
+@click.option('--messages', default=100000, show_default=True)
+@click.option('--seed', default=0, show_default=True,
+              help='The same seed generates the same data.')
+@click.option('--zipf-s', default=1.1, show_default=True,
+              help='Exponent of the Zipf law of the chats\' popularity.')
+@click.option('--members', default=6, show_default=True,
+              help='Median number of members of a chat.')
+@click.option('--days', default=365, show_default=True,
+              help='The messages are sent over the days before --end-ms.')
+@click.option('--end-ms', default=SYNTHETIC_END_MS, show_default=True,
+              help='Time of the newest message, in ms since the epoch.')
+def gen_synthetic_command(users, chats, messages, seed, zipf_s, members,
+                          days, end_ms):
+    """
+    Helper function to recreate the DB filled with synthetic data
+    :param users: the number of users
+    :param chats: the number of chats
+    :param messages: the number of messages
+    :param seed: the seed of the random choices
+    :param zipf_s: the exponent of the chats' Zipf popularity
+    :param members: the median number of members of a chat
+    :param days: the number of days the messages span
+    :param end_ms: the time of the newest message
+    :return: None
+    """
+    def progress(stats):
+        rate = stats['messages'] / (stats['seconds'] or 1)
+        print('{messages} messages generated ({0:.0f} rows/s)'.format(
+            rate, **stats))
+
+    stats = generate_synthetic_data(users, chats, messages, seed, zipf_s,
+                                    members, days, end_ms,
+                                    progress=progress)
+    print('{users} users, {chats} chats, {chat_rels} memberships and '
+          '{messages} messages generated in {seconds:.1f} s'.format(**stats))
+    print('Every user (user1, user2, ...) has the password '
+          '"{}"'.format(SYNTHETIC_PASSWORD))
 
 
 @login_manager.user_loader
@@ -524,8 +865,16 @@ def login():
             # Get stored hash
             password_real = userdata['password']
 
-            # Compare Password entered to password saved in DB
-            if sha256_crypt.verify(password_entered, password_real):
+            # Compare Password entered to password saved in DB, in a worker
+            # process rather than this request thread
+            verified, new_hash = get_password_hasher().verify_and_update(
+                password_entered, password_real)
+
+            if verified:
+                if new_hash is not None:
+                    # stored under an older password policy, upgrade it
+                    update_user_password(userdata['id'], new_hash)
+
                 # yay! The passwords match
                 session['logged_in'] = True
                 session['username'] = username
@@ -599,22 +948,34 @@ def dashboard():
     Obtains the information to send to the dashboard.html such as info
     on the various chat rooms that the user is a part of.
 
+    The chats are listed by their last activity, DASHBOARD_PAGE_SIZE at a
+    time (the ?before= cursor pages through the less active ones), with
+    their newest message and message and member counts read from
+    chat_summary, and their number of messages after the user's read
+    watermark (see mark_read), up to UNREAD_COUNT_CAP. Answered with 304 Not
+    Modified while the users, chats, memberships, messages and the user's
+    watermarks are unchanged (see conditional_response).
+
     :return:
     """
+    user_id = get_user_id(session['username'])
+    before = request.args.get('before')
 
-    data = get_chat_rooms(get_user_id(session['username']))
+    def render_dashboard():
+        data, older = get_chat_rooms_page(
+            user_id, app.config['DASHBOARD_PAGE_SIZE'], before=before)
 
-    num_rows = 0
-    if data is not None:
-        num_rows = 1
+        if data:
+            return render_template('dashboard.html', chats=data,
+                                   older=older,
+                                   unread_cap=UNREAD_COUNT_CAP)
+        else:
+            msg = 'No active chats'
+            return render_template('dashboard.html', msg=msg)
 
-    if num_rows > 0:
-        return render_template('dashboard.html', chats=data)
-    else:
-        msg = 'No active chats'
-        return render_template('dashboard.html', msg=msg)
-    # Close connection
-    cur.close()
+    return conditional_response(['user', 'chat', 'chat_rel', 'message',
+                                 'read:user:{}'.format(user_id)],
+                                render_dashboard)
 
 
 ##############################################################################
@@ -629,29 +990,167 @@ def chat_room(id):
     on the chat room name, etc, the messages in the chat room, and a form
     to enter new messages.
 
+    The newest CHAT_PAGE_SIZE messages are shown, and showing them moves
+    the user's read watermark of the chat to the newest message; the
+    ?before= and ?after= cursors page through older and newer messages. A
+    GET is answered with 304 Not Modified while the chat, its members,
+    messages and read watermarks and the user names are unchanged (see
+    conditional_response).
+
     :param id: The chat room id
     :return: if GET or POST -- returns the chat_room.html
     """
-    data = get_messages_in_chatroom(id)
-    room_data = get_room_info(id)
-    participant_list = get_participants_in_chat(id)
-    participant_str = ", ".join(str(participant) for
-                                participant in participant_list)
-
     form = MessageForm(request.form)
-    if request.method == 'POST' and form.validate():
-        insert_message(message=form.message.data,
-                       time=get_date(),
-                       user_id=get_user_id(session['username']),
-                       chat_id=id)
+    before = request.args.get('before')
+    after = request.args.get('after')
+    user_id = get_user_id(session['username'])
+
+    if request.method == 'POST':
+        if form.validate():
+            insert_message(message=form.message.data,
+                           time=get_date(),
+                           user_id=user_id,
+                           chat_id=id,
+                           time_ms=now_ms())
+
+            # show the newest page, which holds the message just sent
+            mark_read(user_id, id)
+            return render_chat_room(id, form)
+
+        return render_chat_room(id, form, before, after)
+
+    # before the tag is computed, so the tag includes the move
+    if before is None and after is None:
+        mark_read(user_id, id)
+
+    return conditional_response(['chat:{}'.format(id), 'user',
+                                 'read:chat:{}'.format(id)],
+                                lambda: render_chat_room(id, form, before,
+                                                         after))
+
+
+def render_chat_room(id, form, before=None, after=None):
+    """
+    Renders one page of a chat room, loaded by load_chat_page.
+
+    :param id: The chat room id
+    :param form: the MessageForm
+    :param before: cursor token, show the messages older than it
+    :param after: cursor token, show the messages newer than it
+    :return: the rendered chat_room.html
+    """
+    page = load_chat_page(id, app.config['CHAT_PAGE_SIZE'], before=before,
+                          after=after)
+
+    if page is None:
+        raise RequestError(404, 'chat does not exist')
+
+    # the page's stream picks up after page['latest_id'], a message sent
+    # meanwhile may be both on the page and in the stream
+    return render_template('chat_room.html', page=page, form=form)
+
+
+@app.route('/chat_room/<string:id>/search')
+@is_logged_in
+def chat_room_search(id):
+    """
+    Shows the messages of a chat room matching the ?q= search box, best
+    match first, CHAT_PAGE_SIZE at a time.
+
+    :param id: The chat room id
+    :return: the rendered chat_search.html
+    """
+    text = request.args.get('q', '')
+    after = request.args.get('after')
+
+    results, next_cursor = [], None
+    if text.strip():
+        results, next_cursor = search_messages(
+            text, app.config['CHAT_PAGE_SIZE'], chat_id=id, after=after,
+            rank_window=app.config['SEARCH_RANK_WINDOW'])
+
+    return render_template('chat_search.html', q=text, results=results,
+                           next_cursor=next_cursor,
+                           title=get_chat_room_name(id))
+
+
+@app.route('/chat_room/<string:id>/read', methods=['POST'])
+@is_logged_in
+def chat_room_read(id):
+    """
+    Moves the user's read watermark of a chat to the message_id of the form,
+    sent by the open chat_room.html page for the messages it is streamed.
+
+    :param id: The chat room id
+    :return: an empty 204 response
+    """
+    try:
+        message_id = int(request.form.get('message_id', ''))
+    except ValueError:
+        raise RequestError(422, 'message_id must be an integer')
+
+    mark_read(get_user_id(session['username']), id, message_id)
+
+    return Response(status=204)
+
+
+@app.route('/chat_room/<int:id>/stream')
+@is_logged_in
+def chat_room_stream(id):
+    """
+    Server-Sent Events stream of the new messages of a chat room, which the
+    open chat_room.html page appends to its table.
+
+    Each event is one message as JSON, with the message id as the event id.
+    The stream starts after the Last-Event-ID header (sent by a reconnecting
+    EventSource) or the ?last_id= argument, so whatever was missed is
+    replayed first, or else after the newest message of the chat. While the
+    chat is quiet the stream sleeps (see events.py) and only sends a
+    keep-alive comment every SSE_KEEPALIVE seconds.
+
+    :param id: The chat room id
+    :return: a text/event-stream response
+    """
+    last_id = request.headers.get('Last-Event-ID',
+                                  request.args.get('last_id'))
+
+    if last_id is None:
+        last_id = get_latest_message_id(id)
+    else:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            raise RequestError(422, 'invalid Last-Event-ID')
+
+    broker = get_message_broker()
+    keepalive = app.config['SSE_KEEPALIVE']
+    batch_size = app.config['SSE_BATCH_SIZE']
+
+    # a stream stays open for a long time, it must not keep a pooled
+    # connection; each read below borrows one just for the query
+    close_db()
+
+    def events(last_id):
+        yield 'retry: 3000\n\n'
+
+        while True:
+            with app.app_context():
+                rows = get_messages_after(id, last_id, batch_size)
+
+            for row in rows:
+                last_id = row['id']
+                yield 'id: {}\nevent: message\ndata: {}\n\n'.format(
+                    row['id'], json.dumps(row))
 
-        data = get_messages_in_chatroom(id)
+            if len(rows) == batch_size:
+                continue  # more to replay
 
-        return render_template('chat_room.html', names=participant_str,
-                               room=room_data, chat_room=data, form=form)
+            if not broker.wait(id, last_id, keepalive):
+                yield ': keep-alive\n\n'
 
-    return render_template('chat_room.html', names=participant_str,
-                           room=room_data, chat_room=data, form=form)
+    return Response(events(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
 
 
 # Add chat room
@@ -713,6 +1212,146 @@ def delete_chat(id):
     return redirect(url_for('dashboard'))
 
 
+# Read watermarks of a chat
+@app.route('/api/chat/<int:id>/read', methods=['GET', 'POST'])
+def chat_read(id):
+    """
+    Returns the read watermarks of the members of a chat, or moves one
+    member's watermark forward. See GET and POST /chat/:id/read above.
+
+    :param id: The chat room id
+    :return: JSON response
+    """
+    if request.method == 'GET':
+        return jsonify(get_read_receipts(id))
+
+    if 'user_id' not in request.form:
+        raise RequestError(422, 'user_id required')
+
+    try:
+        user_id = int(request.form['user_id'])
+        message_id = request.form.get('message_id')
+        if message_id is not None:
+            message_id = int(message_id)
+    except ValueError:
+        raise RequestError(422, 'user_id and message_id must be integers')
+
+    last_read_id = mark_read(user_id, id, message_id)
+
+    if last_read_id is None:
+        raise RequestError(404, 'user is not in the chat')
+
+    return jsonify({'chat_id': id, 'user_id': user_id,
+                    'last_read_id': last_read_id})
+
+
+# Full-text search of the messages
+@app.route('/api/message/search')
+def message_search():
+    """
+    Returns a page of the messages matching ?q=, best match first. See
+    GET /message/search above.
+
+    :return: JSON response
+    """
+    limit = get_page_limit()
+    after = request.args.get('after')
+    text = request.args.get('q', '')
+    chat_id = get_int_arg('chat_id', None)
+
+    results, next_cursor = search_messages(
+        text, limit, chat_id, after,
+        rank_window=app.config['SEARCH_RANK_WINDOW'])
+
+    response = jsonify(results)
+
+    if next_cursor is not None:
+        query = {'q': text, 'limit': limit, 'after': next_cursor}
+        if chat_id is not None:
+            query['chat_id'] = chat_id
+
+        next_url = '{}?{}'.format(request.base_url, urlencode(query))
+
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+
+    return response
+
+
+# Delta sync of a chat's messages
+@app.route('/api/chat/<int:id>/messages')
+def chat_messages(id):
+    """
+    Returns the messages of a chat newer than ?since_id= (or ?since_time=),
+    with the watermark to ask for next. See GET /chat/:id/messages above.
+
+    :param id: The chat room id
+    :return: JSON response
+    """
+    limit = get_page_limit()
+    since_id = get_int_arg('since_id', 0)
+    since_time = get_int_arg('since_time', None)
+    wait = min(get_int_arg('wait', 0), app.config['DELTA_MAX_WAIT'])
+
+    if since_time is not None:
+        rows = get_messages_after_time(id, since_time, limit + 1)
+    else:
+        rows = get_messages_after(id, since_id, limit + 1)
+
+    if not rows and wait > 0:
+        if since_time is not None:
+            since_id = get_latest_message_id(id)
+            since_time = None
+
+        # don't hold a pooled connection while sleeping
+        close_db()
+
+        if get_message_broker().wait(id, since_id, wait):
+            rows = get_messages_after(id, since_id, limit + 1)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    if rows:
+        next_since = max(row['id'] for row in rows)
+    elif since_time is not None:
+        next_since = get_latest_message_id(id)
+    else:
+        next_since = since_id
+
+    return jsonify({'messages': rows, 'next_since': next_since,
+                    'more': more})
+
+
+# Runtime statistics
+@app.route('/api/metrics/')
+def metrics():
+    """
+    Reports the runtime statistics of this process: the usage of the
+    database connection pools, the password hashing queue, the chat room
+    streams, the query cache and the group-commit writers.
+
+    :return: JSON response
+    """
+    stats = {'db_pool': get_db_pool().stats(),
+             'password_hashing': get_password_hasher().stats(),
+             'events': get_message_broker().stats(),
+             'query_cache': get_query_cache().stats()}
+
+    router = get_shard_router()
+    if router.is_sharded:
+        stats['shard_pools'] = router.stats()[1:]
+
+    # chat shard + 1 is in shard, so this is one writer per shard
+    writers = [get_group_commit_writer(shard + 1)
+               for shard in range(router.shards)]
+    if writers[0] is not None:
+        stats['group_commit'] = writers[0].stats() if len(writers) == 1 \
+            else [writer.stats() for writer in writers]
+
+    return jsonify(stats)
+
+
 ##############################################################################
 
 @app.errorhandler(RequestError)
@@ -0,0 +1,302 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the hot/cold archive of the messages.
+
+Almost every read is of recent messages, yet every message ever sent stays in
+the message table, its indexes and its full-text index. archive_messages()
+moves the messages older than a cutoff into one SQLite file per period (a
+year or a month of messages), next to the database file:
+
+    WooMessages.sqlite              the recent ("hot") messages
+    WooMessages-2017.sqlite         the messages of 2017
+    WooMessages-2018.sqlite         ...
+
+Each archive file holds a message table with the columns and indexes of the
+live one, and its own message_fts index. The message_archive table (see
+migrations.py) catalogs the files. attach_archives() ATTACHes them to a
+connection and creates message_history, a TEMP view of the UNION ALL of the
+live and archived messages, which SQLite reads with a merge of the index
+scans of every file; the chat pages and the search read through it.
+
+The messages of a batch are copied into the archive and committed there
+before they are deleted from the live database (two transactions, since a
+transaction over several WAL databases is not atomic as a whole). A crash in
+between leaves a batch in both files; running the job again skips the
+copies already archived and finishes the deletes.
+
+Archived messages are read only: they are no longer changed or deleted by
+the message functions of the app.
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+from exception_classes import *
+from timestamps import now_ms, to_time_ms
+
+ARCHIVE_BATCH_SIZE = 10000
+
+# the columns of the message table, in order
+MESSAGE_COLUMNS = 'id, message, time, user_id, chat_id, time_ms'
+
+# the schema of an archive file, attached as {schema}
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS {schema}.message (
+        id INTEGER PRIMARY KEY,
+        message TEXT,
+        time TEXT,
+        user_id INTEGER,
+        chat_id INTEGER,
+        time_ms INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS {schema}.message_chat_time_ms
+    ON message(chat_id, time_ms);
+    CREATE INDEX IF NOT EXISTS {schema}.message_chat_id
+    ON message(chat_id, id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.message_fts USING fts5(
+        message, content='message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+'''
+
+# the catalogued archives, with whether the connection has them attached
+ARCHIVES_QUERY = '''
+    SELECT schema_name, path,
+    schema_name IN (SELECT name FROM pragma_database_list)
+    FROM message_archive ORDER BY period
+'''
+
+
+def period_bounds(time_ms, period):
+    """
+    :param time_ms: milliseconds since the epoch
+    :param period: 'year' or 'month'
+    :return: tuple of the name of the period holding time_ms ('2018' or
+    '2018-04') and its first and last-plus-one milliseconds
+    """
+    moment = datetime.datetime.fromtimestamp(time_ms / 1000)
+
+    if period == 'year':
+        start = datetime.datetime(moment.year, 1, 1)
+        end = datetime.datetime(moment.year + 1, 1, 1)
+        name = start.strftime('%Y')
+    elif period == 'month':
+        start = datetime.datetime(moment.year, moment.month, 1)
+        end = datetime.datetime(moment.year + moment.month // 12,
+                                moment.month % 12 + 1, 1)
+        name = start.strftime('%Y-%m')
+    else:
+        raise RequestError(422, 'period must be year or month')
+
+    return name, to_time_ms(start), to_time_ms(end)
+
+
+def get_schema_name(period):
+    """
+    :param period: the name of a period, e.g. '2018-04'
+    :return: the schema name its archive file is attached under
+    """
+    return 'archive_' + re.sub(r'\W', '_', period)
+
+
+def get_database_directory(conn):
+    """
+    :param conn: sqlite connection
+    :return: the directory of the connection's main database file
+    """
+    for _, name, path in conn.execute('PRAGMA database_list'):
+        if name == 'main':
+            return os.path.dirname(path)
+
+
+def _create_history_view(conn, schemas):
+    """
+    (Re)creates the connection's message_history view over the live
+    messages and the messages of the attached archives.
+
+    :param conn: sqlite connection to the live database
+    :param schemas: the schema names of the archives
+    :return: None
+    """
+    conn.execute('DROP VIEW IF EXISTS temp.message_history')
+    conn.execute('CREATE TEMP VIEW message_history AS ' + ' UNION ALL '.join(
+        'SELECT {} FROM {}.message'.format(MESSAGE_COLUMNS, schema)
+        for schema in ['main'] + schemas))
+
+
+def attach_archives(conn):
+    """
+    Attaches the catalogued archive files that the connection does not have
+    attached yet, and then (re)creates its message_history view. It must
+    not be called inside a transaction.
+
+    One statement when every archive is attached already, so the readers
+    call it before each read.
+
+    :param conn: sqlite connection to the live database
+    :return: list of the schema names of the archives, oldest first. When
+    it is empty there is no message_history view, read the message table.
+    """
+    archives = conn.execute(ARCHIVES_QUERY).fetchall()
+    schemas = [schema for schema, _, _ in archives]
+    missing = [(schema, path) for schema, path, attached in archives
+               if not attached]
+
+    if missing:
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(archives) > limit:
+            raise RequestError(500, 'a connection can attach {} archive '
+                                    'files, not {}'.format(limit,
+                                                           len(archives)))
+
+        directory = get_database_directory(conn)
+        for schema, path in missing:
+            conn.execute('ATTACH DATABASE ? AS {}'.format(schema),
+                         (os.path.join(directory, path),))
+
+        _create_history_view(conn, schemas)
+
+    return schemas
+
+
+def create_archive(conn, period):
+    """
+    Attaches the archive file of a period, first creating and cataloguing it
+    if it does not exist yet.
+
+    :param conn: sqlite connection to the live database
+    :param period: the name of the period
+    :return: the schema name of the archive
+    """
+    schema = get_schema_name(period)
+    schemas = attach_archives(conn)
+
+    if schema in schemas:
+        return schema
+
+    main_file = conn.execute('PRAGMA database_list').fetchone()[2]
+    path = '{}-{}.sqlite'.format(
+        os.path.splitext(os.path.basename(main_file))[0], period)
+
+    # the message table must exist before the view reads it
+    conn.execute('ATTACH DATABASE ? AS {}'.format(schema),
+                 (os.path.join(os.path.dirname(main_file), path),))
+    conn.executescript(ARCHIVE_SCHEMA.format(schema=schema))
+    conn.execute('INSERT INTO message_archive(period, path, schema_name) '
+                 'VALUES (?, ?, ?)', (period, path, schema))
+    conn.commit()
+
+    _create_history_view(conn, attach_archives(conn))
+
+    return schema
+
+
+def _archive_batch(conn, schema, ids):
+    """
+    Moves messages into an archive: copies them and their full-text entries
+    and commits the archive, then deletes them from the live database and
+    puts back the chat summaries of their chats, which the delete triggers
+    would otherwise lower.
+
+    :param conn: sqlite connection to the live database
+    :param schema: the schema name of the archive
+    :param ids: the ids of the messages
+    :return: the number of messages deleted from the live database
+    """
+    batch = json.dumps(ids)
+    in_batch = 'id IN (SELECT value FROM json_each(?))'
+
+    # the messages already archived by an interrupted run are indexed
+    conn.execute('''
+        INSERT INTO {schema}.message_fts(rowid, message)
+        SELECT id, message FROM main.message
+        WHERE {batch} AND id NOT IN (SELECT id FROM {schema}.message)
+    '''.format(schema=schema, batch=in_batch), (batch,))
+    conn.execute('''
+        INSERT OR IGNORE INTO {schema}.message
+        SELECT {columns} FROM main.message WHERE {batch}
+    '''.format(schema=schema, columns=MESSAGE_COLUMNS, batch=in_batch),
+        (batch,))
+    conn.commit()
+
+    # no message can be added to the chats between the copy and the restore
+    # of their summaries
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('DROP TABLE IF EXISTS temp.archived_summary')
+    conn.execute('''
+        CREATE TEMP TABLE archived_summary AS SELECT * FROM chat_summary
+        WHERE chat_id IN (SELECT chat_id FROM main.message WHERE {})
+    '''.format(in_batch), (batch,))
+    # the ids of the batch are not given again once it is deleted
+    conn.execute('''
+        INSERT INTO main.id_high_water(table_name, high)
+        SELECT 'message', max(id) FROM main.message WHERE true
+        ON CONFLICT(table_name) DO UPDATE
+        SET high = max(high, excluded.high)
+    ''')
+    deleted = conn.execute('''
+        DELETE FROM main.message
+        WHERE {batch} AND id IN (SELECT id FROM {schema}.message)
+    '''.format(schema=schema, batch=in_batch), (batch,)).rowcount
+    conn.execute('INSERT OR REPLACE INTO chat_summary '
+                 'SELECT * FROM temp.archived_summary')
+    conn.execute('DROP TABLE temp.archived_summary')
+
+    conn.execute('''
+        UPDATE message_archive SET message_count = message_count + ?,
+        first_time_ms = (SELECT min(time_ms) FROM {schema}.message),
+        last_time_ms = (SELECT max(time_ms) FROM {schema}.message),
+        archived_ms = ?
+        WHERE schema_name = ?
+    '''.format(schema=schema), (deleted, now_ms(), schema))
+    conn.commit()
+
+    return deleted
+
+
+def archive_messages(conn, cutoff_ms, period='year',
+                     batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Moves the messages sent before cutoff_ms into the archive file of their
+    period, batch_size messages per transaction.
+
+    :param conn: sqlite connection to the live database
+    :param cutoff_ms: the messages with a smaller time_ms are archived
+    :param period: 'year' or 'month', the time span of an archive file
+    :param batch_size: the number of messages moved per transaction
+    :return: dictionary of the number of messages archived per period
+    """
+    conn.commit()
+    archives = {}
+    archived = {}
+
+    while True:
+        oldest = conn.execute('SELECT min(time_ms) FROM main.message '
+                              'WHERE time_ms < ?', (cutoff_ms,)).fetchone()[0]
+        if oldest is None:
+            break
+
+        name, start, end = period_bounds(oldest, period)
+        if name not in archives:
+            archives[name] = create_archive(conn, name)
+        schema = archives[name]
+
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM main.message WHERE time_ms >= ? AND time_ms < ? '
+            'ORDER BY time_ms LIMIT ?',
+            (start, min(end, cutoff_ms), batch_size))]
+
+        deleted = _archive_batch(conn, schema, ids)
+        if not deleted:
+            raise RequestError(500, 'messages could not be archived in '
+                                    '{}'.format(schema))
+
+        archived[name] = archived.get(name, 0) + deleted
+
+    return archived
@@ -0,0 +1,173 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing AsyncWooMessageDB, the asyncio facade of WooMessageDB.
+
+sqlite3 calls block, so an asyncio server that made them on its event loop
+would stall every connection it holds while one query runs. The facade runs
+them on a dedicated thread pool instead, with as many threads as the
+database has pooled connections: at most pool_size statements run at once
+and the others wait in the executor's queue, not in a thread of their own.
+Each call borrows a connection for its own duration and gives it back, so
+an idle client (a long poll, an open stream) holds no thread and no
+connection, only its coroutine.
+
+    async def main():
+        async with AsyncWooMessageDB('WooMessages.sqlite') as db:
+            chat = await db.insert_chat('Hello', get_date())
+            async for message in db.iter_rows('message'):
+                ...
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+from database_class import WooMessageDB
+from exception_classes import *
+
+# the rows fetched per round trip to the executor by iter_rows
+ITER_BATCH_SIZE = 500
+
+# the WooMessageDB methods AsyncWooMessageDB has awaitable versions of
+ASYNC_METHODS = (
+    'insert_user', 'insert_message', 'insert_chat', 'insert_chat_rel',
+    'insert_chat_room', 'insert_table_info',
+    'update_message', 'update_user', 'update_chat',
+    'delete_user_from_chat', 'delete_item',
+    'query_by_id', 'get_all_rows', 'get_rows_after', 'get_user_by_username',
+    'get_user_id', 'get_messages_in_chatroom', 'get_chat_room_name',
+    'get_chat_rooms', 'get_participants_in_chat', 'get_room_info',
+    'check_chat', 'check_chat_rel', 'migrate',
+)
+
+
+class AsyncWooMessageDB:
+    """
+    The awaitable methods of a WooMessageDB. Every method of ASYNC_METHODS
+    takes the arguments of its WooMessageDB namesake and returns a
+    coroutine of its result.
+    """
+
+    def __init__(self, filename, pool_size=4, storage_profile=None,
+                 shards=1):
+        """
+        Opens the database like WooMessageDB, creating or upgrading the file
+        (this blocks, so do it before the event loop serves clients), and
+        starts the executor.
+
+        :param filename: the database file name
+        :param pool_size: the maximum number of open connections, and of
+        queries running at once
+        :param storage_profile: dictionary of PRAGMAs for the connections,
+        e.g. connection_pool.WAL_PROFILE
+        :param shards: the number of shards the database is split into
+        :return: None
+        """
+        self._db = WooMessageDB(filename, pool_size, storage_profile, shards)
+        self._db.close()  # the connection the constructor borrowed
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix='woomessages-db')
+        self._closed = False
+
+    def _call(self, method, args, kwargs):
+        """
+        Runs a WooMessageDB method on an executor thread, then gives the
+        thread's connections back to the pools.
+        """
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._db.close()
+
+    async def _run(self, name, *args, **kwargs):
+        """
+        :param name: the name of a WooMessageDB method
+        :return: the method's result, computed on the executor
+        """
+        if self._closed:
+            raise RequestError(500, 'the database is closed')
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(
+                self._call, getattr(self._db, name), args, kwargs))
+
+    async def iter_rows(self, table_name, batch_size=ITER_BATCH_SIZE,
+                        as_records=False):
+        """
+        Iterates over all of the rows of a table, in id order, fetching
+        batch_size of them per query (see WooMessageDB.get_rows_after), so
+        that only one batch is held in memory and no connection is held
+        while the caller awaits.
+
+            async for row in db.iter_rows('message'):
+                ...
+
+        :param table_name: name of the table
+        :param batch_size: number of rows fetched at a time
+        :param as_records: yield the rows as their model (see
+        table_classes.py)
+        :return: async generator of dictionaries representing the rows
+        """
+        after_id = 0
+
+        while True:
+            rows = await self._run('get_rows_after', table_name, after_id,
+                                   batch_size, as_records)
+
+            for row in rows:
+                yield row
+
+            if len(rows) < batch_size:
+                break
+
+            after_id = rows[-1].id if as_records else rows[-1]['id']
+
+    def pool_stats(self):
+        """
+        Returns the usage statistics of the connection pool.
+
+        :return: a dictionary of the pool's counters
+        """
+        return self._db.pool_stats()
+
+    async def close(self):
+        """
+        Waits for the queued calls to finish and stops the executor. Later
+        calls raise a RequestError.
+
+        :return: None
+        """
+        self._closed = True
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def _awaitable(name):
+    """
+    :param name: the name of a WooMessageDB method
+    :return: the AsyncWooMessageDB method running it on the executor
+    """
+    async def method(self, *args, **kwargs):
+        return await self._run(name, *args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = 'Awaitable WooMessageDB.{}, see its docstring.'.format(
+        name)
+
+    return method
+
+
+for _name in ASYNC_METHODS:
+    setattr(AsyncWooMessageDB, _name, _awaitable(_name))
@@ -0,0 +1,11 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Benchmarks for the WooMessages database layer. Run them from the repository
+root, e.g.
+
+$ python3 -m benchmarks.bench_storage_profile
+"""
@@ -0,0 +1,137 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures the cost of loading one chat_room page with separate lookups and
+with load_chat_page.
+
+The separate lookups are the reads the chat_room view used to make
+(get_room_info, get_participants_in_chat, get_latest_message_id and
+get_message_page), with the query cache off so that every page reads the
+database like a cold cache does.
+
+Normal use:
+$ python3 -m benchmarks.bench_chat_page --members 20 --messages 5000
+loader       pages/s    ms/page    statements/page    KB peak/page
+---------  ---------  ---------  -----------------  --------------
+separate       ...
+single         ...
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import tabulate
+import app_main
+
+
+def create_database(members, messages):
+    """
+    Fills the app's database with one chat, its members and messages.
+
+    :param members: number of users in the chat
+    :param messages: number of messages in the chat
+    """
+    app_main.init_db()
+    conn = app_main.get_db()
+    conn.executemany('INSERT INTO user(name, email, username, password) '
+                     'VALUES (?, ?, ?, ?)',
+                     [('user {}'.format(i), '{}@w.edu'.format(i),
+                       'user{}'.format(i), 'x') for i in range(members)])
+    conn.execute("INSERT INTO chat(title, time, time_ms) "
+                 "VALUES ('bench', '', 0)")
+    conn.executemany('INSERT INTO chat_rel(user_id, chat_id) VALUES (?, 1)',
+                     [(i + 1,) for i in range(members)])
+    conn.executemany('INSERT INTO message(message, time, user_id, chat_id, '
+                     'time_ms) VALUES (?, ?, ?, 1, ?)',
+                     [('hello {}'.format(i), '', 1 + i % members, i)
+                      for i in range(messages)])
+    conn.commit()
+
+
+def load_separately(limit):
+    """
+    :param limit: messages per page
+    :return: the page's data, read with one function per part
+    """
+    room = app_main.get_room_info(1)
+    participants = app_main.get_participants_in_chat(1)
+    latest_id = app_main.get_latest_message_id(1)
+    page = app_main.get_message_page(1, limit)
+
+    return room, participants, latest_id, page
+
+
+def load_single(limit):
+    """
+    :param limit: messages per page
+    :return: the page's data, read with load_chat_page
+    """
+    return app_main.load_chat_page(1, limit)
+
+
+def measure(load, limit, pages):
+    """
+    Loads the page repeatedly, then once more under tracemalloc.
+
+    :return: dictionary with the page rate, latency, statements and
+    peak memory of one page
+    """
+    conn = app_main.get_db()
+    statements = []
+
+    start = time.perf_counter()
+    for _ in range(pages):
+        load(limit)
+    elapsed = time.perf_counter() - start
+
+    conn.set_trace_callback(statements.append)
+    tracemalloc.start()
+    load(limit)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    conn.set_trace_callback(None)
+
+    return {
+        'pages/s': round(pages / elapsed),
+        'ms/page': round(elapsed * 1000 / pages, 3),
+        'statements/page': len(statements),
+        'KB peak/page': round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=2000)
+    args = parser.parse_args()
+
+    app_main.app.config['QUERY_CACHE'] = False
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        app_main.app.config['DATABASE'] = os.path.join(directory,
+                                                       'bench.sqlite')
+
+        with app_main.app.app_context():
+            create_database(args.members, args.messages)
+
+            for name, load in (('separate', load_separately),
+                               ('single', load_single)):
+                result = measure(load, args.limit, args.pages)
+                results.append(dict(loader=name, **result))
+
+            app_main.close_db()
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures message insert throughput with one commit per insert against the
+group-commit writer.
+
+Sender threads insert messages like insert_message for a fixed number of
+seconds, either each committing on its own pooled connection or through one
+shared GroupCommitWriter. Group commit pays off when a commit has to wait
+for the disk, so the WAL profile is run with synchronous=FULL by default.
+
+Normal use:
+$ python3 -m benchmarks.bench_group_commit --senders 50
+mode            inserts/s    p50 ms    p99 ms    avg batch    errors
+------------  -----------  --------  --------  -----------  --------
+per-insert          ...
+group-commit        ...
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tabulate
+from benchmarks.bench_storage_profile import create_database, percentile
+from connection_pool import ConnectionPool, WAL_PROFILE
+from group_commit import GroupCommitWriter
+from database_class import insert_message_row
+
+
+def run_mode(path, group_commit, senders, seconds, window, pragmas):
+    """
+    Runs the sender threads against a database in one mode.
+
+    :return: dictionary with the insert rate, latencies and batch size
+    """
+    pool = ConnectionPool(path, max_size=senders,
+                          pragmas=pragmas)
+    writer = None
+    if group_commit:
+        writer = GroupCommitWriter(path, pragmas, window=window)
+
+    stop = time.monotonic() + seconds
+    times = []
+    errors = []
+
+    def sender(chat_id):
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            args = ('bench', '', 1, chat_id, int(time.time() * 1000))
+            try:
+                if writer is not None:
+                    writer.submit(insert_message_row, *args).result()
+                else:
+                    with pool.connection() as conn:
+                        insert_message_row(conn.cursor(), *args)
+                        conn.commit()
+            except Exception as error:
+                errors.append(error)
+            times.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=sender, args=(1 + i % 10,))
+               for i in range(senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    average_batch = 1.0
+    if writer is not None:
+        average_batch = writer.stats()['average_batch']
+        writer.close()
+    pool.close()
+
+    return {
+        'inserts/s': round(len(times) / seconds),
+        'p50 ms': round(percentile(times, 0.5) * 1000, 2),
+        'p99 ms': round(percentile(times, 0.99) * 1000, 2),
+        'avg batch': average_batch,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--senders', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--window', type=float, default=0.002)
+    parser.add_argument('--synchronous', default='FULL',
+                        choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    pragmas = tuple(dict(WAL_PROFILE, synchronous=args.synchronous).items())
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, group_commit in (('per-insert', False),
+                                   ('group-commit', True)):
+            path = os.path.join(directory, name + '.sqlite')
+            create_database(path, 10, 1000)
+
+            result = run_mode(path, group_commit, args.senders, args.seconds,
+                              args.window, pragmas)
+            results.append(dict(mode=name, **result))
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures the latency of the main routes of the app on generated databases
+of 10K, 1M and 10M messages, and compares it with a stored baseline.
+
+Each route is requested through app.test_client() as a logged-in user who
+is a member of many chats: the dashboard, the busiest chat room, the first
+page of /api/message/ and a login (which verifies a password hash at the
+configured PASSWORD_HASH_ROUNDS). For each route and scale the suite
+reports the p50/p95/p99 latency, the SQL statements run per request on any
+pooled connection (global or shard) and the peak Python memory of one
+request (tracemalloc). Every route is requested once before it is measured,
+so the statement counts are those of warm caches: lookups served by the
+query cache only read its version counters.
+
+The results are written as JSON (--output). With --baseline they are
+compared with an earlier run: a route regresses when its median latency
+(by more than --min-delta-ms too) or its peak memory grew by more than
+--tolerance, or it runs more statements. The exit status is 1 when a route
+regressed, so the suite can gate a change.
+--save-baseline stores this run as the new baseline. Latencies depend on
+the machine, so compare runs of the same machine.
+
+The generated databases take a while at 1M and 10M messages; with
+--data-dir they are kept and reused by later runs.
+
+Normal use:
+$ python3 -m benchmarks.bench_routes --scale 10k 1m --output routes.json \\
+      --baseline benchmarks/bench_routes_baseline.json
+scale    route              p50 ms    p95 ms  ...    KB peak  baseline
+-------  ---------------  --------  --------  ...  ---------  ----------
+10k      GET /dashboard       ...
+...
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import tabulate
+import app_main
+from benchmarks.bench_storage_profile import percentile
+from connection_pool import trace_statements
+from migrations import migrate
+from password_hashing import hash_password
+
+# messages in the database of each scale
+SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__),
+                                'bench_routes_baseline.json')
+
+# the password of the benchmark user, user 1 (username user0)
+PASSWORD = 'bench'
+
+# rows per INSERT transaction when a database is generated
+BATCH_SIZE = 100000
+
+
+def create_database(path, messages, seed=0):
+    """
+    Generates a database: one user per 1000 messages and one chat per 500
+    (at least 10 of each), a few members per chat, user 1 in the first 100
+    chats, and messages skewed towards the low chat ids, one second apart.
+
+    :param path: the database file name
+    :param messages: the number of messages
+    :param seed: the seed of the random choices
+    :return: None
+    """
+    chooser = random.Random(seed)
+    users = max(10, messages // 1000)
+    chats = max(10, messages // 500)
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    migrate(conn)
+
+    conn.executemany('INSERT INTO user(name, email, username, password) '
+                     'VALUES (?, ?, ?, ?)',
+                     [('user {}'.format(i), '{}@w.edu'.format(i),
+                       'user{}'.format(i), 'x') for i in range(users)])
+    conn.executemany('INSERT INTO chat(title, time, time_ms) '
+                     'VALUES (?, ?, ?)',
+                     [('chat {}'.format(i), '', i) for i in range(chats)])
+
+    members = {(1, chat_id) for chat_id in range(1, min(chats, 100) + 1)}
+    for chat_id in range(1, chats + 1):
+        for _ in range(chooser.randint(2, 10)):
+            members.add((chooser.randint(1, users), chat_id))
+    conn.executemany('INSERT INTO chat_rel(user_id, chat_id) VALUES (?, ?)',
+                     sorted(members))
+    conn.commit()
+
+    start_ms = 1500000000000
+    for first in range(0, messages, BATCH_SIZE):
+        conn.executemany(
+            'INSERT INTO message(message, time, user_id, chat_id, time_ms) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [('hello from message {}'.format(i), '',
+              chooser.randint(1, users),
+              1 + int(chats * chooser.random() ** 3),
+              start_ms + i * 1000)
+             for i in range(first, min(first + BATCH_SIZE, messages))])
+        conn.commit()
+
+    conn.close()
+
+
+def prepare_database(directory, scale):
+    """
+    Returns the database of a scale in a directory, generating it unless it
+    is there already, and gives user 1 the password PASSWORD.
+
+    :return: the database file name
+    """
+    path = os.path.join(directory, 'routes-{}.sqlite'.format(scale))
+
+    complete = False
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            complete = conn.execute('SELECT count(*) FROM message'
+                                    ).fetchone()[0] == SCALES[scale]
+        except sqlite3.Error:
+            pass
+        conn.close()
+
+    if not complete:
+        if os.path.exists(path):
+            os.remove(path)
+        print('Generating {} messages...'.format(scale), file=sys.stderr)
+        create_database(path, SCALES[scale])
+
+    app_main.app.config['DATABASE'] = path
+    with app_main.app.app_context():
+        app_main.migrate_db()
+        app_main.update_user_password(1, hash_password(
+            PASSWORD, app_main.get_password_settings()))
+
+    return path
+
+
+def get_routes(login_requests):
+    """
+    :param login_requests: the number of login requests
+    :return: list of (name, function(client) making one request, number of
+    requests or None for --requests)
+    """
+    return [
+        ('GET /dashboard', lambda client: client.get('/dashboard'), None),
+        ('GET /chat_room/1/', lambda client: client.get('/chat_room/1/'),
+         None),
+        ('GET /api/message/', lambda client: client.get('/api/message/'),
+         None),
+        ('POST /login', lambda client: client.post('/login', data={
+            'username': 'user0', 'password': PASSWORD}), login_requests),
+    ]
+
+
+def measure(client, request, count, statements):
+    """
+    Makes a request count times, then once more under tracemalloc.
+
+    :return: dictionary with the latency percentiles, statements and peak
+    memory of one request
+    """
+    request(client)  # warm up the caches and the hashing processes
+
+    times = []
+    del statements[:]
+    for _ in range(count):
+        start = time.perf_counter()
+        response = request(client)
+        times.append(time.perf_counter() - start)
+
+        if response.status_code >= 400:
+            raise RuntimeError('{} answered {}'.format(request,
+                                                       response.status_code))
+    queries = len(statements) / count
+
+    tracemalloc.start()
+    request(client)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'p50 ms': round(percentile(times, 0.5) * 1000, 3),
+        'p95 ms': round(percentile(times, 0.95) * 1000, 3),
+        'p99 ms': round(percentile(times, 0.99) * 1000, 3),
+        'queries': round(queries, 1),
+        'KB peak': round(peak / 1024, 1),
+    }
+
+
+def compare(result, baseline, tolerance, min_delta_ms):
+    """
+    :param result: the measurements of a route
+    :param baseline: the baseline measurements of the route, or None
+    :param tolerance: the allowed relative growth, e.g. 0.25
+    :param min_delta_ms: latency growth below this is noise, whatever its
+    relative size
+    :return: tuple of whether the route regressed and a short description
+    """
+    if baseline is None:
+        return False, 'new'
+
+    def growth(key):
+        return result[key] / max(baseline[key], 1e-9) - 1
+
+    problems = []
+    # the median, the tail of a few hundred requests is too noisy to gate
+    if growth('p50 ms') > tolerance and \
+            result['p50 ms'] - baseline['p50 ms'] > min_delta_ms:
+        problems.append('p50 ms {:+.0%}'.format(growth('p50 ms')))
+    if growth('KB peak') > tolerance:
+        problems.append('KB peak {:+.0%}'.format(growth('KB peak')))
+    if result['queries'] > baseline['queries']:
+        problems.append('queries {} > {}'.format(result['queries'],
+                                                 baseline['queries']))
+
+    if problems:
+        return True, 'REGRESSION ' + ', '.join(problems)
+
+    return False, 'ok ({:+.0%} p50, {:+.0%} p95)'.format(growth('p50 ms'),
+                                                        growth('p95 ms'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scale', nargs='+', default=['10k'],
+                        choices=list(SCALES))
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--login-requests', type=int, default=20)
+    parser.add_argument('--data-dir', default=None,
+                        help='keep the generated databases here')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='compare with the results in this JSON file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the baseline '
+                             '(default file {})'.format(DEFAULT_BASELINE))
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-delta-ms', type=float, default=0.5)
+    args = parser.parse_args()
+
+    app_main.app.testing = True
+    statements = []
+    trace_statements(statements.append)
+
+    baseline = {}
+    if args.baseline is not None and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    elif args.baseline is not None and not args.save_baseline:
+        parser.error('{} does not exist'.format(args.baseline))
+
+    results = {}
+    table = []
+    regressed = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        data_dir = args.data_dir or directory
+
+        for scale in args.scale:
+            prepare_database(data_dir, scale)
+
+            client = app_main.app.test_client()
+            with client.session_transaction() as session:
+                session['logged_in'] = True
+                session['username'] = 'user0'
+
+            results[scale] = {}
+            for name, request, count in get_routes(args.login_requests):
+                result = measure(client, request, count or args.requests,
+                                 statements)
+                results[scale][name] = result
+
+                failed, verdict = compare(
+                    result, baseline.get(scale, {}).get(name),
+                    args.tolerance, args.min_delta_ms)
+                regressed = regressed or failed
+                table.append([scale, name] + list(result.values()) +
+                             [verdict if args.baseline else ''])
+
+    print(tabulate.tabulate(table, ['scale', 'route', 'p50 ms', 'p95 ms',
+                                    'p99 ms', 'queries (warm)', 'KB peak',
+                                    'baseline']))
+
+    report = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'requests': args.requests,
+            'queries': 'statements per request, with warm caches',
+        },
+        'results': results,
+    }
+
+    paths = [args.output] if args.output else []
+    if args.save_baseline:
+        paths.append(args.baseline or DEFAULT_BASELINE)
+
+    for path in paths:
+        with open(path, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures the memory held by the result of get_messages_in_chatroom,
+get_chat_rooms and get_participants_in_chat, per row, with the old
+OrderedDict of sqlite3.Row lists and with the current lists of records.
+
+Normal use:
+$ python3 -m benchmarks.bench_row_memory --messages 20000
+query                       rows    old bytes/row    new bytes/row
+------------------------  ------  ---------------  ---------------
+get_messages_in_chatroom     ...
+get_chat_rooms               ...
+get_participants_in_chat     ...
+"""
+
+import argparse
+import collections
+import os
+import tempfile
+import tracemalloc
+import tabulate
+import app_main
+
+
+def create_database(users, chats, messages):
+    """
+    Fills the app's database. User 1 is in every chat and every user is in
+    chat 1, which holds all of the messages.
+
+    :param users: number of users
+    :param chats: number of chats
+    :param messages: number of messages
+    """
+    app_main.init_db()
+    conn = app_main.get_db()
+    conn.executemany('INSERT INTO user(name, email, username, password) '
+                     'VALUES (?, ?, ?, ?)',
+                     [('user {}'.format(i), '{}@w.edu'.format(i),
+                       'user{}'.format(i), 'x') for i in range(users)])
+    conn.executemany('INSERT INTO chat(title, time, time_ms) '
+                     'VALUES (?, ?, ?)',
+                     [('chat {}'.format(i), '', i) for i in range(chats)])
+    conn.executemany('INSERT OR IGNORE INTO chat_rel(user_id, chat_id) '
+                     'VALUES (?, ?)',
+                     [(1, i + 1) for i in range(chats)] +
+                     [(i + 1, 1) for i in range(users)])
+    conn.executemany('INSERT INTO message(message, time, user_id, chat_id, '
+                     'time_ms) VALUES (?, ?, ?, 1, ?)',
+                     [('message number {}'.format(i), '', 1 + i % users, i)
+                      for i in range(messages)])
+    conn.commit()
+
+
+def group_rows(rows, key):
+    """
+    Builds the result the queries used to return: an OrderedDict mapping
+    key(row) to the list of its sqlite3.Row objects.
+    """
+    grouped = collections.OrderedDict()
+
+    for row in rows:
+        grouped.setdefault(key(row), []).append(row)
+
+    return grouped
+
+
+def old_messages_in_chatroom(chat_id):
+    cur = app_main.get_db().cursor()
+    cur.execute('''
+        SELECT user.name AS "name", message.message AS "message",
+        message.time_ms AS "time", chat.title AS "title",
+        chat.time_ms AS "created"
+        FROM user, message, chat
+        WHERE chat.id = ? AND message.chat_id = ? AND
+        user.id = message.user_id
+        ORDER BY message.time_ms, message.id
+    ''', (chat_id, chat_id))
+
+    return group_rows(cur, lambda row: (row['name'], row['message'],
+                                        row['time']))
+
+
+def old_chat_rooms(user_id):
+    cur = app_main.get_db().cursor()
+    cur.execute('''
+        SELECT chat.title AS "title", user.name AS "participants",
+        chat.time_ms AS "create_date", chat.id AS "id"
+        FROM chat, chat_rel, user
+        WHERE chat_rel.user_id = user.id
+        AND chat_rel.chat_id = chat.id
+        AND user.id = ?
+        ORDER BY chat.time_ms, chat.title
+    ''', (user_id,))
+
+    return group_rows(cur, lambda row: (row['title'], row['create_date'],
+                                        row['id']))
+
+
+def old_participants_in_chat(chat_id):
+    cur = app_main.get_db().cursor()
+    cur.execute('''
+        SELECT user.name AS "name" FROM user, chat_rel
+        WHERE user.id = chat_rel.user_id AND chat_rel.chat_id = ?
+        ORDER BY name
+    ''', (chat_id,))
+
+    return group_rows(cur, lambda row: row['name'])
+
+
+def held_bytes(query, argument):
+    """
+    :return: tuple of the number of rows a query returns and the bytes its
+    result keeps allocated
+    """
+    tracemalloc.start()
+    result = query(argument)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return len(result), held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    app_main.app.config['QUERY_CACHE'] = False
+
+    queries = [
+        ('get_messages_in_chatroom', old_messages_in_chatroom,
+         app_main.get_messages_in_chatroom),
+        ('get_chat_rooms', old_chat_rooms, app_main.get_chat_rooms),
+        ('get_participants_in_chat', old_participants_in_chat,
+         app_main.get_participants_in_chat),
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        app_main.app.config['DATABASE'] = os.path.join(directory,
+                                                       'bench.sqlite')
+
+        with app_main.app.app_context():
+            create_database(args.users, args.chats, args.messages)
+
+            for name, old, new in queries:
+                rows, old_bytes = held_bytes(old, 1)
+                _, new_bytes = held_bytes(new, 1)
+
+                results.append({'query': name, 'rows': rows,
+                                'old bytes/row': round(old_bytes / rows),
+                                'new bytes/row': round(new_bytes / rows)})
+
+            app_main.close_db()
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures message search latency with the message_fts index against a LIKE
+scan of the message table, for databases of different sizes.
+
+The messages are random sentences over a vocabulary whose words are used
+with a Zipf-like skew, so the searched words range from very common to rare.
+Each search asks for the first page of 20 results, like the search API,
+ranking all of the matches (fts) or only the newest 10000 (fts windowed, the
+app's default SEARCH_RANK_WINDOW).
+
+Normal use (a 10M message database takes several minutes to build):
+$ python3 -m benchmarks.bench_search --messages 1000000 10000000
+messages    word frequency      fts ms    fts windowed ms    like ms
+----------  ----------------  --------  -----------------  ---------
+1000000     common                 ...
+1000000     rare                   ...
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import tabulate
+from migrations import migrate
+
+PAGE = 20
+
+FTS_QUERY = '''
+    SELECT message.id FROM message_fts
+    JOIN message ON message.id = message_fts.rowid
+    WHERE message_fts MATCH ?
+    ORDER BY message_fts.rank, message.id LIMIT ?
+'''
+
+# the lowest id of the newest RANK_WINDOW matches, as search_messages finds it
+WINDOW_QUERY = '''
+    SELECT rowid FROM message_fts WHERE message_fts MATCH ?
+    ORDER BY rowid DESC LIMIT 1 OFFSET ?
+'''
+
+WINDOWED_FTS_QUERY = '''
+    SELECT message.id FROM message_fts
+    JOIN message ON message.id = message_fts.rowid
+    WHERE message_fts MATCH ? AND message_fts.rowid >= ?
+    ORDER BY message_fts.rank, message.id LIMIT ?
+'''
+
+RANK_WINDOW = 10000
+
+LIKE_QUERY = '''
+    SELECT id FROM message WHERE message LIKE ? ORDER BY id LIMIT ?
+'''
+
+
+def make_vocabulary(size):
+    """
+    :param size: the number of words
+    :return: list of distinct made up words, the first are used the most
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+
+    while len(words) < size:
+        words.add(''.join(random.choice(letters)
+                          for _ in range(random.randint(3, 9))))
+
+    return sorted(words, key=len)
+
+
+def create_database(path, messages, vocabulary):
+    """
+    Creates a database at the latest schema holding random messages.
+
+    :param path: the database file name
+    :param messages: number of messages
+    :param vocabulary: the words of the messages
+    """
+    weights = list(itertools.accumulate(1 / (rank + 1)
+                                        for rank in range(len(vocabulary))))
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    migrate(conn)
+    conn.execute("INSERT INTO user(name, username) VALUES ('b', 'b')")
+    conn.execute("INSERT INTO chat(title, time_ms) VALUES ('bench', 0)")
+
+    batch = 50000
+    for start in range(0, messages, batch):
+        rows = [(' '.join(random.choices(vocabulary, cum_weights=weights,
+                                         k=8)), '', i)
+                for i in range(start, min(messages, start + batch))]
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, 1, ?)', rows)
+        conn.commit()
+
+    conn.execute("INSERT INTO message_fts(message_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+
+def median_ms(search, repeat):
+    """
+    :param search: function running one search
+    :return: the median milliseconds of the search, over repeat runs
+    """
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        search()
+        times.append(time.perf_counter() - start)
+
+    return round(statistics.median(times) * 1000, 2)
+
+
+def windowed_search(conn, match):
+    """
+    Ranks only the newest RANK_WINDOW matches, like search_messages with
+    SEARCH_RANK_WINDOW.
+    """
+    row = conn.execute(WINDOW_QUERY, (match, RANK_WINDOW - 1)).fetchone()
+
+    return conn.execute(WINDOWED_FTS_QUERY,
+                        (match, row[0] if row else 0, PAGE)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--messages', type=int, nargs='+',
+                        default=[1000000, 10000000])
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    vocabulary = make_vocabulary(args.vocabulary)
+    words = {'common': vocabulary[0],
+             'medium': vocabulary[len(vocabulary) // 100],
+             'rare': vocabulary[-1]}
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for messages in args.messages:
+            path = os.path.join(directory, '{}.sqlite'.format(messages))
+            create_database(path, messages, vocabulary)
+
+            conn = sqlite3.connect(path)
+            for frequency, word in words.items():
+                match = '"{}"'.format(word)
+                like = '%{}%'.format(word)
+
+                results.append({
+                    'messages': messages,
+                    'word frequency': frequency,
+                    'fts ms': median_ms(
+                        lambda: conn.execute(FTS_QUERY,
+                                             (match, PAGE)).fetchall(),
+                        args.repeat),
+                    'fts windowed ms': median_ms(
+                        lambda: windowed_search(conn, match), args.repeat),
+                    'like ms': median_ms(
+                        lambda: conn.execute(LIKE_QUERY,
+                                             (like, PAGE)).fetchall(),
+                        args.repeat),
+                })
+            conn.close()
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures message insert throughput of a database split into 1, 2, 4 and 8
+shards by chat_id.
+
+Writer processes insert messages into random chats for a fixed number of
+seconds, each insert committed on its own like insert_message, through the
+pools of a ShardRouter. A SQLite file has one writer at a time, so with one
+shard the writers queue on its lock; with N shards the inserts into chats of
+different shards commit in parallel. Commits wait for the disk, so the WAL
+profile is run with synchronous=FULL by default.
+
+Normal use:
+$ python3 -m benchmarks.bench_shards --writers 8
+  shards    messages/s    p50 ms    p99 ms    speedup    errors
+--------  ------------  --------  --------  ---------  --------
+       1           ...
+       2           ...
+       4           ...
+       8           ...
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tabulate
+from benchmarks.bench_storage_profile import create_database, percentile
+from connection_pool import WAL_PROFILE
+from database_class import insert_message_row
+from shard_router import ShardRouter, reshard
+
+
+def write_messages(path, shards, chats, start, seconds, pragmas, seed):
+    """
+    Inserts messages into random chats from start until start + seconds
+    (wall clock time, shared by the writer processes).
+
+    :return: tuple of the list of insert times and the number of errors
+    """
+    router = ShardRouter(path, shards, max_size=1, pragmas=pragmas)
+    chooser = random.Random(seed)
+    times = []
+    errors = 0
+
+    time.sleep(max(0.0, start - time.time()))
+
+    while time.time() < start + seconds:
+        chat_id = chooser.randint(1, chats)
+        pool = router.get_shard_pool(router.shard_of(chat_id))
+
+        begin = time.perf_counter()
+        try:
+            with pool.connection() as conn:
+                insert_message_row(conn.cursor(), 'bench', '', 1, chat_id,
+                                   int(time.time() * 1000))
+                conn.commit()
+        except sqlite3.OperationalError:
+            errors += 1
+        times.append(time.perf_counter() - begin)
+
+    for pool in [router.pool] + router.shard_pools:
+        pool.close()
+
+    return times, errors
+
+
+def run_shards(directory, shards, writers, chats, seconds, pragmas):
+    """
+    Creates a database split into shards and runs the writer processes
+    against it.
+
+    :return: dictionary with the insert rate, latencies and errors
+    """
+    path = os.path.join(directory, 'shards{}.sqlite'.format(shards))
+    create_database(path, chats, 0)
+    if shards > 1:
+        reshard(path, 1, shards)
+
+    # the workers open their own connections, after the setup closed its own
+    start = time.time() + 1.0
+    with multiprocessing.Pool(writers) as processes:
+        outcomes = processes.starmap(write_messages, [
+            (path, shards, chats, start, seconds, pragmas, seed)
+            for seed in range(writers)])
+
+    times = [sample for samples, _ in outcomes for sample in samples]
+
+    return {
+        'messages/s': round(len(times) / seconds),
+        'p50 ms': round(percentile(times, 0.5) * 1000, 2),
+        'p99 ms': round(percentile(times, 0.99) * 1000, 2),
+        'errors': sum(errors for _, errors in outcomes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--shards', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('--synchronous', default='FULL',
+                        choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    pragmas = tuple(dict(WAL_PROFILE, synchronous=args.synchronous).items())
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for shards in args.shards:
+            result = run_shards(directory, shards, args.writers, args.chats,
+                                args.seconds, pragmas)
+            results.append(dict(shards=shards, **result))
+
+    for result in results:
+        result['speedup'] = round(result['messages/s'] /
+                                  max(1, results[0]['messages/s']), 2)
+        result['errors'] = result.pop('errors')
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
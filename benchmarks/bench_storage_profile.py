@@ -0,0 +1,158 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+Measures read/write concurrency of the SQLite backend with the WAL storage
+profile on and off.
+
+Reader threads page through a chat's history like the chat_room view while
+writer threads insert and commit messages like insert_message, all sharing
+one connection pool, for a fixed number of seconds.
+
+Normal use:
+$ python3 -m benchmarks.bench_storage_profile --readers 8 --writers 2
+profile      reads/s    writes/s    read p99 ms    write p99 ms    errors
+---------  ---------  ----------  -------------  --------------  --------
+rollback       ...
+wal            ...
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import tabulate
+from connection_pool import ConnectionPool, WAL_PROFILE, ROLLBACK_PROFILE
+from migrations import migrate
+
+PROFILES = {'rollback': ROLLBACK_PROFILE, 'wal': WAL_PROFILE}
+
+PAGE_QUERY = '''
+    SELECT user.name, message.message, message.time_ms, message.id
+    FROM message JOIN user ON user.id = message.user_id
+    WHERE message.chat_id = ?
+    ORDER BY message.time_ms DESC, message.id DESC LIMIT 50
+'''
+
+
+def create_database(path, chats, messages):
+    """
+    Creates a database with one user, some chats and their messages.
+
+    :param path: the database file name
+    :param chats: number of chats
+    :param messages: number of messages, spread over the chats
+    """
+    pool = ConnectionPool(path)
+    with pool.connection() as conn:
+        migrate(conn)
+        conn.execute("INSERT INTO user(name, username) VALUES ('b', 'b')")
+        conn.executemany('INSERT INTO chat(title, time_ms) VALUES (?, ?)',
+                         [('chat {}'.format(i), i) for i in range(chats)])
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, ?, ?)',
+                         [('hello', '', 1 + i % chats, i)
+                          for i in range(messages)])
+        conn.commit()
+    pool.close()
+
+
+def percentile(samples, fraction):
+    """
+    :param samples: list of numbers
+    :param fraction: e.g. 0.99
+    :return: the value below which the fraction of the samples lie
+    """
+    if not samples:
+        return 0.0
+
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_profile(path, profile, readers, writers, seconds, chats):
+    """
+    Runs the readers and writers against a database with one profile.
+
+    :return: dictionary with the read and write rates and latencies
+    """
+    pool = ConnectionPool(path, max_size=readers + writers,
+                          pragmas=profile.items())
+    stop = time.monotonic() + seconds
+    read_times = []
+    write_times = []
+    errors = []
+
+    def reader():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                with pool.connection() as conn:
+                    conn.execute(PAGE_QUERY,
+                                 (random.randint(1, chats),)).fetchall()
+            except Exception as error:
+                errors.append(error)
+            read_times.append(time.perf_counter() - start)
+
+    def writer():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                with pool.connection() as conn:
+                    conn.execute('INSERT INTO message(message, time, '
+                                 'user_id, chat_id, time_ms) '
+                                 'VALUES (?, ?, 1, ?, ?)',
+                                 ('bench', '', random.randint(1, chats),
+                                  int(time.time() * 1000)))
+                    conn.commit()
+            except Exception as error:
+                errors.append(error)
+            write_times.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+
+    return {
+        'reads/s': round(len(read_times) / seconds),
+        'writes/s': round(len(write_times) / seconds),
+        'read p99 ms': round(percentile(read_times, 0.99) * 1000, 2),
+        'write p99 ms': round(percentile(write_times, 0.99) * 1000, 2),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=100000)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile in PROFILES.items():
+            # a fresh file each time, journal_mode=WAL sticks to the file
+            path = os.path.join(directory, name + '.sqlite')
+            create_database(path, args.chats, args.messages)
+
+            result = run_profile(path, profile, args.readers, args.writers,
+                                 args.seconds, args.chats)
+            results.append(dict(profile=name, **result))
+
+    print(tabulate.tabulate([row.values() for row in results],
+                            list(results[0].keys())))
+
+
+if __name__ == '__main__':
+    main()
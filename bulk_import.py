@@ -0,0 +1,275 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the bulk CSV importer behind initdb_with_csv.
+
+Importing row by row with insert_table_info hashes the password of every row
+again, looks every chat up by title and commits four times per row. The
+BulkImporter instead:
+
+    - keeps the ids of the users, chats and chat memberships it has seen in
+    memory, so each one is looked up or inserted only once,
+    - hashes each new user's password once, spread over a pool of worker
+    processes (hashing is CPU bound, so threads would not run in parallel),
+    - writes a chunk of rows with executemany inside a single transaction,
+    - stores the number of imported rows in the import_checkpoint table in
+    that same transaction, so an interrupted import can be resumed exactly
+    after its last committed chunk.
+
+The result is the same as insert_table_info: an existing username keeps its
+user (and password), an existing chat title keeps its chat and a user joins
+a chat once. Rows whose new user has an email that is already taken are
+skipped, where insert_table_info would fail.
+"""
+
+import concurrent.futures
+import csv
+import functools
+import itertools
+import os
+import time
+from password_hashing import hash_password, DEFAULT_SETTINGS
+from shard_router import NEXT_ID
+from timestamps import parse_time, now_ms
+
+CHUNK_SIZE = 5000
+
+
+class BulkImporter:
+    """
+    Imports a WooMessages CSV export into a database in chunked transactions.
+    """
+
+    def __init__(self, conn, chunk_size=CHUNK_SIZE, workers=None,
+                 progress=None, settings=DEFAULT_SETTINGS):
+        """
+        Loads the existing users, chats and memberships of the database.
+
+        :param conn: sqlite connection to a database at the latest schema
+        version
+        :param chunk_size: rows written per transaction
+        :param workers: number of hashing processes, None for one per CPU and
+        0 to hash in this process
+        :param progress: function(stats) called after every committed chunk
+        :param settings: the password policy, see crypt_settings()
+        """
+        self._conn = conn
+        self._hash = functools.partial(hash_password, settings=settings)
+        self._chunk_size = chunk_size
+        self._workers = workers
+        self._progress = progress
+
+        self._users = dict(conn.execute('SELECT username, id FROM user'))
+        self._emails = set(email for email, in
+                           conn.execute('SELECT email FROM user'))
+        # like check_chat, the first chat with a title is the one used
+        self._chats = dict(conn.execute('SELECT title, min(id) FROM chat '
+                                        'GROUP BY title'))
+        self._chat_rels = set(conn.execute('SELECT user_id, chat_id '
+                                           'FROM chat_rel'))
+
+        self.stats = {'rows': 0, 'skipped': 0, 'users': 0, 'chats': 0,
+                      'messages': 0, 'chunks': 0, 'resumed_at': 0,
+                      'seconds': 0.0}
+
+    def get_checkpoint(self, source):
+        """
+        :param source: the key of the imported file
+        :return: the number of rows of the file already imported
+        """
+        row = self._conn.execute('SELECT rows FROM import_checkpoint '
+                                 'WHERE source = ?', (source,)).fetchone()
+
+        return row[0] if row is not None else 0
+
+    def import_csv(self, filename, resume=False):
+        """
+        Imports a CSV file with the columns 'Username', 'Password', 'Name',
+        'Email', 'Chat_Title', 'Message' and 'Time'.
+
+        :param filename: the CSV filename
+        :param resume: skip the rows that a previous, interrupted import of
+        the same file has already committed
+        :return: dictionary of the import's counters
+        """
+        source = os.path.abspath(filename)
+        start = time.perf_counter()
+
+        if resume:
+            self.stats['resumed_at'] = self.get_checkpoint(source)
+        self.stats['rows'] = self.stats['resumed_at']
+
+        executor = None
+        if self._workers != 0:
+            executor = concurrent.futures.ProcessPoolExecutor(self._workers)
+
+        try:
+            with open(filename, encoding='utf-8', newline='') as f:
+                rows = itertools.islice(csv.DictReader(f),
+                                        self.stats['resumed_at'], None)
+
+                while True:
+                    chunk = list(itertools.islice(rows, self._chunk_size))
+                    if not chunk:
+                        break
+
+                    self._import_chunk(source, chunk, executor)
+
+                    self.stats['seconds'] = round(time.perf_counter() -
+                                                  start, 3)
+                    if self._progress is not None:
+                        self._progress(dict(self.stats))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stats['seconds'] = round(time.perf_counter() - start, 3)
+
+        return self.stats
+
+    def _hash_passwords(self, passwords, executor):
+        """
+        :param passwords: list of plain text passwords
+        :param executor: the hashing process pool, or None
+        :return: list of their hashes, in the same order
+        """
+        if executor is None:
+            return [self._hash(password) for password in passwords]
+
+        # a few tasks per worker, not one pickled task per password
+        chunksize = max(1, len(passwords) // (4 * (os.cpu_count() or 1)))
+
+        return list(executor.map(self._hash, passwords,
+                                 chunksize=chunksize))
+
+    def _import_chunk(self, source, chunk, executor):
+        """
+        Writes one chunk of CSV rows and its checkpoint in one transaction.
+
+        :param source: the key of the imported file
+        :param chunk: list of CSV rows as dictionaries
+        :param executor: the hashing process pool, or None
+        :return: None
+        """
+        # the first row of a new user decides its name, email and password
+        new_users = {}
+        for row in chunk:
+            username = row['Username']
+            if username in self._users or username in new_users:
+                continue
+            if row['Email'] in self._emails:
+                continue
+            self._emails.add(row['Email'])
+            new_users[username] = row
+
+        # hash before the transaction is opened, so the database is not
+        # locked while the workers are busy
+        hashes = self._hash_passwords([row['Password'] for row in
+                                       new_users.values()], executor)
+
+        conn = self._conn
+        conn.commit()
+        cur = conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+
+        try:
+            next_user_id = cur.execute('SELECT coalesce(max(id), 0) + 1 '
+                                       'FROM user').fetchone()[0]
+            next_chat_id = cur.execute('SELECT coalesce(max(id), 0) + 1 '
+                                       'FROM chat').fetchone()[0]
+
+            users = {}
+            user_rows = []
+            for (username, row), password in zip(new_users.items(), hashes):
+                users[username] = next_user_id
+                user_rows.append((next_user_id, row['Name'], row['Email'],
+                                  username, password))
+                next_user_id += 1
+
+            chats = {}
+            chat_rows = []
+            chat_rels = set()
+            message_rows = []
+            skipped = 0
+
+            for row in chunk:
+                user_id = self._users.get(row['Username'],
+                                          users.get(row['Username']))
+                if user_id is None:
+                    skipped += 1
+                    continue
+
+                time_ms = parse_time(row['Time']) or now_ms()
+
+                title = row['Chat_Title']
+                chat_id = self._chats.get(title, chats.get(title))
+                if chat_id is None:
+                    chat_id = chats[title] = next_chat_id
+                    chat_rows.append((chat_id, title, row['Time'], time_ms))
+                    next_chat_id += 1
+
+                if (user_id, chat_id) not in self._chat_rels:
+                    chat_rels.add((user_id, chat_id))
+
+                message_rows.append((row['Message'], row['Time'], user_id,
+                                     chat_id, time_ms))
+
+            cur.executemany('INSERT INTO user(id, name, email, username, '
+                            'password) VALUES (?, ?, ?, ?, ?)', user_rows)
+            cur.executemany('INSERT INTO chat(id, title, time, time_ms) '
+                            'VALUES (?, ?, ?, ?)', chat_rows)
+            cur.executemany('INSERT OR IGNORE INTO chat_rel(user_id, chat_id) '
+                            'VALUES (?, ?)', sorted(chat_rels))
+            cur.executemany('INSERT INTO message(id, message, time, '
+                            'user_id, chat_id, time_ms) '
+                            'VALUES ({}, ?, ?, ?, ?, ?)'.format(
+                                NEXT_ID.format(table='message')),
+                            message_rows)
+
+            cur.execute('INSERT INTO import_checkpoint(source, rows, time_ms) '
+                        'VALUES (?, ?, ?) ON CONFLICT(source) DO UPDATE SET '
+                        'rows = excluded.rows, time_ms = excluded.time_ms',
+                        (source, self.stats['rows'] + len(chunk), now_ms()))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # forget the emails claimed by this chunk, it was not written
+            self._emails.difference_update(row['Email'] for row in
+                                           new_users.values())
+            raise
+
+        # only remember ids once they are committed
+        self._users.update(users)
+        self._chats.update(chats)
+        self._chat_rels.update(chat_rels)
+
+        self.stats['rows'] += len(chunk)
+        self.stats['skipped'] += skipped
+        self.stats['users'] += len(user_rows)
+        self.stats['chats'] += len(chat_rows)
+        self.stats['messages'] += len(message_rows)
+        self.stats['chunks'] += 1
+
+
+def import_csv(conn, filename, resume=False, chunk_size=CHUNK_SIZE,
+               workers=None, progress=None, settings=DEFAULT_SETTINGS):
+    """
+    Imports a CSV file into a database with a BulkImporter.
+
+    :param conn: sqlite connection to a database at the latest schema version
+    :param filename: the CSV filename
+    :param resume: continue an interrupted import of the same file
+    :param chunk_size: rows written per transaction
+    :param workers: number of hashing processes, None for one per CPU and 0
+    to hash in this process
+    :param progress: function(stats) called after every committed chunk
+    :param settings: the password policy, see crypt_settings()
+    :return: dictionary of the import's counters
+    """
+    importer = BulkImporter(conn, chunk_size, workers, progress, settings)
+
+    return importer.import_csv(filename, resume)
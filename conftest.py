@@ -7,6 +7,8 @@ AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
 
 """
 import app_main
+import connection_pool
+import password_hashing
 import pytest
 import os
 import tempfile
@@ -15,6 +17,19 @@ import time
 logging.basicConfig(filename='flask_api_test.log', level=logging.DEBUG)
 logging.debug(time.ctime() + ': ------------------------------------')
 
+# hash passwords at the lowest cost, the tests don't need production strength
+app_main.app.config['PASSWORD_HASH_ROUNDS'] = password_hashing.TEST_ROUNDS
+
+
+@pytest.fixture(scope='session', autouse=True)
+def hash_pools():
+    """
+    Stops the password hashing worker processes after the test session.
+    """
+    yield
+
+    password_hashing.close_hash_pools()
+
 
 @pytest.fixture(scope='session')
 def test_client():
@@ -29,4 +44,39 @@ def test_client():
     yield test_client
 
     os.close(db_fd)
+    connection_pool.close_pools(app_main.app.config['DATABASE'])
     os.unlink(app_main.app.config['DATABASE'])
+
+
+@pytest.fixture
+def fresh_client(tmp_path):
+    """
+    A flask test client on its own empty database, logged in as 'tester'
+    (user id 1) who is a member of chat 1.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = str(tmp_path / 'WooMessages.sqlite')
+    saved = app_main.app.config['DATABASE']
+    app_main.app.config['DATABASE'] = path
+    app_main.app.testing = True
+
+    with app_main.app.app_context():
+        app_main.init_db()
+        conn = app_main.get_db()
+        conn.execute("INSERT INTO user(name, email, username, password) "
+                     "VALUES ('Tester', 't@t.t', 'tester', 'x')")
+        conn.execute("INSERT INTO chat(title, time, time_ms) "
+                     "VALUES ('Test chat', '04/25/2018 21:49', 1)")
+        conn.execute('INSERT INTO chat_rel(user_id, chat_id) VALUES (1, 1)')
+        conn.commit()
+
+    client = app_main.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'tester'
+
+    yield client
+
+    connection_pool.close_pools(path)
+    app_main.app.config['DATABASE'] = saved
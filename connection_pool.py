@@ -0,0 +1,381 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing a thread-safe pool of SQLite connections.
+
+Opening a connection and setting its PRAGMAs on every request is wasted work,
+so the app (through get_db()) and WooMessageDB borrow connections from a
+bounded pool instead and hand them back when they are done. Each connection
+is set up once, when it is created.
+
+A pool can also apply a storage profile, the PRAGMAs that tune SQLite for
+many concurrent readers and a writer (see WAL_PROFILE), and periodically
+checkpoint the write-ahead log so that the -wal file can't grow without
+limit. The periodic checkpoints run on a thread of the pool with a
+connection of its own, never in a request: a TRUNCATE checkpoint waits for
+the readers, and the request that happened to run it would wait with it.
+"""
+
+import collections
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from exception_classes import *
+
+# Write-ahead logging lets readers keep reading while a message is committed.
+# synchronous=NORMAL only syncs at checkpoints: a commit survives an app
+# crash, but the last commits can be lost if the machine loses power.
+WAL_PROFILE = {
+    'busy_timeout': 5000,           # ms to wait for a lock before failing
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,           # KiB of page cache per connection
+    'mmap_size': 268435456,         # bytes of the file memory-mapped
+    'temp_store': 'MEMORY',
+    'journal_size_limit': 67108864,  # bytes the -wal file is cut back to
+}
+
+# ms the periodic checkpoint waits for readers and writers before giving up
+# until the next interval, short so that writers are not held up by it
+CHECKPOINT_BUSY_TIMEOUT = 100
+
+# function(statement) called with the SQL run on every borrowed connection,
+# see trace_statements()
+_trace_callback = None
+
+# SQLite's own defaults, for comparison with WAL_PROFILE
+ROLLBACK_PROFILE = {
+    'busy_timeout': 5000,
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+}
+
+
+class ConnectionPool:
+    """
+    A bounded pool of connections to one SQLite database file.
+
+    At most max_size connections exist at once. acquire() hands out an idle
+    connection, opens a new one while the pool is not full, or waits up to
+    timeout seconds for a connection to be released.
+    """
+
+    def __init__(self, database, max_size=8, timeout=5.0, pragmas=(),
+                 checkpoint_interval=None, checkpoint_mode='TRUNCATE',
+                 attach=()):
+        """
+        Constructs an empty pool, connections are opened when needed.
+
+        :param database: the database file name
+        :param max_size: the maximum number of open connections
+        :param timeout: seconds acquire() waits for a free connection
+        :param pragmas: sequence of (name, value) PRAGMAs set on every new
+        connection
+        :param checkpoint_interval: seconds between WAL checkpoints, run on
+        a background thread, None to leave checkpoints to SQLite's
+        wal_autocheckpoint
+        :param checkpoint_mode: PASSIVE, FULL, RESTART or TRUNCATE
+        :param attach: sequence of (schema name, database file name) ATTACHed
+        to every new connection
+        """
+        self._database = database
+        self._max_size = max_size
+        self._timeout = timeout
+        self._pragmas = tuple(pragmas)
+        self._attach = tuple(attach)
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_mode = checkpoint_mode
+        self._checkpoints = 0
+        self._last_checkpoint_result = None
+
+        self._idle = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._created = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+        self._stopping = threading.Event()
+        self._checkpointer = None
+        if checkpoint_interval is not None:
+            self._checkpointer = threading.Thread(
+                target=self._checkpoint_periodically,
+                name='wal-checkpoint', daemon=True)
+            self._checkpointer.start()
+
+    def _connect(self):
+        """
+        Opens a new connection, attaches the pool's other databases to it
+        and applies the pool's PRAGMAs.
+
+        :return: a sqlite connection whose rows are sqlite3.Row objects
+        """
+        conn = sqlite3.connect(self._database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+
+        for schema, database in self._attach:
+            conn.execute('ATTACH DATABASE ? AS {}'.format(schema), (database,))
+
+        for name, value in self._pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+
+        return conn
+
+    def acquire(self):
+        """
+        Borrows a connection from the pool. It must be given back with
+        release().
+
+        :return: a sqlite connection
+        """
+        start = time.perf_counter()
+        deadline = start + self._timeout
+        conn = None
+        waited = False
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RequestError(503, 'database pool is closed')
+
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+
+                if self._created < self._max_size:
+                    # count it now so other threads don't overfill the pool
+                    self._created += 1
+                    break
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise RequestError(503, 'no database connection free')
+
+                waited = True
+                self._condition.wait(remaining)
+
+            self._in_use += 1
+            self._acquired += 1
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._condition:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._condition.notify()
+                raise
+
+        wait_time = time.perf_counter() - start
+        with self._condition:
+            if waited:
+                self._waits += 1
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        conn.set_trace_callback(_trace_callback)
+
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Gives a borrowed connection back to the pool. Any transaction left
+        open is rolled back first.
+
+        :param conn: the connection returned by acquire()
+        :param discard: close the connection instead of reusing it
+        :return: None
+        """
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        with self._condition:
+            self._in_use -= 1
+
+            if discard or self._closed:
+                self._created -= 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+
+            self._condition.notify()
+
+    def _checkpoint_periodically(self):
+        """
+        The checkpoint thread: checkpoints every checkpoint_interval seconds
+        on its own connection, until the pool is closed. A checkpoint that
+        finds the database busy for CHECKPOINT_BUSY_TIMEOUT ms gives up
+        until the next interval.
+        """
+        while not self._stopping.wait(self._checkpoint_interval):
+            # connecting would create a deleted database file again
+            if not os.path.exists(self._database):
+                continue
+
+            try:
+                conn = sqlite3.connect(self._database)
+                try:
+                    conn.execute('PRAGMA busy_timeout = {}'.format(
+                        CHECKPOINT_BUSY_TIMEOUT))
+                    self.checkpoint(conn)
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+
+    def checkpoint(self, conn=None):
+        """
+        Copies the write-ahead log back into the database file. In TRUNCATE
+        mode the -wal file is also emptied, once no reader still needs it.
+
+        :param conn: the connection to checkpoint with, one is borrowed if
+        None
+        :return: the (busy, log pages, checkpointed pages) result of SQLite
+        """
+        if conn is None:
+            with self.connection() as conn:
+                return self.checkpoint(conn)
+
+        result = tuple(conn.execute('PRAGMA wal_checkpoint({})'.format(
+            self._checkpoint_mode)).fetchone())
+
+        with self._condition:
+            self._checkpoints += 1
+            self._last_checkpoint_result = result
+
+        return result
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a connection for a with block.
+
+        :return: a sqlite connection
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """
+        Returns the usage statistics of the pool.
+
+        :return: a dictionary of the pool's counters, times are in
+        milliseconds
+        """
+        with self._condition:
+            return {
+                'database': self._database,
+                'max_size': self._max_size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'acquired': self._acquired,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait_ms': round(self._wait_time * 1000, 3),
+                'max_wait_ms': round(self._max_wait_time * 1000, 3),
+                'pragmas': dict(self._pragmas),
+                'checkpoints': self._checkpoints,
+                'last_checkpoint': self._last_checkpoint_result,
+            }
+
+    def close(self):
+        """
+        Stops the checkpoint thread and closes the idle connections.
+        Borrowed connections are closed when they are released.
+
+        :return: None
+        """
+        self._stopping.set()
+        if self._checkpointer is not None and \
+                self._checkpointer is not threading.current_thread():
+            self._checkpointer.join()
+
+        with self._condition:
+            self._closed = True
+
+            while self._idle:
+                self._idle.pop().close()
+                self._created -= 1
+
+            self._condition.notify_all()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database, max_size=8, timeout=5.0, pragmas=(),
+             checkpoint_interval=None, checkpoint_mode='TRUNCATE',
+             attach=()):
+    """
+    Returns the shared pool for a database file, creating it on first use.
+    Pools with different PRAGMAs or attached databases are kept apart. The
+    other settings only apply when the pool is created.
+
+    :param database: the database file name
+    :param max_size: the maximum number of open connections
+    :param timeout: seconds acquire() waits for a free connection
+    :param pragmas: sequence of (name, value) PRAGMAs for new connections
+    :param checkpoint_interval: seconds between WAL checkpoints, or None
+    :param checkpoint_mode: PASSIVE, FULL, RESTART or TRUNCATE
+    :param attach: sequence of (schema name, database file name) to attach
+    :return: a ConnectionPool
+    """
+    key = (database, tuple(pragmas), tuple(attach))
+
+    with _pools_lock:
+        pool = _pools.get(key)
+
+        if pool is None:
+            pool = ConnectionPool(database, max_size, timeout, pragmas,
+                                  checkpoint_interval, checkpoint_mode,
+                                  attach)
+            _pools[key] = pool
+
+    return pool
+
+
+def trace_statements(callback):
+    """
+    Passes the SQL statements run on every connection borrowed from now on,
+    from any pool, to a callback, e.g. to count the queries of a request.
+
+    :param callback: function(statement), None to stop tracing
+    :return: None
+    """
+    global _trace_callback
+
+    _trace_callback = callback
+
+
+def close_pools(database):
+    """
+    Closes and forgets every pool of a database file, e.g. before the file is
+    deleted.
+
+    :param database: the database file name
+    :return: None
+    """
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == database]:
+            _pools.pop(key).close()
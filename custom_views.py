@@ -12,12 +12,240 @@ There are three customMethodViews: ArtistView, AlbumView and TrackView.
 Each of them have GET, POST, PATCH, PUT and DELETE requests implemented.
 """
 from flask.views import MethodView, request
-from flask import Flask, g, jsonify
+from flask import Flask, g, jsonify, current_app, Response, \
+    stream_with_context, session, make_response
+from urllib.parse import urlencode
+import datetime
+import hashlib
+import json
 from queries import *
 from exception_classes import *
 from database_class import *
 
 
+def get_page_limit():
+    """
+    Reads the ?limit= parameter of a request. Defaults to the app's
+    API_PAGE_SIZE and is capped at API_MAX_PAGE_SIZE.
+
+    :return: the number of rows to return in a page
+    """
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'])
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise RequestError(422, 'limit must be a positive integer')
+
+    if limit < 1:
+        raise RequestError(422, 'limit must be a positive integer')
+
+    return min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+
+
+def get_int_arg(name, default):
+    """
+    Reads an optional non-negative integer argument of the request.
+
+    :param name: the name of the argument
+    :param default: the value when the argument is not given
+    :return: the integer, or default
+    """
+    value = request.args.get(name)
+
+    if value is None:
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        raise RequestError(422, '{} must be an integer'.format(name))
+
+    if value < 0:
+        raise RequestError(422, '{} must not be negative'.format(name))
+
+    return value
+
+
+def conditional_response(scopes, build):
+    """
+    Answers a GET with 304 Not Modified if the client already has the
+    current version of the response, and builds it otherwise.
+
+    The strong ETag is made from the data_version counters of the scopes
+    the response is built from, plus everything else it depends on: the
+    URL with its arguments, the Accept header and the logged in user.
+    Checking it only reads the counters, never the tables themselves. The
+    Last-Modified time, the latest change of those scopes, is only
+    informative: If-Modified-Since is not answered with 304, its whole
+    seconds can't tell apart two writes of the same second, nor the
+    responses of two users or two URLs.
+
+    :param scopes: the data_version scopes, e.g. ['chat:1', 'user']
+    :param build: function building the full response
+    :return: a response
+    """
+    versions = get_data_versions(['epoch'] + list(scopes))
+
+    key = json.dumps([request.full_path,
+                      request.headers.get('Accept', ''),
+                      session.get('username'),
+                      [version for version, _ in versions]])
+    etag = hashlib.sha1(key.encode()).hexdigest()
+
+    modified = [modified_ms for _, modified_ms in versions[1:] if modified_ms]
+    last_modified = None
+    if modified:
+        last_modified = datetime.datetime.fromtimestamp(
+            max(modified) // 1000, datetime.timezone.utc)
+
+    # flashed messages are only shown once, so a page holding them must be
+    # sent again
+    if '_flashes' not in session:
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    response = make_response(build())
+
+    if response.status_code == 200:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # may be stored, but must be revalidated before every use
+        response.cache_control.no_cache = True
+
+    return response
+
+
+def collection_response(table_name):
+    """
+    Builds the response for a GET of a whole table. The table is streamed if
+    the request asks for it (see wants_stream), and paged otherwise.
+
+    :param table_name: name of the table
+    :return: JSON or NDJSON response
+    """
+    if wants_stream():
+        return conditional_response([table_name],
+                                    lambda: streamed_response(table_name))
+
+    return conditional_response([table_name],
+                                lambda: paginated_response(table_name))
+
+
+def item_response(table_name, id, not_found):
+    """
+    Builds the response for a GET of a single row, or 304 Not Modified if
+    its table has not changed since the client got it (see
+    conditional_response).
+
+    :param table_name: name of the table
+    :param id: id of the row
+    :param not_found: the error message if there is no such row
+    :return: JSON response
+    """
+    def build():
+        record = query_by_id(table_name, id, as_record=True)
+
+        if record is None:
+            raise RequestError(404, not_found)
+
+        return Response(record.to_json(), mimetype='application/json')
+
+    return conditional_response([table_name], build)
+
+
+def wants_ndjson():
+    """
+    :return: True if the request prefers application/x-ndjson over JSON
+    """
+    best = request.accept_mimetypes.best_match(['application/json',
+                                                'application/x-ndjson'])
+
+    return best == 'application/x-ndjson'
+
+
+def wants_stream():
+    """
+    A request asks for a streamed response with ?stream=1 or with an
+    Accept: application/x-ndjson header.
+
+    :return: True if the response should be streamed
+    """
+    return request.args.get('stream') == '1' or wants_ndjson()
+
+
+def streamed_response(table_name):
+    """
+    Streams every row of a table while it is read from the database, so the
+    memory used stays at one batch of STREAM_BATCH_SIZE rows however large
+    the table is.
+
+    The rows are sent as NDJSON (one JSON object per line) if the request
+    accepts application/x-ndjson, or as a single JSON list otherwise.
+
+    :param table_name: name of the table
+    :return: a streamed response
+    """
+    batches = iter_row_batches(table_name,
+                               current_app.config['STREAM_BATCH_SIZE'],
+                               as_records=True)
+
+    if wants_ndjson():
+        def generate():
+            for batch in batches:
+                yield ''.join(record.to_json() + '\n' for record in batch)
+
+        mimetype = 'application/x-ndjson'
+    else:
+        def generate():
+            separator = '['
+            for batch in batches:
+                yield separator + ','.join(record.to_json()
+                                           for record in batch)
+                separator = ','
+            yield ']' if separator == ',' else '[]'
+
+        mimetype = 'application/json'
+
+    # keeps the app context, and with it the db connection, for the stream
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def paginated_response(table_name):
+    """
+    Builds the JSON response for a GET of a whole table, one page at a time.
+
+    The body is a JSON list of the rows in the page. If there are more rows,
+    the cursor for the next page is sent in the X-Next-Cursor header and the
+    URL of the next page in the Link header.
+
+    :param table_name: name of the table
+    :return: JSON response
+    """
+    limit = get_page_limit()
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    records, next_cursor = get_rows_page(table_name, limit, before, after,
+                                         as_records=True)
+
+    response = Response(records_to_json(records),
+                        mimetype='application/json')
+
+    if next_cursor is not None:
+        direction = 'before' if before is not None else 'after'
+        next_url = '{}?{}'.format(request.base_url,
+                                  urlencode({'limit': limit,
+                                             direction: next_cursor}))
+
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+
+    return response
+
+
 class ChatRelView(MethodView):
     """
     This view handles all the /chatrel/ requests.
@@ -26,23 +254,16 @@ class ChatRelView(MethodView):
     def get(self, id):
         """
         Handle GET requests.
-        Returns JSON representing all of the logins if login_id is None, or a
-        single login if login_id is not None.
+        Returns JSON representing a page of the logins if login_id is None
+        (see collection_response), or a single login if login_id is not
+        None.
         :param id: id of a login, or None for all logins
         :return: JSON response
         """
         if id is None:
-            chatrel = get_all_rows('chat_rel')
-            return jsonify(chatrel)
+            return collection_response('chat_rel')
         else:
-            chatrel = query_by_id('chat_rel', id)
-
-            if chatrel is not None:
-                response = jsonify(chatrel)
-            else:
-                raise RequestError(404, 'chat relation not found')
-
-            return response
+            return item_response('chat_rel', id, 'chat relation not found')
 
     def post(self):
         """
@@ -85,23 +306,16 @@ class MessageView(MethodView):
     def get(self, id):
         """
         Handle GET requests.
-        Returns JSON representing all of the message if message_id is None, or
-        a single message if message_id is not None.
+        Returns JSON representing a page of the messages if message_id is
+        None (see collection_response), or a single message if message_id is
+        not None.
         :param id: id of a message, or None for all messages
         :return: JSON response
         """
         if id is None:
-            messages = get_all_rows('message')
-            return jsonify(messages)
+            return collection_response('message')
         else:
-            messages = query_by_id('message', id)
-
-            if messages is not None:
-                response = jsonify(messages)
-            else:
-                raise RequestError(404, 'message not found')
-
-            return response
+            return item_response('message', id, 'message not found')
 
     # The user_id should be provided through form data, not URL data. I
     # updated it to fix that -Morgan
@@ -154,22 +368,15 @@ class UserView(MethodView):
     def get(self, id):
         """
         Handle GET requests.
-        Returns JSON representing all of the users if user_id is None, or a
-        single user if user_id is not None.
+        Returns JSON representing a page of the users if user_id is None
+        (see collection_response), or a single user if user_id is not None.
         :param id: id of a user, or None for all users
         :return: JSON response
         """
         if id is None:
-            user = get_all_rows('user')
-            return jsonify(user)
+            return collection_response('user')
         else:
-            user = query_by_id('user', id)
-            if user is not None:
-                response = jsonify(user)
-            else:
-                raise RequestError(404, 'user not found')
-
-            return response
+            return item_response('user', id, 'user not found')
 
     def post(self):
         """
@@ -223,23 +430,15 @@ class ChatView(MethodView):
     def get(self, id):
         """
         Handle GET requests.
-        Returns JSON representing all of the message if chat_id is None, or a
-        single chat if chat_id is not None.
+        Returns JSON representing a page of the chats if chat_id is None
+        (see collection_response), or a single chat if chat_id is not None.
         :param id: id of a chat, or None for all chats
         :return: JSON response
         """
         if id is None:
-            chat = get_all_rows('chat')
-            return jsonify(chat)
+            return collection_response('chat')
         else:
-            chat = query_by_id('chat', id)
-
-            if chat is not None:
-                response = jsonify(chat)
-            else:
-                raise RequestError(404, 'chat not found')
-
-            return response
+            return item_response('chat', id, 'chat not found')
 
     def post(self):
         """
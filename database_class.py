@@ -8,18 +8,98 @@ A file containing functions for database creation and the functions required
 for updating/inserting/deleting from the database's tables.
 """
 
-from flask import Flask, g
+from flask import Flask, g, current_app
 import os
 import sqlite3
 import csv
 import datetime
+import threading
+import concurrent.futures
+import copy
+import functools
+import random
 # a hash algorithm that encrypts password
-from passlib.hash import sha256_crypt
 from exception_classes import *
-from collections import OrderedDict
+from migrations import SCHEMA_VERSION, migrate, drop_tables
+from timestamps import parse_time, now_ms
+from connection_pool import get_pool, WAL_PROFILE
+from group_commit import get_writer
+from bulk_import import import_csv, CHUNK_SIZE
+from synthetic_data import generate, CHUNK_SIZE as SYNTHETIC_CHUNK_SIZE, \
+    END_MS
+from archive import archive_messages, attach_archives
+from shard_router import get_router, reshard, SHARDED_TABLES, NEXT_ID
+from events import get_broker
+from query_cache import get_cache
+from password_hashing import get_hash_pool, hash_password, crypt_settings, \
+    DEFAULT_SETTINGS, DEFAULT_ROUNDS
+from table_classes import MODELS, Record, records_to_json
+from collections import OrderedDict, namedtuple
+
+# the rows of the lists read for the templates, holding only the columns
+# the templates use
+MessageRecord = namedtuple('MessageRecord', ['name', 'message', 'time'])
+ChatRoomRecord = namedtuple('ChatRoomRecord',
+                            ['title', 'create_date', 'id', 'unread',
+                             'last_activity', 'message_count',
+                             'participant_count', 'last_message',
+                             'last_sender'])
+
+# unread counts stop at UNREAD_COUNT_CAP (shown as "99+"), so a chat costs
+# at most that many index entries however far behind its member is
+UNREAD_COUNT_CAP = 100
+
+# the chats of a user (?) before a (last_activity, chat_id) key (?, ?), most
+# recently active first, at most ? of them (-1 for all), with the number of
+# messages after the user's read watermark, counted through the
+# message(chat_id, id) index, and the chat's summary (see chat_summary in
+# migrations.py) and newest message. The chats are found through
+# chat_rel(user_id, chat_id) and only those of the user are sorted; the
+# unread counts and newest messages are read for the page only.
+CHAT_ROOMS_QUERY = '''
+    SELECT chat.title, chat.time_ms, chat.id,
+    (SELECT count(*) FROM
+        (SELECT 1 FROM message
+         WHERE message.chat_id = page.chat_id
+         AND message.id > page.last_read_id LIMIT ?)),
+    page.last_activity, page.message_count, page.participant_count,
+    message.message, user.name
+    FROM (SELECT chat_rel.chat_id, chat_rel.last_read_id,
+          chat_summary.last_activity, chat_summary.message_count,
+          chat_summary.participant_count, chat_summary.last_message_id
+          FROM chat_rel
+          JOIN chat_summary ON chat_summary.chat_id = chat_rel.chat_id
+          WHERE chat_rel.user_id = ?
+          AND (chat_summary.last_activity, chat_summary.chat_id) < (?, ?)
+          ORDER BY chat_summary.last_activity DESC,
+          chat_summary.chat_id DESC
+          LIMIT ?) AS page
+    JOIN chat ON chat.id = page.chat_id
+    LEFT JOIN message ON message.id = page.last_message_id
+    LEFT JOIN user ON user.id = message.user_id
+    ORDER BY page.last_activity DESC, page.chat_id DESC
+'''
+
+# the (last_activity, chat_id) key after every chat, where the first page
+# of CHAT_ROOMS_QUERY starts
+CHAT_ROOMS_START = (2 ** 63 - 1, 2 ** 63 - 1)
+
+
+def fetch_records(cur, record, query, args=()):
+    """
+    Runs a query and returns its rows as records. The rows are read as plain
+    tuples instead of sqlite3.Row objects, so only the records are kept.
+
+    :param cur: a cursor
+    :param record: a namedtuple class or model (see table_classes.py) with
+    one field per selected column
+    :param query: the query
+    :param args: the query's parameters
+    :return: list of records
+    """
+    cur.row_factory = None
 
-app = Flask(__name__)
-app.config['DATABASE'] = os.path.join(app.root_path, 'WooMessages.sqlite')
+    return list(map(record._make, cur.execute(query, args)))
 
 
 class WooMessageDB:
@@ -52,104 +132,210 @@ class WooMessageDB:
 
     # CONSTRUCTOR AND INITIALISER ############################################
 
-    def __init__(self, filename):
+    def __init__(self, filename, pool_size=4, storage_profile=None,
+                 shards=1):
         """
         Constructor for Car Store Database object.
 
         Constructor for the Car Store Database. Provided a car store database
         filename, the constructor creates a cursor in the database. If a
         database file does not exist, the constructor creates a file and
-        generates the care store tables in it. Also turns foreign keys on.
+        generates the care store tables in it. An existing file is upgraded
+        to the latest schema version. Also turns foreign keys on.
+
+        Connections come from a pool shared by every WooMessageDB of the same
+        file. Each thread borrows its own connection on first use and keeps
+        it until close() is called from that thread.
+
+        With shards > 1 the chats, their members and their messages are in
+        shard files next to filename (see shard_router.py), and foreign keys
+        stay off, since a shard's rows refer to users of the global file.
 
         :param filename: File name of the car store database.
+        :param pool_size: the maximum number of open connections to the file
+        :param storage_profile: dictionary of PRAGMAs for the connections,
+        e.g. connection_pool.WAL_PROFILE
+        :param shards: the number of shards the database is split into
         :return: None.
         """
+        pragmas = [('foreign_keys', 'ON')] if shards == 1 else []
+        pragmas.extend((storage_profile or {}).items())
+
+        self._router = get_router(filename, shards, max_size=pool_size,
+                                  pragmas=pragmas)
+        self._pool = self._router.pool
+        self._local = threading.local()
+
         if not os.path.isfile(filename):
             print("{} does not exist, creating it now.".format(filename))
-            self._conn = sqlite3.connect(filename)
             self.create_tables()
         else:
-            self._conn = sqlite3.connect(filename)
-        self._conn.row_factory = sqlite3.Row
-        cur = self._conn.cursor()
-        cur.execute('PRAGMA foreign_keys = ON')
+            self.migrate()
+
+    @property
+    def _conn(self):
+        """
+        The connection borrowed by the current thread.
+
+        :return: a sqlite connection
+        """
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            conn = self._local.conn = self._pool.acquire()
+
+        return conn
+
+    def _chat_conn(self, chat_id):
+        """
+        The connection borrowed by the current thread to the file holding a
+        chat.
+
+        :param chat_id: the id of the chat
+        :return: a sqlite connection
+        """
+        if not self._router.is_sharded:
+            return self._conn
+
+        return self._shard_conn(self._router.shard_of(chat_id))
+
+    def _shard_conn(self, shard):
+        """
+        The connection borrowed by the current thread to a shard.
+
+        :param shard: the shard number
+        :return: a sqlite connection
+        """
+        if not self._router.is_sharded:
+            return self._conn
+
+        shard_conns = getattr(self._local, 'shard_conns', None)
+        if shard_conns is None:
+            shard_conns = self._local.shard_conns = {}
 
-    def convert_csv_to_sqlite(self, filename):
+        if shard not in shard_conns:
+            shard_conns[shard] = self._router.get_shard_pool(shard).acquire()
+
+        return shard_conns[shard]
+
+    def _table_conns(self, table_name):
+        """
+        :param table_name: the name of a table
+        :return: list of the connections holding the table's rows
+        """
+        if table_name in SHARDED_TABLES:
+            return [self._shard_conn(shard)
+                    for shard in range(self._router.shards)]
+
+        return [self._conn]
+
+    def _row_conn(self, table_name, item_id):
+        """
+        :param table_name: the name of a table
+        :param item_id: the id of a row
+        :return: the connection holding the row (see get_row_db)
+        """
+        conns = self._table_conns(table_name)
+
+        if len(conns) > 1:
+            query = 'SELECT 1 FROM {} WHERE id = ?'.format(table_name)
+
+            for conn in conns:
+                if conn.execute(query, (item_id,)).fetchone() is not None:
+                    return conn
+
+        return conns[0]
+
+    def close(self):
+        """
+        Gives the current thread's connections back to the pools.
+
+        :return: None
+        """
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is not None:
+            self._local.conn = None
+            self._pool.release(conn)
+
+        shard_conns = getattr(self._local, 'shard_conns', None) or {}
+        self._local.shard_conns = None
+
+        for shard, conn in shard_conns.items():
+            self._router.get_shard_pool(shard).release(conn)
+
+    def pool_stats(self):
+        """
+        Returns the usage statistics of the connection pool of the global
+        file (router_stats() has the shards' too).
+
+        :return: a dictionary of the pool's counters
+        """
+        return self._pool.stats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def convert_csv_to_sqlite(self, filename, resume=False,
+                              chunk_size=CHUNK_SIZE, workers=None,
+                              progress=None):
         """
         Initialises a db if non-existent and populates the db with data from a
-        CSV file.
+        CSV file, in chunked transactions (see bulk_import.py).
 
         :param filename: the CSV filename where data is stored. The data must
         be in the columns titled 'Username', 'Password', 'Name', 'Email',
-        'Chat_Title', 'Title' and 'Message'
-        :return: None
+        'Chat_Title', 'Time' and 'Message'
+        :param resume: keep the existing data and continue an interrupted
+        import of the same file
+        :param chunk_size: rows written per transaction
+        :param workers: number of password hashing processes, None for one
+        per CPU
+        :param progress: function(stats) called after every chunk
+        :return: dictionary of the import's counters
         """
+        if self._router.is_sharded:
+            raise RequestError(409, 'import into an unsplit database, then '
+                                    'split it with shard_router.reshard()')
 
-        self.create_tables()  # creates database tables if non-existant
-
-        for row in csv_row_generator(filename):
+        if resume:
+            self.migrate()
+        else:
+            self.create_tables()  # creates database tables if non-existant
 
-            self.insert_table_info(username=row['Username'],
-                                   password=row['Password'],
-                                   name=row['Name'],
-                                   email=row['Email'],
-                                   chat_title=row['Chat_Title'],
-                                   message_time=row['Time'],
-                                   message_content=row['Message'],
-                                   )
+        return import_csv(self._conn, filename, resume, chunk_size, workers,
+                          progress)
 
     # CREATE TABLES############################################################
 
     def create_tables(self):
         """Creates tables for our database.
 
-        Creates the Manufacturer, Store, Car and Model tables if they do not
-        already exist.
+        Drops the user, chat_rel, chat and message tables and recreates them,
+        with their indexes, at the latest schema version.
 
         :return: None
         """
-        cur = self._conn.cursor()
+        drop_tables(self._conn)
+        migrate(self._conn)
 
-        query = '''
-            PRAGMA foreign_keys = ON;
-            DROP TABLE IF EXISTS user;
-            DROP TABLE IF EXISTS chat_rel;
-            DROP TABLE IF EXISTS chat;
-            DROP TABLE IF EXISTS message;
-
-            CREATE TABLE user (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                email TEXT UNIQUE,
-                username TEXT UNIQUE,
-                password TEXT
-            );
-            CREATE TABLE chat_rel(
-                id INTEGER PRIMARY KEY,
-                user_id INTEGER,
-                chat_id INTEGER,
-                FOREIGN KEY(user_id) REFERENCES user(id)
-                FOREIGN KEY(chat_id) REFERENCES chat(id)
-            );
-            CREATE TABLE chat(
-                id INTEGER PRIMARY KEY,
-                title TEXT,
-                time TEXT
-            );
-            CREATE TABLE message (
-                id INTEGER PRIMARY KEY,
-                message TEXT,
-                time TEXT,
-                user_id INTEGER,
-                chat_id INTEGER,
-                FOREIGN KEY(user_id) REFERENCES user(id),
-                FOREIGN KEY(chat_id) REFERENCES chat(id)
-            );
-        '''
+        self._router.create_shards()
+
+    def migrate(self):
+        """
+        Upgrades the database to the latest schema version without dropping
+        any data.
 
-        cur.executescript(query)
+        :return: list of the (version, description) of applied migrations
+        """
+        applied = migrate(self._conn)
 
-        self._conn.commit()
+        self._router.migrate_shards()
+
+        return applied
 
     # INSERTS##################################################################
 
@@ -168,7 +354,7 @@ class WooMessageDB:
         print("TRYING TO INSERT {}".format(name))
 
         # hash and salt password
-        password = sha256_crypt.encrypt(str(password))
+        password = hash_password(password)
 
         # Create cursor
         cur = self._conn.cursor()
@@ -193,7 +379,7 @@ class WooMessageDB:
 
         return result
 
-    def insert_message(self, message, time, user_id, chat_id):
+    def insert_message(self, message, time, user_id, chat_id, time_ms=None):
         """
         Insert a message into the database. Keeps track of the user who
         sent the message, the chat in which the message was sent and the
@@ -204,16 +390,23 @@ class WooMessageDB:
         :param time: the time the message was sent
         :param user_id: the ID of the user who sent the message
         :param chat_id: the ID of the chat the message is sent to
+        :param time_ms: the time in milliseconds since the epoch, parsed from
+        time if not given
         :return:
         """
-        cur = self._conn.cursor()
+        conn = self._chat_conn(chat_id)
+        cur = conn.cursor()
+
+        if time_ms is None:
+            time_ms = parse_time(time) or now_ms()
 
         cur.execute('INSERT OR IGNORE INTO '
-                    'message(message, time, user_id, chat_id)'
-                    'VALUES(?, ?, ?, ?)',
-                    (message, time, user_id, chat_id))
+                    'message(id, message, time, user_id, chat_id, time_ms)'
+                    'VALUES({}, ?, ?, ?, ?, ?)'.format(
+                        NEXT_ID.format(table='message')),
+                    (message, time, user_id, chat_id, time_ms))
 
-        self._conn.commit()
+        conn.commit()
 
         message_id = cur.lastrowid
 
@@ -221,7 +414,7 @@ class WooMessageDB:
 
         return dict(cur.fetchone())
 
-    def insert_chat(self, title, time):
+    def insert_chat(self, title, time, time_ms=None):
         """
         Insert a chat into the database ONLY IF a chat with the same
         title does
@@ -231,18 +424,29 @@ class WooMessageDB:
 
         :param title: chat title
         :param time: time the first message was sent in this chat
+        :param time_ms: the time in milliseconds since the epoch, parsed from
+        time if not given
         :return: inserted row as a dictionary
         """
-        cur = self._conn.cursor()
-
         chat_id = self.check_chat(title)  # check if this chat already exists
 
         if chat_id is None:
+            if time_ms is None:
+                time_ms = parse_time(time) or now_ms()
+
+            # a new chat goes to a random shard
+            conn = self._shard_conn(random.randrange(self._router.shards))
+            cur = conn.cursor()
+
             cur.execute('INSERT INTO '
-                        'chat(title, time)'
-                        'VALUES(?, ?)', (title, time))
-            self._conn.commit()
+                        'chat(id, title, time, time_ms)'
+                        'VALUES({}, ?, ?, ?)'.format(
+                            NEXT_ID.format(table='chat')),
+                        (title, time, time_ms))
+            conn.commit()
             chat_id = cur.lastrowid
+        else:
+            cur = self._chat_conn(chat_id).cursor()
 
         cur.execute('SELECT * FROM chat WHERE id = ?', (chat_id,))
 
@@ -259,17 +463,20 @@ class WooMessageDB:
         :param chat_id: ID of the chat
         :return: inserted row as a dictionary
         """
-        cur = self._conn.cursor()
+        conn = self._chat_conn(chat_id)
+        cur = conn.cursor()
 
         chat_rel_id = self.check_chat_rel(user_id, chat_id)
 
         if chat_rel_id is None:
             cur.execute('INSERT INTO '
-                        'chat_rel(user_id, chat_id) '
-                        'VALUES(?, ?)', (user_id, chat_id))
+                        'chat_rel(id, user_id, chat_id) '
+                        'VALUES({}, ?, ?)'.format(
+                            NEXT_ID.format(table='chat_rel')),
+                        (user_id, chat_id))
             # we cannot use INSERT OR IGNORE INTO...
 
-            self._conn.commit()
+            conn.commit()
 
             chat_rel_id = cur.lastrowid
 
@@ -347,14 +554,15 @@ class WooMessageDB:
         :param message_id: ID of the message
         :return: dictionary containing updated message
         """
-        cur = self._conn.cursor()
+        conn = self._row_conn('message', message_id)
+        cur = conn.cursor()
 
         query = '''
             UPDATE message SET message = ?, user_id = ? WHERE id = ?
         '''
 
         cur.execute(query, (text, user_id, message_id))
-        self._conn.commit()
+        conn.commit()
 
         cur.execute('SELECT * FROM message WHERE id = ?', (message_id,))
 
@@ -391,14 +599,15 @@ class WooMessageDB:
         :return: a dictionary representing the updated chat title
         """
 
-        cur = self._conn.cursor()
+        conn = self._chat_conn(chat_id)
+        cur = conn.cursor()
 
         query = '''
             UPDATE chat SET title = ? WHERE id = ?
         '''
 
         cur.execute(query, (title, chat_id))
-        self._conn.commit()
+        conn.commit()
 
         cur.execute('SELECT * FROM chat WHERE id = ?', (chat_id,))
 
@@ -416,14 +625,15 @@ class WooMessageDB:
         :param chat_id: that chat id from which to delete a user
         """
 
-        cur = self._conn.cursor()
+        conn = self._chat_conn(chat_id)
+        cur = conn.cursor()
 
         user_id = self.get_user_id(username)
 
         cur.execute(
             'DELETE FROM chat_rel WHERE user_id = ? AND chat_id = ?',
             (user_id, chat_id))
-        self._conn.commit()
+        conn.commit()
 
     def delete_user_from_chat(self, username, chat_id):
         """
@@ -435,14 +645,15 @@ class WooMessageDB:
         :param chat_id: the id of the chat
         """
 
-        cur = self._conn.cursor()
+        conn = self._chat_conn(chat_id)
+        cur = conn.cursor()
 
         user_id = self.get_user_id(username)
 
         cur.execute(
             'DELETE FROM chat_rel WHERE user_id = ? AND chat_id = ?',
             (user_id, chat_id))
-        self._conn.commit()
+        conn.commit()
 
     def delete_item(self, table_name, item_id):
         """
@@ -452,18 +663,19 @@ class WooMessageDB:
         :param item_id: it item which to delte
         :return: NONE
         """
-        cur = self._conn.cursor()
+        conn = self._row_conn(table_name, item_id)
+        cur = conn.cursor()
 
         query = 'DELETE FROM {} WHERE id = ?'.format(table_name)
 
         cur.execute(query, (item_id,))
-        self._conn.commit()
+        conn.commit()
 
         return None
 
     # QUERIES##################################################################
 
-    def query_by_id(self, table_name, item_id):
+    def query_by_id(self, table_name, item_id, as_record=False):
         """
         Get a row from a table that has a primary key attribute named id.
 
@@ -471,10 +683,19 @@ class WooMessageDB:
 
         :param table_name: name of the table to query
         :param item_id: id of the row
+        :param as_record: return the row as its model (see table_classes.py)
         :return: a dictionary representing the row, and None if there is
         no row
         """
-        cur = self._conn.cursor()
+        cur = self._row_conn(table_name, item_id).cursor()
+
+        if as_record:
+            model = MODELS[table_name]
+            records = fetch_records(cur, model,
+                                    model.select() + ' WHERE id = ?',
+                                    (item_id,))
+
+            return records[0] if records else None
 
         query = 'SELECT * FROM {} WHERE id = ?'.format(table_name)
 
@@ -487,27 +708,78 @@ class WooMessageDB:
         else:
             return None
 
-    def get_all_rows(self, table_name):
+    def get_all_rows(self, table_name, as_records=False):
         """
         Returns all of the rows from a table as a list of dictionaries.
         This is
         suitable for passing to jsonify().
 
         :param table_name: name of the table
+        :param as_records: return the rows as their model (see
+        table_classes.py)
         :return: list of dictionaries representing the table's rows
         """
+        conns = self._table_conns(table_name)
+        results = []
 
-        cur = self._conn.cursor()
+        for conn in conns:
+            cur = conn.cursor()
 
-        query = 'SELECT * FROM {}'.format(table_name)
+            if as_records:
+                model = MODELS[table_name]
+                results.extend(fetch_records(cur, model, model.select()))
+                continue
 
-        results = []
+            query = 'SELECT * FROM {}'.format(table_name)
+
+            for row in cur.execute(query):
+                results.append(dict(row))
 
-        for row in cur.execute(query):
-            results.append(dict(row))
+        if len(conns) > 1:
+            results.sort(key=lambda row: row.id if as_records
+                         else row['id'])
 
         return results
 
+    def get_rows_after(self, table_name, after_id, limit, as_records=False):
+        """
+        Returns the rows of a table with an id greater than after_id, in id
+        order: one keyset page of a scan of the whole table, which holds no
+        cursor open between pages.
+
+        :param table_name: name of the table
+        :param after_id: only rows with a greater id are returned
+        :param limit: maximum number of rows returned
+        :param as_records: return the rows as their model (see
+        table_classes.py)
+        :return: list of dictionaries representing the rows
+        """
+        select = 'SELECT * FROM {}'.format(table_name)
+        if as_records:
+            model = MODELS[table_name]
+            select = model.select()
+
+        query = select + ' WHERE id > ? ORDER BY id LIMIT ?'
+
+        conns = self._table_conns(table_name)
+        rows = []
+
+        for conn in conns:
+            cur = conn.cursor()
+
+            if as_records:
+                rows.extend(fetch_records(cur, model, query,
+                                          (after_id, limit)))
+            else:
+                rows.extend(dict(row) for row in
+                            cur.execute(query, (after_id, limit)))
+
+        if len(conns) > 1:
+            rows.sort(key=lambda row: row.id if as_records else row['id'])
+            del rows[limit:]
+
+        return rows
+
     def get_user_by_username(self, username):
         """
         Returns a dictionary of one user's details
@@ -556,34 +828,19 @@ class WooMessageDB:
         Gets all of the messages in a chatroom, ordered by time
 
         :param chat_id: the id of the chat with the messages
-        :return: an ordered dictionary with the messages.
+        :return: a list of MessageRecord (name, message, time_ms)
         """
 
-        cur = self._conn.cursor()
-
-        list_of_messages = OrderedDict()
+        cur = self._chat_conn(chat_id).cursor()
 
         query = '''
-            SELECT user.name AS "name", message.message AS "message",
-            message.time AS "time", chat.title AS "title", chat.time AS
-            "created"
-            FROM user, message, chat
-            WHERE chat.id = ? AND message.chat_id = ? AND
-            user.id = message.user_id ORDER BY time
+            SELECT user.name, message.message, message.time_ms
+            FROM message JOIN user ON user.id = message.user_id
+            WHERE message.chat_id = ?
+            ORDER BY message.time_ms, message.id
         '''
 
-        for row in cur.execute(query, (chat_id, chat_id)):
-
-            message = row['message']
-            name = row['name']
-            time = row['time']
-
-            if message not in list_of_messages:
-                list_of_messages[name, message, time] = []
-
-            list_of_messages[name, message, time].append(row)
-
-        return list_of_messages
+        return fetch_records(cur, MessageRecord, query, (chat_id,))
 
     def get_chat_room_name(self, chat_id):
         """
@@ -594,7 +851,7 @@ class WooMessageDB:
         :return: name of the chat room
         """
 
-        cur = self._conn.cursor()
+        cur = self._chat_conn(chat_id).cursor()
 
         query = '''
             SELECT chat.title AS "chat_title"
@@ -616,63 +873,42 @@ class WooMessageDB:
         Gets all of the chat rooms that a user is a part of
 
         :param user_id: ID of the user
-        :return: an ordered dictionary containing the chat rooms
+        :return: a list of ChatRoomRecord, most recently active first;
+        unread is at most UNREAD_COUNT_CAP
         """
 
-        cur = self._conn.cursor()
-
-        room_data = OrderedDict()
-
-        query = '''
-            SELECT chat.title AS "title", user.name AS "participants",
-            chat.time AS "create_date", chat.id AS "id"
-            FROM chat, chat_rel, user
-            WHERE chat_rel.user_id = user.id
-            AND chat_rel.chat_id = chat.id
-            AND user.id = ?
-            ORDER BY chat.time, chat.title;
-        '''
-
-        for row in cur.execute(query, (user_id,)):
-            room_name = row['title']
-            room_date = row['create_date']
-            room_id = row['id']
+        conns = self._table_conns('chat_rel')
+        rooms = []
 
-            if room_name not in room_data:
-                room_data[room_name, room_date, room_id] = []
+        for conn in conns:
+            rooms.extend(fetch_records(conn.cursor(), ChatRoomRecord,
+                                       CHAT_ROOMS_QUERY,
+                                       (UNREAD_COUNT_CAP, user_id) +
+                                       CHAT_ROOMS_START + (-1,)))
 
-            room_data[room_name, room_date, room_id].append(row)
+        if len(conns) > 1:
+            rooms.sort(key=lambda room: (room.last_activity, room.id),
+                       reverse=True)
 
-        return room_data
+        return rooms
 
     def get_participants_in_chat(self, chat_id):
         """
-        A function that returns an ordered dictionary of participants
-        in a chat
+        A function that returns the names of the participants in a chat
 
         :param chat_id: ID of a chat
-        :return: an ordered dictionary of participants
+        :return: a list of participant names, sorted
         """
 
-        cur = self._conn.cursor()
-
-        participant_data = OrderedDict()
+        cur = self._chat_conn(chat_id).cursor()
 
         query = '''
-                SELECT user.name AS "name" FROM user, chat_rel
+                SELECT user.name FROM user, chat_rel
                 WHERE user.id = chat_rel.user_id AND chat_rel.chat_id = ?
-                ORDER BY name
+                ORDER BY user.name
             '''
 
-        for row in cur.execute(query, (chat_id,)):
-            participant = row['name']
-
-            if participant not in participant_data:
-                participant_data[participant] = []
-
-            participant_data[participant].append(row)
-
-        return participant_data
+        return [name for name, in cur.execute(query, (chat_id,))]
 
     def get_room_info(self, chatroom_id):
         """
@@ -683,13 +919,13 @@ class WooMessageDB:
         :return: an ordered dictionary of the chat room information
         """
 
-        cur = self._conn.cursor()
+        cur = self._chat_conn(chatroom_id).cursor()
 
         room_data = OrderedDict()
 
         query = '''
-                SELECT chat.title AS "title", chat.time AS "time"
-                FROM chat WHERE chat.id = ? ORDER BY time
+                SELECT chat.title AS "title", chat.time_ms AS "time"
+                FROM chat WHERE chat.id = ?
             '''
 
         for row in cur.execute(query, (chatroom_id,)):
@@ -718,19 +954,19 @@ class WooMessageDB:
         otherwise.
         """
 
-        cur = self._conn.cursor()
-
         query = '''
             SELECT * FROM chat WHERE title = ?
         '''
 
-        cur.execute(query, (title,))
+        for conn in self._table_conns('chat'):
+            cur = conn.cursor()
+            cur.execute(query, (title,))
 
-        content = cur.fetchone()
-        if content is not None:
-            return content['id']
-        else:
-            return None  # none instead of 0 because 0 might be a chat_id
+            content = cur.fetchone()
+            if content is not None:
+                return content['id']
+
+        return None  # none instead of 0 because 0 might be a chat_id
 
     def check_chat_rel(self, user_id, chat_id):
         """
@@ -745,7 +981,7 @@ class WooMessageDB:
                  is not in the chat
         """
 
-        cur = self._conn.cursor()
+        cur = self._chat_conn(chat_id).cursor()
 
         query = '''
             SELECT * FROM chat_rel
@@ -768,72 +1004,154 @@ class WooMessageDB:
 def init_db():
     """
     This will initialize the database and create the following tables: user,
-    chat, message, chat_rel
+    chat, message, chat_rel. Any existing tables are dropped first. A split
+    database also gets its SHARDS shard files, empty.
     """
     conn = get_db()
 
-    query = '''
-        DROP TABLE IF EXISTS user;
-        DROP TABLE IF EXISTS chat_rel;
-        DROP TABLE IF EXISTS chat;
-        DROP TABLE IF EXISTS message;
-
-        CREATE TABLE user (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            email TEXT UNIQUE,
-            username TEXT UNIQUE,
-            password TEXT
-        );
-        CREATE TABLE chat_rel(
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            chat_id INTEGER,
-            FOREIGN KEY(user_id) REFERENCES user(id)
-            FOREIGN KEY(chat_id) REFERENCES chat(id)
-        );
-        CREATE TABLE chat(
-            id INTEGER PRIMARY KEY,
-            title TEXT,
-            time TEXT
-        );
-        CREATE TABLE message (
-            id INTEGER PRIMARY KEY,
-            message TEXT,
-            time TEXT,
-            user_id INTEGER,
-            chat_id INTEGER,
-            FOREIGN KEY(user_id) REFERENCES user(id),
-            FOREIGN KEY(chat_id) REFERENCES chat(id)
-        );
-    '''
+    drop_tables(conn)
+    migrate(conn)
+
+    get_shard_router().create_shards()
+
+    get_query_cache().clear()
 
-    conn.cursor().executescript(query)
 
+def migrate_db():
+    """
+    Upgrades the application's database to the latest schema version in
+    place, keeping all of its data.
 
-def convert_csv_to_sqlite(filename):
+    :return: list of the (version, description) of applied migrations
+    """
+    applied = migrate(get_db())
+
+    get_shard_router().migrate_shards()
+
+    get_query_cache().clear()
+
+    return applied
+
+
+def rebuild_search_index():
+    """
+    Rebuilds the message_fts full-text index from the message table and
+    merges it into as few segments as possible. The triggers keep the index
+    up to date, so this is only needed if it was damaged or the message table
+    was written with the triggers off.
+
+    :return: the number of messages indexed
+    """
+    count = 0
+
+    for conn in get_table_dbs('message'):
+        conn.execute("INSERT INTO message_fts(message_fts) "
+                     "VALUES ('rebuild')")
+        conn.execute("INSERT INTO message_fts(message_fts) "
+                     "VALUES ('optimize')")
+        conn.commit()
+
+        count += conn.execute('SELECT count(*) FROM message').fetchone()[0]
+
+    return count
+
+
+def archive_old_messages(days=None):
+    """
+    Moves the messages older than days (by default the ARCHIVE_AFTER_DAYS
+    setting) out of the message table into the archive file of their
+    ARCHIVE_PERIOD (see archive.py). They stay readable in the chat pages
+    and the search.
+
+    :param days: the age in days of the oldest messages kept live
+    :return: dictionary of the number of messages archived per period
+    """
+    config = current_app.config
+    if days is None:
+        days = config['ARCHIVE_AFTER_DAYS']
+
+    # each shard has archive files of its own, named after its file
+    archived = {}
+    for conn in get_table_dbs('message'):
+        for period, count in archive_messages(
+                conn, now_ms() - days * 86400000,
+                period=config.get('ARCHIVE_PERIOD', 'year')).items():
+            archived[period] = archived.get(period, 0) + count
+
+    get_query_cache().clear()
+
+    return archived
+
+
+def convert_csv_to_sqlite(filename, resume=False, chunk_size=CHUNK_SIZE,
+                          workers=None, progress=None):
     """
     Initialises a db if non-existent and populates the db with data from a CSV
-    file.
+    file, in chunked transactions (see bulk_import.py).
 
     :param filename: the CSV filename where data is stored. The data must be
     in the columns titled 'Username', 'Password', 'Name', 'Email',
-    'Chat_Title', 'Title' and 'Message'
-    :return: None
+    'Chat_Title', 'Time' and 'Message'
+    :param resume: keep the existing data and continue an interrupted import
+    of the same file
+    :param chunk_size: rows written per transaction
+    :param workers: number of password hashing processes, None for one per
+    CPU
+    :param progress: function(stats) called after every chunk
+    :return: dictionary of the import's counters
     """
+    if get_shard_router().is_sharded:
+        raise RequestError(409, 'import into an unsplit database (SHARDS = '
+                                '1), then split it with flask reshard')
+
+    if resume:
+        migrate_db()
+    else:
+        init_db()  # creates database tables if non-existant
 
-    init_db()  # creates database tables if non-existant
+    stats = import_csv(get_db(), filename, resume, chunk_size, workers,
+                       progress, get_password_settings())
 
-    for row in csv_row_generator(filename):
+    get_query_cache().clear()
 
-        insert_table_info(username=row['Username'],
-                          password=row['Password'],
-                          name=row['Name'],
-                          email=row['Email'],
-                          chat_title=row['Chat_Title'],
-                          message_time=row['Time'],
-                          message_content=row['Message'],
-                          )
+    return stats
+
+
+def generate_synthetic_data(users, chats, messages, seed=0, zipf_s=1.1,
+                            median_members=6, days=365, end_ms=END_MS,
+                            chunk_size=SYNTHETIC_CHUNK_SIZE,
+                            progress=None):
+    """
+    Recreates the db and fills it with synthetic users, chats and messages
+    (see synthetic_data.py). Every user has the password
+    synthetic_data.PASSWORD.
+
+    :param users: the number of users
+    :param chats: the number of chats
+    :param messages: the number of messages
+    :param seed: the seed of the random choices, the same seed gives the
+    same data
+    :param zipf_s: the exponent of the chats' Zipf popularity
+    :param median_members: the median number of members of a chat
+    :param days: the messages are sent over the days before end_ms
+    :param end_ms: the time of the newest message
+    :param chunk_size: rows written per transaction
+    :param progress: function(stats) called after every message chunk
+    :return: dictionary of the generated counts and the seconds taken
+    """
+    if get_shard_router().is_sharded:
+        raise RequestError(409, 'generate into an unsplit database (SHARDS = '
+                                '1), then split it with flask reshard')
+
+    init_db()
+
+    stats = generate(get_db(), users, chats, messages, seed, zipf_s,
+                     median_members, days, end_ms, chunk_size,
+                     progress=progress)
+
+    get_query_cache().clear()
+
+    return stats
 
 
 def csv_row_generator(filename):
@@ -849,23 +1167,65 @@ def csv_row_generator(filename):
             yield row
 
 
+def get_db_pool():
+    """
+    Returns the connection pool of the application's database file, sized by
+    the DB_POOL_SIZE and DB_POOL_TIMEOUT settings. Its connections use the
+    STORAGE_PROFILE PRAGMAs, and the WAL is checkpointed every
+    WAL_CHECKPOINT_INTERVAL seconds.
+    """
+    config = current_app.config
+    profile = config.get('STORAGE_PROFILE') or {}
+
+    return get_pool(config['DATABASE'],
+                    max_size=config.get('DB_POOL_SIZE', 8),
+                    timeout=config.get('DB_POOL_TIMEOUT', 5.0),
+                    pragmas=profile.items(),
+                    checkpoint_interval=config.get('WAL_CHECKPOINT_INTERVAL'),
+                    checkpoint_mode=config.get('WAL_CHECKPOINT_MODE',
+                                               'TRUNCATE'))
+
+
+def get_shard_router():
+    """
+    Returns the shard router of the application's database, split into
+    SHARDS files by chat_id (see shard_router.py), with the pool settings of
+    get_db_pool().
+    """
+    config = current_app.config
+    profile = config.get('STORAGE_PROFILE') or {}
+
+    return get_router(config['DATABASE'], config.get('SHARDS', 1),
+                      max_size=config.get('DB_POOL_SIZE', 8),
+                      timeout=config.get('DB_POOL_TIMEOUT', 5.0),
+                      pragmas=profile.items(),
+                      checkpoint_interval=config.get(
+                          'WAL_CHECKPOINT_INTERVAL'),
+                      checkpoint_mode=config.get('WAL_CHECKPOINT_MODE',
+                                                 'TRUNCATE'))
+
+
 def connect_db():
     """
     Returns a sqlite connection object associated with the application's
-    database file.
+    database file, borrowed from the connection pool.
     """
 
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
+    return get_db_pool().acquire()
 
-    return conn
 
-
-def get_db():
+def get_db(chat_id=None):
     """
-    Returns a database connection. If a connection has already been created,
-    the existing connection is used, otherwise it creates a new connection.
+    Returns a database connection. If a connection has already been borrowed
+    in this app context, the existing connection is used, otherwise one is
+    borrowed from the pool. It is given back by close_db().
+
+    :param chat_id: the chat the caller reads or writes, whose shard's
+    connection is returned when the database is split (see
+    shard_router.py); None for the global file
     """
+    if chat_id is not None and current_app.config.get('SHARDS', 1) > 1:
+        return get_shard_db(get_shard_router().shard_of(chat_id))
 
     if not hasattr(g, 'sqlite_db'):
         g.sqlite_db = connect_db()
@@ -873,6 +1233,300 @@ def get_db():
     return g.sqlite_db
 
 
+def get_shard_db(shard):
+    """
+    Returns the app context's connection to a shard, borrowed from the
+    shard's pool on first use. It is given back by close_db().
+
+    :param shard: the shard number
+    :return: a sqlite connection, to the global file if it is not split
+    """
+    router = get_shard_router()
+
+    if not router.is_sharded:
+        return get_db()
+
+    if 'shard_dbs' not in g:
+        g.shard_dbs = {}
+
+    if shard not in g.shard_dbs:
+        g.shard_dbs[shard] = router.get_shard_pool(shard).acquire()
+
+    return g.shard_dbs[shard]
+
+
+def get_shard_dbs():
+    """
+    :return: list of the connections to every shard, by shard number, for
+    the queries that scatter over all the chats
+    """
+    return [get_shard_db(shard)
+            for shard in range(current_app.config.get('SHARDS', 1))]
+
+
+def get_table_dbs(table_name):
+    """
+    :param table_name: the name of a table
+    :return: list of the connections holding the table's rows
+    """
+    if table_name in SHARDED_TABLES:
+        return get_shard_dbs()
+
+    return [get_db()]
+
+
+def get_row_db(table_name, item_id):
+    """
+    Finds the connection holding a row by its id, probing the primary key
+    of every shard of a sharded table.
+
+    :param table_name: the name of the table
+    :param item_id: the id of the row
+    :return: the connection holding the row, or the first one holding the
+    table if there is no such row
+    """
+    dbs = get_table_dbs(table_name)
+
+    if len(dbs) > 1:
+        query = 'SELECT 1 FROM {} WHERE id = ?'.format(table_name)
+
+        for conn in dbs:
+            if conn.execute(query, (item_id,)).fetchone() is not None:
+                return conn
+
+    return dbs[0]
+
+
+def get_new_chat_db():
+    """
+    :return: the connection to the shard a new chat is created in, a random
+    one so that the chats spread evenly
+    """
+    return get_shard_db(random.randrange(current_app.config.get('SHARDS',
+                                                                1)))
+
+
+def close_db(error=None):
+    """
+    Gives the app context's connections back to their pools. Registered with
+    app.teardown_appcontext, so it runs at the end of every request.
+
+    :param error: the exception that ended the app context, if any
+    """
+    conn = g.pop('sqlite_db', None)
+
+    if conn is not None:
+        get_db_pool().release(conn)
+
+    shard_dbs = g.pop('shard_dbs', {})
+
+    if shard_dbs:
+        router = get_shard_router()
+
+        for shard, conn in shard_dbs.items():
+            router.get_shard_pool(shard).release(conn)
+
+
+def get_password_settings():
+    """
+    Returns the password policy of the application: new hashes use the
+    first of PASSWORD_HASH_SCHEMES with PASSWORD_HASH_ROUNDS rounds.
+    """
+    config = current_app.config
+
+    return crypt_settings(
+        tuple(config.get('PASSWORD_HASH_SCHEMES', ('sha256_crypt',))),
+        config.get('PASSWORD_HASH_ROUNDS', DEFAULT_ROUNDS))
+
+
+def get_password_hasher():
+    """
+    Returns the process pool that hashes and verifies passwords, with
+    HASH_WORKERS processes admitting at most HASH_MAX_QUEUE hashes at once.
+    """
+    config = current_app.config
+
+    return get_hash_pool(config.get('HASH_WORKERS', 2),
+                         config.get('HASH_MAX_QUEUE', 32),
+                         config.get('HASH_TIMEOUT', 10.0),
+                         get_password_settings())
+
+
+def get_query_cache():
+    """
+    Returns the read cache of the application's database (see
+    query_cache.py), holding at most QUERY_CACHE_SIZE results for
+    QUERY_CACHE_TTL seconds.
+    """
+    config = current_app.config
+
+    return get_cache(config['DATABASE'],
+                     config.get('QUERY_CACHE_SIZE', 1024),
+                     config.get('QUERY_CACHE_TTL', 60.0))
+
+
+def get_data_versions(scopes):
+    """
+    Reads the version counters of some scopes (see data_version in
+    migrations.py), without touching the tables they count.
+
+    :param scopes: scope names such as 'message' or 'chat:1'
+    :return: a list of the (version, modified_ms) of each scope, in order,
+    (0, None) for scopes that were never changed. A scope's version is the
+    sum of its versions in the global file and the shards, so it grows
+    whenever any of them changes.
+    """
+    dbs = [get_db()]
+    if get_shard_router().is_sharded:
+        dbs.extend(get_shard_dbs())
+
+    scopes = list(scopes)
+    query = ('SELECT scope, version, modified_ms FROM data_version '
+             'WHERE scope IN ({})'.format(', '.join('?' * len(scopes))))
+
+    found = {}
+    for conn in dbs:
+        for row in conn.execute(query, scopes):
+            version, modified_ms = found.get(row['scope'], (0, None))
+            if modified_ms is None or row['modified_ms'] is not None and \
+                    row['modified_ms'] > modified_ms:
+                modified_ms = row['modified_ms']
+
+            found[row['scope']] = (version + row['version'], modified_ms)
+
+    return [found.get(scope, (0, None)) for scope in scopes]
+
+
+def get_version_scopes(tags):
+    """
+    :param tags: the query cache tags of some data, e.g. ['user',
+    'chat_rel:3']
+    :return: the data_version scopes counting its changes, e.g. ['epoch',
+    'user', 'chat:3'] (a chat's memberships and messages count under it)
+    """
+    scopes = ['epoch']
+
+    for tag in tags:
+        table_name, _, row_id = tag.partition(':')
+        scopes.append('chat:' + row_id if row_id else table_name)
+
+    return scopes
+
+
+def get_request_versions(scopes):
+    """
+    Returns the version counters of some scopes as read by the first lookup
+    of each of them in this request (or app context). invalidate_cache()
+    forgets them, so the writes of this process are seen at once; the writes
+    of the others are seen from the next request on.
+
+    :param scopes: scope names such as 'user' or 'chat:1'
+    :return: a tuple of the (version, modified_ms) of each scope, in order
+    """
+    versions = g.setdefault('data_versions', {})
+    missing = [scope for scope in scopes if scope not in versions]
+
+    if missing:
+        versions.update(zip(missing, get_data_versions(missing)))
+
+    return tuple(versions[scope] for scope in scopes)
+
+
+def cached_query(tags):
+    """
+    Decorator that caches the results of a read function in the query
+    cache, keyed by its arguments. The data_version counters of the tags
+    (see get_version_scopes) are read once per request, so a result is not
+    returned after a write, whichever process made it. Results are copied on
+    the way out, so a caller changing one does not change the cached one.
+
+    :param tags: function of the read function's arguments returning the
+    tags of the data it reads, e.g. lambda chat_id: ['chat:' + chat_id]
+    :return: the decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            if not current_app.config.get('QUERY_CACHE', True):
+                return function(*args)
+
+            key = (function.__name__,) + tuple(str(arg) for arg in args)
+            read_tags = tags(*args)
+            version = get_request_versions(get_version_scopes(read_tags))
+            value = get_query_cache().get_or_load(key, read_tags,
+                                                  lambda: function(*args),
+                                                  version)
+
+            return copy.copy(value)
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate_cache(*tags):
+    """
+    Drops the cached reads of changed data. Called after the change is
+    committed.
+
+    :param tags: the names of the changed data, e.g. 'user', 'chat:1'
+    :return: None
+    """
+    g.pop('data_versions', None)
+    get_query_cache().invalidate(*tags)
+
+
+def get_message_broker():
+    """
+    Returns the broker that announces new messages of the application's
+    database to the chat room streams (see events.py).
+    """
+    return get_broker(current_app.config['DATABASE'])
+
+
+def get_group_commit_writer(chat_id):
+    """
+    Returns the group-commit writer of the file holding a chat (one writer
+    per shard) if GROUP_COMMIT is turned on, None otherwise. Its batches
+    stay open for GROUP_COMMIT_WINDOW seconds or GROUP_COMMIT_MAX_BATCH
+    operations.
+
+    :param chat_id: the id of the chat written to
+    """
+    config = current_app.config
+
+    if not config.get('GROUP_COMMIT'):
+        return None
+
+    profile = config.get('STORAGE_PROFILE') or {}
+    router = get_shard_router()
+
+    return get_writer(router.get_shard_path(router.shard_of(chat_id)),
+                      pragmas=profile.items(),
+                      window=config.get('GROUP_COMMIT_WINDOW', 0.002),
+                      max_batch=config.get('GROUP_COMMIT_MAX_BATCH', 256))
+
+
+def wait_for_write(future):
+    """
+    Waits for a group-commit operation to be committed. After
+    GROUP_COMMIT_TIMEOUT seconds the operation is cancelled, so a retry of
+    the request can not write it twice, unless its batch is already running,
+    which is then waited for.
+
+    :param future: the future returned by GroupCommitWriter.submit()
+    :return: the result of the operation
+    """
+    try:
+        return future.result(
+            timeout=current_app.config.get('GROUP_COMMIT_TIMEOUT', 5.0))
+    except concurrent.futures.TimeoutError:
+        if future.cancel():
+            raise RequestError(503, 'write was not committed in time')
+
+        return future.result()
+
+
 def get_date():
     """
     Returns the current date and time in yyyy/mm/dd  h/m format
@@ -894,8 +1548,8 @@ def insert_user(name, email, username, password):
     :return: inserted row as a dictionary
     """
 
-    # hash and salt password
-    password = sha256_crypt.encrypt(str(password))
+    # hash and salt password, in a worker process
+    password = get_password_hasher().hash(password)
 
     # Create cursor
     conn = get_db()
@@ -908,33 +1562,72 @@ def insert_user(name, email, username, password):
 
     # Commit to DB
     conn.commit()
+    invalidate_cache('user')
 
     cur.execute('SELECT * FROM user WHERE username = ?', (username,))
 
     return dict(cur.fetchone())
 
 
-def insert_message(message, time, user_id, chat_id):
+def insert_message(message, time, user_id, chat_id, time_ms=None):
     """
     Insert a message into the database. Keeps track of the user who sent the
     message, the chat in which the message was sent and the time when the
     message was sent.
     Returns a dictionary representing the newly inserted row.
 
+    With GROUP_COMMIT turned on the insert is committed together with the
+    other inserts of its batch (see group_commit.py).
+
     :param message: The content of the message being sent
     :param time: the time the message was sent
     :param user_id: the ID of the user who sent the message
     :param chat_id: the ID of the chat the message is sent to
+    :param time_ms: the time in milliseconds since the epoch, parsed from time
+    if not given
     :return:
     """
-    conn = get_db()
-    cur = conn.cursor()
+    if time_ms is None:
+        time_ms = parse_time(time) or now_ms()
+
+    writer = get_group_commit_writer(chat_id)
+    if writer is not None:
+        result = wait_for_write(writer.submit(insert_message_row, message,
+                                              time, user_id, chat_id,
+                                              time_ms))
+    else:
+        conn = get_db(chat_id)
+        cur = conn.cursor()
 
-    cur.execute('INSERT OR IGNORE INTO '
-                'message(message, time, user_id, chat_id)'
-                'VALUES(?, ?, ?, ?)', (message, time, user_id, chat_id))
+        result = insert_message_row(cur, message, time, user_id, chat_id,
+                                    time_ms)
 
-    conn.commit()
+        conn.commit()
+
+    # wake up the streams of the chat, now that the message is committed
+    get_message_broker().publish(result['chat_id'], result['id'])
+
+    return result
+
+
+def insert_message_row(cur, message, time, user_id, chat_id, time_ms):
+    """
+    Inserts a message without committing, shared by insert_message and the
+    group-commit writer. In a shard its id is picked by NEXT_ID.
+
+    :param cur: the cursor to the chat's file to insert with
+    :param message: The content of the message being sent
+    :param time: the time the message was sent
+    :param user_id: the ID of the user who sent the message
+    :param chat_id: the ID of the chat the message is sent to
+    :param time_ms: the time in milliseconds since the epoch
+    :return: inserted row as a dictionary
+    """
+    cur.execute('INSERT OR IGNORE INTO '
+                'message(id, message, time, user_id, chat_id, time_ms)'
+                'VALUES({}, ?, ?, ?, ?, ?)'.format(
+                    NEXT_ID.format(table='message')),
+                (message, time, user_id, chat_id, time_ms))
 
     message_id = cur.lastrowid
 
@@ -943,7 +1636,7 @@ def insert_message(message, time, user_id, chat_id):
     return dict(cur.fetchone())
 
 
-def insert_chat(title, time):
+def insert_chat(title, time, time_ms=None):
     """
     Insert a chat into the database ONLY IF a chat with the same title does
     not already exist.
@@ -952,19 +1645,28 @@ def insert_chat(title, time):
 
     :param title: chat title
     :param time: time the first message was sent in this chat
+    :param time_ms: the time in milliseconds since the epoch, parsed from time
+    if not given
     :return: inserted row as a dictionary
     """
-    conn = get_db()
-    cur = conn.cursor()
-
     chat_id = check_chat(title)  # check if this chat already exists
 
     if chat_id is None:
+        if time_ms is None:
+            time_ms = parse_time(time) or now_ms()
+
+        conn = get_new_chat_db()
+        cur = conn.cursor()
+
         cur.execute('INSERT INTO '
-                    'chat(title, time)'
-                    'VALUES(?, ?)', (title, time))
+                    'chat(id, title, time, time_ms)'
+                    'VALUES({}, ?, ?, ?)'.format(NEXT_ID.format(table='chat')),
+                    (title, time, time_ms))
         conn.commit()
         chat_id = cur.lastrowid
+        invalidate_cache('chat:{}'.format(chat_id))
+    else:
+        cur = get_db(chat_id).cursor()
 
     cur.execute('SELECT * FROM chat WHERE id = ?', (chat_id,))
 
@@ -978,26 +1680,49 @@ def insert_chat_rel(user_id, chat_id):
     Insert a chat relationship into the database that will link which user
     belongs to which chat
 
+    With GROUP_COMMIT turned on the insert is committed together with the
+    other inserts of its batch (see group_commit.py).
+
     :param user_id: ID of the user
     :param chat_id: ID of the chat
     :return: inserted row as a dictionary
     """
-    conn = get_db()
-    cur = conn.cursor()
+    writer = get_group_commit_writer(chat_id)
+    if writer is not None:
+        result = wait_for_write(writer.submit(insert_chat_rel_row, user_id,
+                                              chat_id))
+    else:
+        conn = get_db(chat_id)
+        cur = conn.cursor()
 
-    chat_rel_id = check_chat_rel(user_id, chat_id)
-
-    if chat_rel_id is None:
-        cur.execute('INSERT INTO '
-                    'chat_rel(user_id, chat_id) '
-                    'VALUES(?, ?)', (user_id, chat_id))
-        # we cannot use INSERT OR IGNORE INTO...
+        result = insert_chat_rel_row(cur, user_id, chat_id)
 
         conn.commit()
 
-        chat_rel_id = cur.lastrowid
+    invalidate_cache('chat_rel:{}'.format(chat_id))
+
+    return result
+
+
+def insert_chat_rel_row(cur, user_id, chat_id):
+    """
+    Inserts a chat relationship, unless the user is already in the chat,
+    without committing. Shared by insert_chat_rel and the group-commit
+    writer.
+
+    :param cur: the cursor to the chat's file to insert with
+    :param user_id: ID of the user
+    :param chat_id: ID of the chat
+    :return: the chat relationship row as a dictionary
+    """
+    # the UNIQUE chat_rel(user_id, chat_id) index makes this safe now
+    cur.execute('INSERT OR IGNORE INTO '
+                'chat_rel(id, user_id, chat_id) '
+                'VALUES({}, ?, ?)'.format(NEXT_ID.format(table='chat_rel')),
+                (user_id, chat_id))
 
-    cur.execute('SELECT * FROM chat_rel WHERE id = ?', (chat_rel_id,))
+    cur.execute('SELECT * FROM chat_rel WHERE user_id = ? AND chat_id = ?',
+                (user_id, chat_id))
 
     return dict(cur.fetchone())
 
@@ -1039,7 +1764,7 @@ def update_message(text, user_id, message_id):
     :param message_id: ID of the message
     :return: dictionary containing updated message
     """
-    conn = get_db()
+    conn = get_row_db('message', message_id)
     cur = conn.cursor()
 
     query = '''
@@ -1079,12 +1804,30 @@ def update_user(user_id, name):
     else:
         cur.execute(query, (name, user_id))
         conn.commit()
+        invalidate_cache('user')
 
     cur.execute('SELECT * FROM user WHERE id = ?', (user_id,))
 
     return dict(cur.fetchone())
 
 
+def update_user_password(user_id, password_hash):
+    """
+    Replaces the stored password hash of a user, e.g. with one made under the
+    current password policy when the user logs in.
+
+    :param user_id: the id of the user
+    :param password_hash: the new, already hashed, password
+    :return: None
+    """
+    conn = get_db()
+
+    conn.execute('UPDATE user SET password = ? WHERE id = ?',
+                 (password_hash, user_id))
+    conn.commit()
+    invalidate_cache('user')
+
+
 def update_chat(chat_id, title):
     """
     Updates a chat title given a specific chat_id
@@ -1094,7 +1837,7 @@ def update_chat(chat_id, title):
     :return: a dictionary representing the updated chat title
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
     query = '''
@@ -1106,12 +1849,59 @@ def update_chat(chat_id, title):
     else:
         cur.execute(query, (title, chat_id))
         conn.commit()
+        invalidate_cache('chat:{}'.format(chat_id))
 
     cur.execute('SELECT * FROM chat WHERE id = ?', (chat_id,))
 
     return dict(cur.fetchone())
 
 
+def mark_read(user_id, chat_id, message_id=None):
+    """
+    Moves a member's read watermark of a chat forward to a message. A
+    watermark never moves back, so an older message_id changes nothing.
+
+    :param user_id: the id of the member
+    :param chat_id: the id of the chat
+    :param message_id: the newest message read, None for the newest message
+    of the chat
+    :return: the member's watermark, None if the user is not in the chat
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    # the newest message of the chat is in its summary
+    cur.execute('''
+        SELECT chat_rel.last_read_id,
+        coalesce(?, chat_summary.last_message_id, 0)
+        FROM chat_rel LEFT JOIN chat_summary
+        ON chat_summary.chat_id = chat_rel.chat_id
+        WHERE chat_rel.user_id = ? AND chat_rel.chat_id = ?
+    ''', (message_id, user_id, chat_id))
+    row = cur.fetchone()
+
+    if row is None:
+        return None
+
+    last_read_id, message_id = row
+    if message_id <= last_read_id:
+        return last_read_id
+
+    # only a watermark that moves is written, which bumps its versions, so
+    # a chat read again takes no write lock
+    cur.execute('''
+        UPDATE chat_rel SET last_read_id = max(last_read_id, ?)
+        WHERE user_id = ? AND chat_id = ?
+    ''', (message_id, user_id, chat_id))
+    conn.commit()
+
+    cur.execute('SELECT last_read_id FROM chat_rel '
+                'WHERE user_id = ? AND chat_id = ?', (user_id, chat_id))
+    row = cur.fetchone()
+
+    return row[0] if row is not None else None
+
+
 def delete_item(table_name, item_id):
     """
     This function deletes items from a table based on their item_id
@@ -1120,13 +1910,26 @@ def delete_item(table_name, item_id):
     :param item_id: item which to delete
     :return: NONE
     """
-    conn = get_db()
+    conn = get_row_db(table_name, item_id)
     cur = conn.cursor()
+    tags = [table_name]
+
+    # the cached reads of a chat's rows are tagged by the chat's id
+    chat_id = item_id if table_name == 'chat' else None
+    if table_name in ('chat_rel', 'message'):
+        cur.execute('SELECT chat_id FROM {} WHERE id = ?'.format(table_name),
+                    (item_id,))
+        row = cur.fetchone()
+        chat_id = row[0] if row is not None else None
+
+    if chat_id is not None:
+        tags += ['chat:{}'.format(chat_id), 'chat_rel:{}'.format(chat_id)]
 
     query = 'DELETE FROM {} WHERE id = ?'.format(table_name)
 
     cur.execute(query, (item_id,))
     conn.commit()
+    invalidate_cache(*tags)
 
     return None
 
@@ -1140,20 +1943,20 @@ def check_chat(title):
     :return: None if the chat doesn't exist. Returns the chat id otherwise.
     """
 
-    conn = get_db()
-    cur = conn.cursor()
-
     query = '''
     SELECT * FROM chat WHERE title = ?
     '''
 
-    cur.execute(query, (title,))
+    # the chat may be in any shard
+    for conn in get_table_dbs('chat'):
+        cur = conn.cursor()
+        cur.execute(query, (title,))
 
-    content = cur.fetchone()
-    if content is not None:
-        return content['id']
-    else:
-        return None  # none instead of 0 because 0 might be a chat_id
+        content = cur.fetchone()
+        if content is not None:
+            return content['id']
+
+    return None  # none instead of 0 because 0 might be a chat_id
 
 
 def check_chat_rel(user_id, chat_id):
@@ -1169,7 +1972,7 @@ def check_chat_rel(user_id, chat_id):
              is not in the chat
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
     query = '''
@@ -0,0 +1,145 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the in-process publish/subscribe of new chat messages.
+
+insert_message publishes the id of every message it commits to the broker
+of its database. Open chat rooms subscribe to it through the
+/chat_room/<id>/stream Server-Sent Events endpoint: they sleep until their
+chat has a message newer than the last one they were sent, then read just
+the new rows through the message(chat_id, id) index. Nothing is read while a
+chat is quiet, instead of every tab reloading the whole chat history every
+few seconds.
+
+The new rows are read from the database rather than handed over by the
+broker, because messages committed by different threads can be published in
+a different order than their ids. Reading id > last id after the wake-up
+always sees every message committed before the one that was published, and
+it is the same query that replays what a reconnecting client (Last-Event-ID)
+has missed.
+
+The broker only sees messages inserted by this process. When the app runs in
+several processes, each has its own broker and a message only wakes up the
+streams served by the process that inserted it.
+"""
+
+import collections
+import threading
+
+# the most chats whose latest message id the broker remembers
+LATEST_CHATS = 4096
+
+
+class MessageBroker:
+    """
+    Keeps the id of the latest message of the recently written chats and
+    wakes up the threads waiting for a newer one.
+
+    A chat has a channel, its condition, only while threads wait on it, and
+    the latest ids are kept for the max_chats most recently written chats,
+    so a long-running process does not keep one of each for every chat it
+    ever served.
+    """
+
+    def __init__(self, max_chats=LATEST_CHATS):
+        """
+        :param max_chats: the most chats whose latest id is remembered
+        """
+        self._lock = threading.Lock()
+        self._max_chats = max_chats
+        self._latest = collections.OrderedDict()
+        self._channels = {}
+        self._published = 0
+        self._waiting = 0
+
+    def publish(self, chat_id, message_id):
+        """
+        Announces a committed message and wakes up the subscribers of its
+        chat.
+
+        :param chat_id: the id of the chat
+        :param message_id: the id of the new message
+        :return: None
+        """
+        chat_id = int(chat_id)
+
+        with self._lock:
+            self._latest[chat_id] = max(self._latest.get(chat_id, 0),
+                                        int(message_id))
+            self._latest.move_to_end(chat_id)
+            while len(self._latest) > self._max_chats:
+                self._latest.popitem(last=False)
+
+            self._published += 1
+
+            channel = self._channels.get(chat_id)
+            if channel is not None:
+                channel['condition'].notify_all()
+
+    def wait(self, chat_id, last_id, timeout):
+        """
+        Blocks until a message newer than last_id is published to the chat
+        or timeout seconds have passed.
+
+        :param chat_id: the id of the chat
+        :param last_id: the id of the last message the subscriber has seen
+        :param timeout: the most seconds to wait
+        :return: True if a newer message was published
+        """
+        chat_id = int(chat_id)
+
+        with self._lock:
+            channel = self._channels.get(chat_id)
+            if channel is None:
+                channel = self._channels[chat_id] = {
+                    'condition': threading.Condition(self._lock),
+                    'waiters': 0,
+                }
+
+            channel['waiters'] += 1
+            self._waiting += 1
+
+            try:
+                return channel['condition'].wait_for(
+                    lambda: self._latest.get(chat_id, 0) > last_id, timeout)
+            finally:
+                self._waiting -= 1
+                channel['waiters'] -= 1
+
+                # the last one out drops the channel
+                if not channel['waiters']:
+                    del self._channels[chat_id]
+
+    def stats(self):
+        """
+        :return: dictionary of the number of chats remembered and waited
+        on, published messages and waiting subscribers
+        """
+        with self._lock:
+            return {'chats': len(self._latest),
+                    'channels': len(self._channels),
+                    'published': self._published,
+                    'waiting': self._waiting}
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker(database):
+    """
+    Returns the broker of a database file, creating it on first use.
+
+    :param database: the database file name
+    :return: a MessageBroker
+    """
+    with _brokers_lock:
+        broker = _brokers.get(database)
+
+        if broker is None:
+            broker = _brokers[database] = MessageBroker()
+
+    return broker
@@ -14,14 +14,17 @@ class RequestError(Exception):
     Custom exception class for handling errors in a request.
     """
 
-    def __init__(self, status_code, error_message):
+    def __init__(self, status_code, error_message, headers=None):
         Exception.__init__(self)
 
         self.status_code = str(status_code)
         self.error_message = str(error_message)
+        # extra response headers, e.g. Retry-After on a 503
+        self.headers = headers or {}
 
     def to_response(self):
         response = jsonify({'error': self.error_message})
         response.status = self.status_code
+        response.headers.update(self.headers)
         return response
 # END: Taken from homework 18
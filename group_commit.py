@@ -0,0 +1,261 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the group-commit writer for the WooMessages database.
+
+Committing every insert on its own costs one journal sync per message. With
+GROUP_COMMIT turned on, insert_message and insert_chat_rel hand their work to
+a GroupCommitWriter instead: one thread that owns a connection, collects the
+operations queued within a short window (or until a batch is full), runs
+them in a single transaction and commits once for the whole batch.
+
+Durability: a caller's future is only resolved after the COMMIT of its batch
+has returned, so a caller never sees a row that could still be rolled back.
+The commit is as durable as the connection's synchronous setting: with the
+WAL profile (synchronous=NORMAL) it survives an app crash but may be lost on
+power failure; with synchronous=FULL it survives both. Operations still
+queued when the process dies were never acknowledged and are lost. Each
+operation runs under its own savepoint, so one failing insert does not undo
+the others in its batch.
+
+A caller that stops waiting cancels its future: a cancelled operation is
+skipped if its batch has not started yet, so it is never committed behind
+the caller's back.
+"""
+
+import concurrent.futures
+import queue
+import sqlite3
+import threading
+import time
+
+
+class GroupCommitWriter:
+    """
+    A thread that runs queued write operations against one database file and
+    commits them in batches.
+
+    An operation is a function taking a sqlite cursor and its arguments and
+    returning a result (for example the inserted row as a dictionary).
+    """
+
+    def __init__(self, database, pragmas=(), window=0.002, max_batch=256):
+        """
+        Starts the writer thread.
+
+        :param database: the database file name
+        :param pragmas: sequence of (name, value) PRAGMAs for the connection
+        :param window: seconds to wait for more operations after the first
+        one of a batch arrives
+        :param max_batch: the most operations committed together
+        """
+        self._database = database
+        self._pragmas = tuple(pragmas)
+        self._window = window
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+        self._batches = 0
+        self._operations = 0
+        self._failures = 0
+        self._largest_batch = 0
+        self._commit_time = 0.0
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='group-commit-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, operation, *args):
+        """
+        Queues an operation for the next batch.
+
+        :param operation: function(cursor, *args) doing the write
+        :param args: the arguments of the operation
+        :return: a concurrent.futures.Future resolved with the result of the
+        operation once its batch is committed. Cancelling it before its batch
+        starts skips the operation
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((operation, args, future))
+
+        return future
+
+    def close(self):
+        """
+        Commits everything already queued and stops the writer thread.
+
+        :return: None
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        """
+        Returns the counters of the writer.
+
+        :return: dictionary of batches, operations, queue depth and average
+        batch size and commit time
+        """
+        with self._lock:
+            batches = self._batches or 1
+
+            return {
+                'database': self._database,
+                'batches': self._batches,
+                'operations': self._operations,
+                'failures': self._failures,
+                'queued': self._queue.qsize(),
+                'largest_batch': self._largest_batch,
+                'average_batch': round(self._operations / batches, 2),
+                'average_commit_ms': round(self._commit_time * 1000 /
+                                           batches, 3),
+            }
+
+    def _next_batch(self):
+        """
+        Waits for an operation, then gathers more for up to window seconds or
+        until max_batch operations are queued.
+
+        :return: list of queued operations, None when the writer is closed
+        """
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self._window
+
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            if item is None:
+                # finish this batch, then stop
+                self._queue.put(None)
+                break
+
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        """
+        The writer thread: commits batches until close() is called.
+        """
+        conn = sqlite3.connect(self._database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self._pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            # the operations cancelled by their callers are skipped, the
+            # others can no longer be cancelled
+            batch = [item for item in batch
+                     if item[2].set_running_or_notify_cancel()]
+            if batch:
+                self._commit_batch(conn, batch)
+
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        """
+        Runs a batch of operations in one transaction and resolves their
+        futures after the commit.
+
+        :param conn: the writer's connection
+        :param batch: list of (operation, args, future)
+        :return: None
+        """
+        start = time.perf_counter()
+        cur = conn.cursor()
+        outcomes = []
+
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+
+            for operation, args, future in batch:
+                cur.execute('SAVEPOINT operation')
+                try:
+                    outcomes.append((future, operation(cur, *args), None))
+                    cur.execute('RELEASE operation')
+                except Exception as error:
+                    cur.execute('ROLLBACK TO operation')
+                    cur.execute('RELEASE operation')
+                    outcomes.append((future, None, error))
+
+            conn.commit()
+        except Exception as error:
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, error) for _, _, future in batch]
+
+        with self._lock:
+            self._batches += 1
+            self._operations += len(batch)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._commit_time += time.perf_counter() - start
+
+            for future, result, error in outcomes:
+                if error is not None:
+                    self._failures += 1
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database, pragmas=(), window=0.002, max_batch=256):
+    """
+    Returns the shared writer of a database file, starting it on first use.
+    The settings only apply when the writer is started.
+
+    :param database: the database file name
+    :param pragmas: sequence of (name, value) PRAGMAs for the connection
+    :param window: seconds a batch stays open for more operations
+    :param max_batch: the most operations committed together
+    :return: a GroupCommitWriter
+    """
+    with _writers_lock:
+        writer = _writers.get(database)
+
+        if writer is None:
+            writer = GroupCommitWriter(database, pragmas, window, max_batch)
+            _writers[database] = writer
+
+    return writer
+
+
+def close_writer(database):
+    """
+    Stops the writer of a database file, if there is one, after it has
+    committed everything queued.
+
+    :param database: the database file name
+    :return: None
+    """
+    with _writers_lock:
+        writer = _writers.pop(database, None)
+
+    if writer is not None:
+        writer.close()
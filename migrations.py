@@ -0,0 +1,634 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the versioned schema migrations for the WooMessages
+database.
+
+The schema version of a database file is stored in SQLite's
+PRAGMA user_version. Every migration below upgrades the schema by exactly one
+version and runs inside its own transaction, so an existing database can be
+upgraded in place without losing any of its data.
+"""
+
+from timestamps import parse_time
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def _create_base_tables(cur):
+    """
+    Version 1: the original user, chat_rel, chat and message tables.
+
+    The tables are only created if they do not exist yet, so databases made
+    before versioning was introduced (user_version 0) keep their data.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            email TEXT UNIQUE,
+            username TEXT UNIQUE,
+            password TEXT
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS chat_rel(
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            chat_id INTEGER,
+            FOREIGN KEY(user_id) REFERENCES user(id)
+            FOREIGN KEY(chat_id) REFERENCES chat(id)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS chat(
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            time TEXT
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS message (
+            id INTEGER PRIMARY KEY,
+            message TEXT,
+            time TEXT,
+            user_id INTEGER,
+            chat_id INTEGER,
+            FOREIGN KEY(user_id) REFERENCES user(id),
+            FOREIGN KEY(chat_id) REFERENCES chat(id)
+        )
+    ''')
+
+
+def _add_query_indexes(cur):
+    """
+    Version 2: indexes for the lookups in queries.py and database_class.py.
+
+    message(chat_id, time)       -- get_messages_in_chatroom
+    chat_rel(user_id, chat_id)   -- check_chat_rel, get_chat_rooms
+    chat_rel(chat_id)            -- get_participants_in_chat
+    chat(title)                  -- check_chat
+
+    Older databases may hold the same user twice in a chat, so duplicate
+    chat_rel rows are removed (keeping the first one) before the UNIQUE index
+    is built.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        DELETE FROM chat_rel WHERE id NOT IN (
+            SELECT min(id) FROM chat_rel GROUP BY user_id, chat_id
+        )
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS message_chat_time '
+                'ON message(chat_id, time)')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS chat_rel_user_chat '
+                'ON chat_rel(user_id, chat_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS chat_rel_chat '
+                'ON chat_rel(chat_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS chat_title ON chat(title)')
+
+
+def _backfill_time_ms(cur, table_name):
+    """
+    Fills the time_ms column of a table by parsing its time column, in
+    batches of BACKFILL_BATCH_SIZE rows. Times that can't be parsed are
+    stored as 0 so that they sort first.
+
+    :param cur: cursor of the database being migrated
+    :param table_name: message or chat
+    :return: None
+    """
+    select = 'SELECT id, time FROM {} WHERE id > ? ' \
+             'ORDER BY id LIMIT ?'.format(table_name)
+    update = 'UPDATE {} SET time_ms = ? WHERE id = ?'.format(table_name)
+
+    last_id = -1
+    while True:
+        rows = cur.execute(select, (last_id, BACKFILL_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+
+        cur.executemany(update, ((parse_time(time) or 0, row_id)
+                                 for row_id, time in rows))
+        last_id = rows[-1][0]
+
+
+def _add_time_ms_columns(cur):
+    """
+    Version 3: sortable epoch-millisecond timestamps.
+
+    Adds an integer time_ms column to message and chat, backfills it from the
+    month-first time text, and replaces the message(chat_id, time) index with
+    message(chat_id, time_ms). Because id is the rowid it is the implicit last
+    column of that index, so ORDER BY time_ms, id is read straight from it.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('ALTER TABLE message ADD COLUMN time_ms INTEGER')
+    cur.execute('ALTER TABLE chat ADD COLUMN time_ms INTEGER')
+
+    _backfill_time_ms(cur, 'message')
+    _backfill_time_ms(cur, 'chat')
+
+    cur.execute('DROP INDEX IF EXISTS message_chat_time')
+    cur.execute('CREATE INDEX message_chat_time_ms '
+                'ON message(chat_id, time_ms)')
+
+
+def _add_import_checkpoint_table(cur):
+    """
+    Version 4: progress of the bulk CSV importer.
+
+    The importer stores how many rows of a CSV file it has imported in the
+    same transaction as the rows themselves, so an interrupted import can be
+    resumed exactly where its last committed chunk ended.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS import_checkpoint(
+            source TEXT PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            time_ms INTEGER
+        )
+    ''')
+
+
+def _add_message_chat_id_index(cur):
+    """
+    Version 5: index for reading the messages of a chat after a message id.
+
+    The chat_room stream and the delta-sync API ask for
+    WHERE chat_id = ? AND id > ? ORDER BY id, which message(chat_id, time_ms)
+    can not answer without sorting.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('CREATE INDEX message_chat_id ON message(chat_id, id)')
+
+
+NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+# the data_version scopes bumped by a change to a row of each table, as SQL
+# expressions of the changed row (NEW or OLD)
+VERSION_SCOPES = {
+    'user': ["'user'"],
+    'chat': ["'chat'", "'chat:' || {row}.id"],
+    'chat_rel': ["'chat_rel'", "'chat:' || {row}.chat_id"],
+    'message': ["'message'", "'chat:' || {row}.chat_id"],
+}
+
+
+# the scopes bumped when a member's read watermark moves (version 8)
+READ_SCOPES = ["'read:user:' || {row}.user_id",
+               "'read:chat:' || {row}.chat_id"]
+
+
+def _bump_versions(table_name, row, scopes=None):
+    """
+    :param table_name: the changed table
+    :param row: NEW or OLD
+    :param scopes: the scope expressions to bump, by default the
+    VERSION_SCOPES of the table
+    :return: the trigger statements that bump the scopes of a changed row
+    """
+    statement = ('''
+        INSERT INTO data_version(scope, version, modified_ms)
+        VALUES ({scope}, 1, {now})
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1,
+        modified_ms = excluded.modified_ms;
+    ''')
+
+    if scopes is None:
+        scopes = VERSION_SCOPES[table_name]
+
+    return ''.join(statement.format(scope=scope.format(row=row), now=NOW_MS)
+                   for scope in scopes)
+
+
+def _add_data_versions(cur):
+    """
+    Version 6: version counters for conditional GETs.
+
+    data_version holds a counter per table ('message', ...) and per chat
+    ('chat:1', ...), with the time of its last change. Triggers bump them on
+    every insert, update and delete, whoever makes it, so a response can be
+    tagged with the counters it was built from and a repeated GET can be
+    answered with 304 Not Modified by reading just those counters.
+
+    The 'epoch' row is random, so that tags from before the database was
+    recreated never match.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS data_version(
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            modified_ms INTEGER
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        INSERT OR IGNORE INTO data_version(scope, version, modified_ms)
+        VALUES ('epoch', abs(random() % 1000000000), {})
+    '''.format(NOW_MS))
+
+    for table_name in VERSION_SCOPES:
+        for event, rows in (('INSERT', ['NEW']), ('DELETE', ['OLD']),
+                            ('UPDATE', ['OLD', 'NEW'])):
+            bumps = ''.join(_bump_versions(table_name, row) for row in rows)
+
+            cur.execute('''
+                CREATE TRIGGER {table}_{name}_version
+                AFTER {event} ON {table}
+                BEGIN {bumps} END
+            '''.format(table=table_name, name=event.lower(), event=event,
+                       bumps=bumps))
+
+
+def _add_message_search(cur):
+    """
+    Version 7: full-text search of the messages.
+
+    message_fts is an FTS5 index of message.message that keeps no copy of
+    the text (content='message'), keyed by the message id. Triggers keep it
+    in step with every insert, update and delete of a message; the messages
+    already in the database are indexed here (see also rebuild_search_index
+    in database_class.py).
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE VIRTUAL TABLE message_fts USING fts5(
+            message, content='message', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    cur.execute('''
+        CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+            INSERT INTO message_fts(rowid, message)
+            VALUES (NEW.id, NEW.message);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+            INSERT INTO message_fts(message_fts, rowid, message)
+            VALUES ('delete', OLD.id, OLD.message);
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER message_fts_update AFTER UPDATE OF message ON message
+        BEGIN
+            INSERT INTO message_fts(message_fts, rowid, message)
+            VALUES ('delete', OLD.id, OLD.message);
+            INSERT INTO message_fts(rowid, message)
+            VALUES (NEW.id, NEW.message);
+        END
+    ''')
+    cur.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+
+def _add_read_watermarks(cur):
+    """
+    Version 8: per-member read watermarks.
+
+    chat_rel.last_read_id is the id of the newest message of the chat the
+    member has seen. The unread messages of a member are the messages of the
+    chat with a greater id, counted through the message(chat_id, id) index,
+    and the members whose watermark has reached a message are the ones who
+    have read it. One row per member, whatever the number of messages.
+
+    Moving a watermark bumps the 'read:user:<user id>' and
+    'read:chat:<chat id>' data_version scopes instead of 'chat_rel', so
+    reading a chat does not change the tags of every chat_rel response.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('ALTER TABLE chat_rel '
+                'ADD COLUMN last_read_id INTEGER NOT NULL DEFAULT 0')
+
+    cur.execute('DROP TRIGGER chat_rel_update_version')
+    cur.execute('''
+        CREATE TRIGGER chat_rel_update_version
+        AFTER UPDATE OF id, user_id, chat_id ON chat_rel
+        BEGIN {} END
+    '''.format(_bump_versions('chat_rel', 'OLD') +
+               _bump_versions('chat_rel', 'NEW')))
+
+    cur.execute('''
+        CREATE TRIGGER chat_rel_read_version
+        AFTER UPDATE OF last_read_id ON chat_rel
+        BEGIN {} END
+    '''.format(_bump_versions('chat_rel', 'NEW', READ_SCOPES)))
+
+
+# the newest message id and the last activity (the newest message, or the
+# creation of the chat) of a chat, read through single entries of the
+# message(chat_id, id) and message(chat_id, time_ms) indexes
+_LAST_MESSAGE = '''
+    last_message_id = (SELECT max(id) FROM message WHERE chat_id = {chat}),
+    last_activity = max(
+        coalesce((SELECT time_ms FROM chat WHERE id = {chat}), 0),
+        coalesce((SELECT max(time_ms) FROM message
+                  WHERE chat_id = {chat}), 0))
+'''
+
+
+def _add_chat_summaries(cur):
+    """
+    Version 9: denormalized chat summaries.
+
+    chat_summary holds one row per chat: its newest message, the time of its
+    last activity, and its numbers of messages and members. Triggers on
+    chat, chat_rel and message keep it up to date by adding or subtracting
+    one per changed row, or by reading one entry of a message index, so the
+    dashboard never aggregates the message table. The
+    chat_summary(last_activity) index lists the chats by recent activity.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE chat_summary(
+            chat_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER,
+            last_activity INTEGER NOT NULL DEFAULT 0,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            participant_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(chat_id) REFERENCES chat(id)
+        )
+    ''')
+    cur.execute('CREATE INDEX chat_summary_activity '
+                'ON chat_summary(last_activity)')
+
+    cur.execute('''
+        INSERT INTO chat_summary(chat_id, message_count, participant_count)
+        SELECT id,
+        (SELECT count(*) FROM message WHERE chat_id = chat.id),
+        (SELECT count(*) FROM chat_rel WHERE chat_id = chat.id)
+        FROM chat
+    ''')
+    cur.execute('UPDATE chat_summary SET ' +
+                _LAST_MESSAGE.format(chat='chat_summary.chat_id'))
+
+    cur.execute('''
+        CREATE TRIGGER chat_summary_chat_insert AFTER INSERT ON chat BEGIN
+            INSERT INTO chat_summary(chat_id, last_activity)
+            VALUES (NEW.id, coalesce(NEW.time_ms, 0));
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER chat_summary_chat_delete AFTER DELETE ON chat BEGIN
+            DELETE FROM chat_summary WHERE chat_id = OLD.id;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER chat_summary_chat_update AFTER UPDATE OF time_ms ON chat
+        BEGIN
+            UPDATE chat_summary SET {} WHERE chat_id = NEW.id;
+        END
+    '''.format(_LAST_MESSAGE.format(chat='NEW.id')))
+
+    cur.execute('''
+        CREATE TRIGGER chat_summary_message_insert AFTER INSERT ON message
+        BEGIN
+            UPDATE chat_summary SET message_count = message_count + 1,
+            last_message_id = max(coalesce(last_message_id, 0), NEW.id),
+            last_activity = max(last_activity, coalesce(NEW.time_ms, 0))
+            WHERE chat_id = NEW.chat_id;
+        END
+    ''')
+    subtract_message = '''
+        UPDATE chat_summary SET message_count = message_count - 1, {}
+        WHERE chat_id = OLD.chat_id;
+    '''.format(_LAST_MESSAGE.format(chat='OLD.chat_id'))
+    cur.execute('''
+        CREATE TRIGGER chat_summary_message_delete AFTER DELETE ON message
+        BEGIN {} END
+    '''.format(subtract_message))
+    # the old chat loses the message and the new one gains it (they may be
+    # the same chat)
+    cur.execute('''
+        CREATE TRIGGER chat_summary_message_update
+        AFTER UPDATE OF id, chat_id, time_ms ON message
+        BEGIN
+            {}
+            UPDATE chat_summary SET message_count = message_count + 1, {}
+            WHERE chat_id = NEW.chat_id;
+        END
+    '''.format(subtract_message, _LAST_MESSAGE.format(chat='NEW.chat_id')))
+
+    for event, changes in (('INSERT', [('NEW', '+')]),
+                           ('DELETE', [('OLD', '-')]),
+                           ('UPDATE OF chat_id', [('OLD', '-'),
+                                                  ('NEW', '+')])):
+        cur.execute('''
+            CREATE TRIGGER chat_summary_chat_rel_{name}
+            AFTER {event} ON chat_rel
+            BEGIN {updates} END
+        '''.format(name=event.split()[0].lower(), event=event,
+                   updates=''.join(
+                       'UPDATE chat_summary SET participant_count = '
+                       'participant_count {} 1 WHERE chat_id = {}.chat_id;'
+                       .format(sign, row) for row, sign in changes)))
+
+
+def _add_message_archive_catalog(cur):
+    """
+    Version 10: the catalog of the message archive files.
+
+    Old messages can be moved out of the message table into one archive
+    database file per period (see archive.py). message_archive lists those
+    files, with the file name relative to the directory of this database,
+    the schema name they are attached under and the number and time range
+    of the messages they hold. The message(time_ms) index finds the
+    messages older than the archive cutoff.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE message_archive(
+            period TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            schema_name TEXT NOT NULL UNIQUE,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            first_time_ms INTEGER,
+            last_time_ms INTEGER,
+            archived_ms INTEGER
+        )
+    ''')
+    cur.execute('CREATE INDEX message_time_ms ON message(time_ms)')
+
+
+def _add_shard_meta(cur):
+    """
+    Version 11: the shard description of a database file.
+
+    A shard file of a database split by chat_id (see shard_router.py) holds
+    one shard_meta row: its shard number, the number of shards and the id
+    floor. A new row of its chat, chat_rel and message tables gets the
+    smallest id above the floor and the ids already there that is equal to
+    shard + 1 modulo shards, so the ids of different shards never collide.
+    In an unsplit database the table is empty and SQLite picks the ids.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE shard_meta(
+            shard INTEGER NOT NULL,
+            shards INTEGER NOT NULL,
+            id_floor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _add_id_high_water(cur):
+    """
+    Version 12: the highest id ever given to a row of a table.
+
+    SQLite gives a new row the id after the largest one in its table, so
+    once the newest messages are moved to an archive (see archive.py) their
+    ids would be given again. The archive job raises the high water mark of
+    the message table before it deletes a batch, and the id of a new row is
+    picked above it (NEXT_ID in shard_router.py). A table without a row
+    here keeps the ids SQLite picks.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('''
+        CREATE TABLE id_high_water(
+            table_name TEXT PRIMARY KEY,
+            high INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _drop_chat_summary_activity(cur):
+    """
+    Version 13: drops the chat_summary(last_activity) index.
+
+    The dashboard finds a user's chats through chat_rel(user_id, chat_id)
+    and sorts those few by activity, so the index was never read, while the
+    message triggers updated it on every message.
+
+    :param cur: cursor of the database being migrated
+    :return: None
+    """
+    cur.execute('DROP INDEX IF EXISTS chat_summary_activity')
+
+
+# (version, description, function) -- append new migrations to the end
+MIGRATIONS = [
+    (1, 'create user, chat_rel, chat and message tables', _create_base_tables),
+    (2, 'add indexes for chat, chat_rel and message lookups',
+     _add_query_indexes),
+    (3, 'add epoch-millisecond time_ms columns to message and chat',
+     _add_time_ms_columns),
+    (4, 'add import_checkpoint table for resumable CSV imports',
+     _add_import_checkpoint_table),
+    (5, 'add message(chat_id, id) index for reads after a message id',
+     _add_message_chat_id_index),
+    (6, 'add data_version counters bumped by triggers', _add_data_versions),
+    (7, 'add message_fts full-text index of the messages',
+     _add_message_search),
+    (8, 'add chat_rel.last_read_id read watermarks', _add_read_watermarks),
+    (9, 'add chat_summary rows kept up to date by triggers',
+     _add_chat_summaries),
+    (10, 'add message_archive catalog and message(time_ms) index',
+     _add_message_archive_catalog),
+    (11, 'add shard_meta for databases split by chat_id', _add_shard_meta),
+    (12, 'add id_high_water marks of the ids given before archiving',
+     _add_id_high_water),
+    (13, 'drop the unused chat_summary(last_activity) index',
+     _drop_chat_summary_activity),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """
+    Returns the schema version stored in a database.
+
+    :param conn: sqlite connection to the database
+    :return: the schema version, 0 if the database was never migrated
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """
+    Upgrades a database to the target schema version.
+
+    Each pending migration runs in its own transaction together with the
+    update of PRAGMA user_version, so an interrupted upgrade leaves the
+    database at the last completed version.
+
+    :param conn: sqlite connection to the database
+    :param target: the schema version to upgrade to
+    :return: list of the (version, description) of the applied migrations
+    """
+    conn.commit()  # the migrations manage their own transactions
+
+    applied = []
+    current = get_schema_version(conn)
+
+    for version, description, upgrade in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN')
+            upgrade(cur)
+            # PRAGMA does not accept parameters, version is always an int
+            cur.execute('PRAGMA user_version = {:d}'.format(version))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied.append((version, description))
+
+    return applied
+
+
+def drop_tables(conn):
+    """
+    Drops every WooMessages table and resets the schema version to 0.
+
+    :param conn: sqlite connection to the database
+    :return: None
+    """
+    conn.commit()
+    conn.executescript('''
+        DROP TABLE IF EXISTS user;
+        DROP TABLE IF EXISTS chat_rel;
+        DROP TABLE IF EXISTS chat;
+        DROP TABLE IF EXISTS message;
+        DROP TABLE IF EXISTS import_checkpoint;
+        DROP TABLE IF EXISTS data_version;
+        DROP TABLE IF EXISTS message_fts;
+        DROP TABLE IF EXISTS chat_summary;
+        DROP TABLE IF EXISTS message_archive;
+        DROP TABLE IF EXISTS shard_meta;
+        DROP TABLE IF EXISTS id_high_water;
+        PRAGMA user_version = 0;
+    ''')
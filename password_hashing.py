@@ -0,0 +1,357 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the process pool that hashes and verifies passwords.
+
+A password hash or verify is hundreds of milliseconds of pure CPU. Run in
+a request thread it holds the GIL the whole time, so a burst of logins
+stalls every other request of the process. The HashPool runs that work in
+separate worker processes instead, and the request thread just waits for
+the result.
+
+The pool admits at most max_queue hashes at a time (running or waiting). A
+login or registration arriving while it is full is refused at once with a
+503 and a Retry-After header, rather than queueing up behind the burst.
+
+The hash scheme and its cost come from a passlib CryptContext built by
+crypt_settings(). When a user logs in with a hash made under an older policy
+the password is rehashed under the current one (see verify_and_update).
+"""
+
+import concurrent.futures
+import functools
+import math
+import multiprocessing
+import threading
+import time
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+from exception_classes import *
+
+# passlib's own default cost for sha256_crypt
+DEFAULT_ROUNDS = 535000
+
+# the cheapest cost sha256_crypt allows, for the test suite only
+TEST_ROUNDS = 1000
+
+
+def crypt_settings(schemes=('sha256_crypt',), rounds=DEFAULT_ROUNDS):
+    """
+    Builds the CryptContext settings of a password policy. New hashes use the
+    first scheme with the given rounds. Hashes of the other schemes, or with
+    other rounds, still verify but are reported as outdated, so that they
+    can be replaced when the user logs in.
+
+    The settings are a tuple of (name, value) pairs, so that they can be
+    sent to the worker processes and used as a cache key.
+
+    :param schemes: passlib scheme names, the first is used for new hashes
+    :param rounds: the cost of the first scheme
+    :return: tuple of CryptContext keyword arguments
+    """
+    scheme = schemes[0]
+
+    return (('schemes', tuple(schemes)),
+            ('deprecated', 'auto'),
+            (scheme + '__default_rounds', rounds),
+            (scheme + '__min_rounds', rounds),
+            (scheme + '__max_rounds', rounds))
+
+
+DEFAULT_SETTINGS = crypt_settings()
+
+
+@functools.lru_cache(maxsize=8)
+def get_crypt_context(settings=DEFAULT_SETTINGS):
+    """
+    :param settings: tuple returned by crypt_settings()
+    :return: the (cached) passlib CryptContext of the settings
+    """
+    return CryptContext(**dict(settings))
+
+
+def hash_password(password, settings=DEFAULT_SETTINGS):
+    """
+    Hashes and salts one password. Runs in the worker processes, so it has to
+    be a module-level function.
+
+    :param password: the plain text password
+    :param settings: tuple returned by crypt_settings()
+    :return: the password hash
+    """
+    return get_crypt_context(settings).hash(str(password))
+
+
+def verify_password(password, password_hash, settings=DEFAULT_SETTINGS):
+    """
+    Checks a password against its stored hash, and rehashes it if the hash
+    does not follow the current policy. Runs in the worker processes.
+
+    :param password: the plain text password entered
+    :param password_hash: the hash stored for the user
+    :param settings: tuple returned by crypt_settings()
+    :return: tuple of whether the password matches and its new hash, or
+    None if the stored hash is up to date
+    """
+    return get_crypt_context(settings).verify_and_update(str(password),
+                                                         password_hash)
+
+
+def calibrate_rounds(target_ms, scheme='sha256_crypt', samples=3):
+    """
+    Finds the rounds of a scheme that make one verify take about target_ms
+    milliseconds on this machine. The time of a sha256_crypt or sha512_crypt
+    hash grows linearly with its rounds, so a measurement is scaled to the
+    target and then checked.
+
+    :param target_ms: the wanted verify latency in milliseconds
+    :param scheme: the passlib scheme name
+    :param samples: the number of timings averaged per measurement
+    :return: tuple of the rounds and their measured milliseconds
+    """
+    def measure(rounds):
+        context = get_crypt_context(crypt_settings((scheme,), rounds))
+        password_hash = context.hash('calibrate')
+
+        start = time.perf_counter()
+        for _ in range(samples):
+            context.verify('calibrate', password_hash)
+
+        return (time.perf_counter() - start) * 1000 / samples
+
+    handler = get_crypt_handler(scheme)
+    rounds = handler.default_rounds
+
+    for _ in range(2):
+        rounds = int(rounds * target_ms / measure(rounds))
+        rounds = max(handler.min_rounds, min(handler.max_rounds, rounds))
+
+    return rounds, round(measure(rounds), 1)
+
+
+class HashPool:
+    """
+    A bounded pool of worker processes for password hashing, with admission
+    control.
+    """
+
+    def __init__(self, workers=2, max_queue=32, timeout=10.0,
+                 settings=DEFAULT_SETTINGS):
+        """
+        Constructs the pool, its processes are started on first use.
+
+        :param workers: number of worker processes, 0 to hash in the calling
+        thread (without admission control)
+        :param max_queue: the most hashes admitted at once, running or
+        waiting
+        :param timeout: seconds a caller waits for its result
+        :param settings: the password policy, see crypt_settings()
+        """
+        self._workers = workers
+        self._max_queue = max_queue
+        self._timeout = timeout
+        self._settings = settings
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self._pending = 0
+        self._peak_pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._rehashed = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
+
+    def hash(self, password):
+        """
+        :param password: the plain text password
+        :return: its hash under the current policy
+        """
+        return self.run(hash_password, password, self._settings)
+
+    def verify(self, password, password_hash):
+        """
+        :param password: the plain text password entered
+        :param password_hash: the hash stored for the user
+        :return: True if the password matches
+        """
+        return self.verify_and_update(password, password_hash)[0]
+
+    def verify_and_update(self, password, password_hash):
+        """
+        :param password: the plain text password entered
+        :param password_hash: the hash stored for the user
+        :return: tuple of whether the password matches and the hash to
+        store instead, or None if the stored hash follows the current policy
+        """
+        verified, new_hash = self.run(verify_password, password,
+                                      password_hash, self._settings)
+
+        if new_hash is not None:
+            with self._lock:
+                self._rehashed += 1
+
+        return verified, new_hash
+
+    def run(self, function, *args):
+        """
+        Runs a hashing function in a worker process and waits for its result.
+        Raises a RequestError 503 with a Retry-After header if the pool is
+        full or the result takes longer than the timeout.
+
+        :param function: a module-level function, so it can be pickled
+        :param args: its arguments
+        :return: the result of the function
+        """
+        start = time.perf_counter()
+
+        if self._workers == 0:
+            result = function(*args)
+            self._finished(start)
+            return result
+
+        with self._lock:
+            if self._pending >= self._max_queue:
+                self._rejected += 1
+                raise RequestError(503, 'server busy, try again later',
+                                   {'Retry-After': self._retry_after()})
+
+            if self._executor is None:
+                # spawn, forking a threaded server process is not safe
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self._workers, mp_context=multiprocessing.get_context(
+                        'spawn'))
+
+            self._pending += 1
+            self._peak_pending = max(self._peak_pending, self._pending)
+            future = self._executor.submit(function, *args)
+
+        # the slot is freed when the worker is done, even if we gave up
+        future.add_done_callback(self._release)
+
+        try:
+            result = future.result(timeout=self._timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+                retry_after = self._retry_after()
+            raise RequestError(503, 'server busy, try again later',
+                               {'Retry-After': retry_after})
+
+        self._finished(start)
+
+        return result
+
+    def _release(self, future):
+        """
+        Frees the admission slot of a finished hash.
+
+        :param future: the finished future
+        """
+        with self._lock:
+            self._pending -= 1
+
+    def _finished(self, start):
+        """
+        Records the latency of a completed hash.
+
+        :param start: the perf_counter() value when it was submitted
+        """
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._completed += 1
+            self._total_time += elapsed
+            self._max_time = max(self._max_time, elapsed)
+
+    def _retry_after(self):
+        """
+        Estimates the seconds until the queue has drained. The lock must be
+        held.
+
+        :return: whole seconds, at least 1
+        """
+        average = self._total_time / (self._completed or 1)
+        drain = average * self._pending / max(self._workers, 1)
+
+        return str(max(1, math.ceil(drain)))
+
+    def stats(self):
+        """
+        Returns the usage statistics of the pool.
+
+        :return: a dictionary of the pool's counters, times are in
+        milliseconds
+        """
+        with self._lock:
+            return {
+                'workers': self._workers,
+                'max_queue': self._max_queue,
+                'pending': self._pending,
+                'peak_pending': self._peak_pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'rehashed': self._rehashed,
+                'average_ms': round(self._total_time * 1000 /
+                                    (self._completed or 1), 3),
+                'max_ms': round(self._max_time * 1000, 3),
+            }
+
+    def close(self):
+        """
+        Stops the worker processes.
+
+        :return: None
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_hash_pool(workers=2, max_queue=32, timeout=10.0,
+                  settings=DEFAULT_SETTINGS):
+    """
+    Returns the shared hash pool for a configuration, creating it on first
+    use.
+
+    :param workers: number of worker processes
+    :param max_queue: the most hashes admitted at once
+    :param timeout: seconds a caller waits for its result
+    :param settings: the password policy, see crypt_settings()
+    :return: a HashPool
+    """
+    key = (workers, max_queue, timeout, settings)
+
+    with _pools_lock:
+        pool = _pools.get(key)
+
+        if pool is None:
+            pool = HashPool(workers, max_queue, timeout, settings)
+            _pools[key] = pool
+
+    return pool
+
+
+def close_hash_pools():
+    """
+    Stops the worker processes of every hash pool.
+
+    :return: None
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
@@ -10,9 +10,15 @@ A file containing functions for querying the WooMessages database.
 from database_class import *
 from exception_classes import *
 from collections import OrderedDict
+from markupsafe import escape
+import base64
+import heapq
+import itertools
+import json
+import operator
 
 
-def query_by_id(table_name, item_id):
+def query_by_id(table_name, item_id, as_record=False):
     """
     Get a row from a table that has a primary key attribute named id.
 
@@ -20,11 +26,19 @@ def query_by_id(table_name, item_id):
 
     :param table_name: name of the table to query
     :param item_id: id of the row
+    :param as_record: return the row as its model (see table_classes.py)
     :return: a dictionary representing the row, and None if there is no row
     """
-    conn = get_db()
+    conn = get_row_db(table_name, item_id)
     cur = conn.cursor()
 
+    if as_record:
+        model = MODELS[table_name]
+        records = fetch_records(cur, model, model.select() + ' WHERE id = ?',
+                                (item_id,))
+
+        return records[0] if records else None
+
     query = 'SELECT * FROM {} WHERE id = ?'.format(table_name)
 
     cur.execute(query, (item_id,))
@@ -37,28 +51,181 @@ def query_by_id(table_name, item_id):
         return None
 
 
-def get_all_rows(table_name):
+def get_all_rows(table_name, as_records=False):
     """
     Returns all of the rows from a table as a list of dictionaries. This is
-    suitable for passing to jsonify().
+    suitable for passing to jsonify(). The rows of a table split into shards
+    are gathered from every shard, in id order.
 
     :param table_name: name of the table
+    :param as_records: return the rows as their model (see table_classes.py)
     :return: list of dictionaries representing the table's rows
     """
+    dbs = get_table_dbs(table_name)
+    results = []
 
-    conn = get_db()
-    cur = conn.cursor()
+    for conn in dbs:
+        cur = conn.cursor()
 
-    query = 'SELECT * FROM {}'.format(table_name)
+        if as_records:
+            model = MODELS[table_name]
+            results.extend(fetch_records(cur, model, model.select()))
+            continue
 
-    results = []
+        query = 'SELECT * FROM {}'.format(table_name)
+
+        for row in cur.execute(query):
+            results.append(dict(row))
 
-    for row in cur.execute(query):
-        results.append(dict(row))
+    if len(dbs) > 1:
+        results.sort(key=operator.attrgetter('id') if as_records
+                     else operator.itemgetter('id'))
 
     return results
 
 
+def encode_cursor(key):
+    """
+    Turns the sort key of a row into an opaque cursor token for the ?before=
+    and ?after= pagination parameters.
+
+    :param key: tuple of the integer key columns, e.g. (time_ms, id)
+    :return: a url-safe string
+    """
+    text = json.dumps(list(key), separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """
+    Turns a cursor token made by encode_cursor() back into a sort key.
+
+    :param token: the cursor token
+    :param size: the number of key columns expected in the token
+    :return: tuple of the key columns
+    """
+    try:
+        padding = '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(token + padding))
+    except ValueError:
+        raise RequestError(422, 'invalid cursor')
+
+    if not isinstance(key, list) or len(key) != size or \
+            not all(isinstance(column, int) for column in key):
+        raise RequestError(422, 'invalid cursor')
+
+    return tuple(key)
+
+
+def get_rows_page(table_name, limit, before=None, after=None,
+                  as_records=False):
+    """
+    Returns one page of the rows of a table, keyed on the id column. Rows
+    come in id order; with before the page ends just before the cursor,
+    otherwise it starts just after it.
+
+    :param table_name: name of the table
+    :param limit: maximum number of rows in the page
+    :param before: cursor token, only rows before it are returned
+    :param after: cursor token, only rows after it are returned
+    :param as_records: return the rows as their model (see table_classes.py)
+    :return: a tuple of the list of dictionaries representing the rows, and
+    the cursor token of the next page in the same direction (None if this is
+    the last page)
+    """
+    dbs = get_table_dbs(table_name)
+
+    select = 'SELECT * FROM {}'.format(table_name)
+    if as_records:
+        model = MODELS[table_name]
+        select = model.select()
+
+    if before is not None:
+        query = select + ' WHERE id < ? ORDER BY id DESC LIMIT ?'
+        args = (decode_cursor(before, 1)[0], limit + 1)
+    else:
+        last_id = decode_cursor(after, 1)[0] if after is not None else -1
+        query = select + ' WHERE id > ? ORDER BY id LIMIT ?'
+        args = (last_id, limit + 1)
+
+    # every shard's page, merged into the page of the whole table
+    rows = []
+    for conn in dbs:
+        cur = conn.cursor()
+
+        if as_records:
+            rows.extend(fetch_records(cur, model, query, args))
+        else:
+            rows.extend(dict(row) for row in cur.execute(query, args))
+
+    if len(dbs) > 1:
+        rows.sort(key=operator.attrgetter('id') if as_records
+                  else operator.itemgetter('id'), reverse=before is not None)
+        del rows[limit + 1:]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows.pop()
+        last = rows[-1]
+        next_cursor = encode_cursor((last.id if as_records else last['id'],))
+
+    if before is not None:
+        rows.reverse()
+
+    return rows, next_cursor
+
+
+def iter_row_batches(table_name, batch_size, as_records=False):
+    """
+    Yields all of the rows of a table, in id order, as lists of at most
+    batch_size dictionaries. Rows are read from the cursor with fetchmany(),
+    so only one batch is held in memory at a time. The cursors of a table
+    split into shards are merged by id.
+
+    :param table_name: name of the table
+    :param batch_size: number of rows fetched at a time
+    :param as_records: yield the rows as their model (see table_classes.py)
+    :return: generator of lists of dictionaries representing the rows
+    """
+    cursors = []
+
+    for conn in get_table_dbs(table_name):
+        cur = conn.cursor()
+
+        if as_records:
+            model = MODELS[table_name]
+            cur.row_factory = None
+            cur.execute(model.select() + ' ORDER BY id')
+        else:
+            cur.execute('SELECT * FROM {} ORDER BY id'.format(table_name))
+
+        cursors.append(cur)
+
+    if len(cursors) == 1:
+        fetch = cursors[0].fetchmany
+    else:
+        # id is the first column of every table
+        merged = heapq.merge(*cursors, key=operator.itemgetter(0))
+
+        def fetch(size):
+            return list(itertools.islice(merged, size))
+
+    while True:
+        rows = fetch(batch_size)
+        if not rows:
+            break
+
+        if as_records:
+            yield list(map(model._make, rows))
+        else:
+            yield [dict(row) for row in rows]
+
+    for cur in cursors:
+        cur.close()
+
+
+@cached_query(lambda username: ['user'])
 def get_user_by_username(username):
     """
     Returns a dictionary of one user's details
@@ -80,6 +247,7 @@ def get_user_by_username(username):
         return None  # if none flash red on the HTML
 
 
+@cached_query(lambda username: ['user'])
 def get_user_id(username):
     """
     Gets the user_id of a user from the username that is passed
@@ -110,36 +278,359 @@ def get_messages_in_chatroom(chat_id):
     Gets all of the messages in a chatroom, ordered by time
 
     :param chat_id: the id of the chat with the messages
-    :return: an ordered dictionary with the messages.
+    :return: a list of MessageRecord (name, message, time_ms)
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    query = '''
+        SELECT user.name, message.message, message.time_ms
+        FROM message JOIN user ON user.id = message.user_id
+        WHERE message.chat_id = ?
+        ORDER BY message.time_ms, message.id
+    '''
+
+    return fetch_records(cur, MessageRecord, query, (chat_id,))
+
+
+def get_messages_after(chat_id, since_id, limit):
+    """
+    Gets the messages of a chatroom with an id greater than since_id, oldest
+    first, through the message(chat_id, id) index.
+
+    :param chat_id: the id of the chat with the messages
+    :param since_id: only messages with a greater id are returned
+    :param limit: maximum number of messages returned
+    :return: list of dictionaries of the message's columns plus the name of
+    its sender
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    cur.execute('''
+        SELECT message.id AS "id", message.message AS "message",
+        message.time AS "time", message.time_ms AS "time_ms",
+        message.user_id AS "user_id", message.chat_id AS "chat_id",
+        user.name AS "name"
+        FROM message JOIN user ON user.id = message.user_id
+        WHERE message.chat_id = ? AND message.id > ?
+        ORDER BY message.id LIMIT ?
+    ''', (chat_id, since_id, limit))
+
+    return [dict(row) for row in cur.fetchall()]
+
+
+def get_messages_after_time(chat_id, since_time, limit):
+    """
+    Gets the messages of a chatroom sent after since_time, oldest first,
+    through the message(chat_id, time_ms) index.
+
+    :param chat_id: the id of the chat with the messages
+    :param since_time: milliseconds since the epoch, only messages with a
+    greater time_ms are returned
+    :param limit: maximum number of messages returned
+    :return: list of dictionaries like get_messages_after()
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    cur.execute('''
+        SELECT message.id AS "id", message.message AS "message",
+        message.time AS "time", message.time_ms AS "time_ms",
+        message.user_id AS "user_id", message.chat_id AS "chat_id",
+        user.name AS "name"
+        FROM message JOIN user ON user.id = message.user_id
+        WHERE message.chat_id = ? AND message.time_ms > ?
+        ORDER BY message.time_ms, message.id LIMIT ?
+    ''', (chat_id, since_time, limit))
+
+    return [dict(row) for row in cur.fetchall()]
+
+
+def get_latest_message_id(chat_id):
+    """
+    :param chat_id: the id of a chat
+    :return: the id of the newest message of the chat, 0 if it has none
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    cur.execute('SELECT max(id) FROM message WHERE chat_id = ?', (chat_id,))
+
+    return cur.fetchone()[0] or 0
+
+
+def get_message_page(chat_id, limit, before=None, after=None, table=None):
+    """
+    Gets one page of the messages in a chatroom, keyed on (time_ms, id).
+
+    Without a cursor the page holds the newest messages. The messages of a
+    page are always ordered from oldest to newest. The archived messages are
+    read too, through the message_history view (see archive.py).
+
+    :param chat_id: the id of the chat with the messages
+    :param limit: maximum number of messages in the page
+    :param before: cursor token, only messages older than it are returned
+    :param after: cursor token, only messages newer than it are returned
+    :param table: message if the caller knows that there are no archives,
+    None to look them up
+    :return: a tuple of the list of MessageRecord (name, message, time_ms),
+    the cursor token for older messages and the cursor token for newer
+    messages (None when there are no such messages)
+    """
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
-    list_of_messages = OrderedDict()
+    if table is None:
+        table = 'message_history' if attach_archives(conn) else 'message'
 
+    # SQLite merges the index scans of the files behind message_history
     query = '''
         SELECT user.name AS "name", message.message AS "message",
-        message.time AS "time", chat.title AS "title", chat.time AS "created"
-        FROM user, message, chat
-        WHERE chat.id = ? AND message.chat_id = ? AND
-        user.id = message.user_id ORDER BY time
-    '''
+        message.time_ms AS "time", message.id AS "id"
+        FROM {table} AS message JOIN user ON user.id = message.user_id
+        WHERE message.chat_id = ? {{}}
+        ORDER BY message.time_ms {{order}}, message.id {{order}} LIMIT ?
+    '''.format(table=table)
+
+    if after is not None:
+        query = query.format('AND (message.time_ms, message.id) > (?, ?)',
+                             order='ASC')
+        args = (chat_id,) + decode_cursor(after, 2) + (limit + 1,)
+    elif before is not None:
+        query = query.format('AND (message.time_ms, message.id) < (?, ?)',
+                             order='DESC')
+        args = (chat_id,) + decode_cursor(before, 2) + (limit + 1,)
+    else:
+        query = query.format('', order='DESC')
+        args = (chat_id, limit + 1)
+
+    rows = cur.execute(query, args).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if after is None:
+        rows.reverse()
+
+    older = newer = None
+    if rows:
+        oldest = encode_cursor((rows[0]['time'], rows[0]['id']))
+        newest = encode_cursor((rows[-1]['time'], rows[-1]['id']))
+
+        if after is not None:
+            older = oldest
+            newer = newest if has_more else None
+        else:
+            older = oldest if has_more else None
+            newer = newest if before is not None else None
+
+    messages = [MessageRecord(row['name'], row['message'], row['time'])
+                for row in rows]
+
+    return messages, older, newer
+
+
+def load_chat_page(chat_id, limit, before=None, after=None):
+    """
+    Loads everything the chat_room page shows in two statements: one row
+    with the chat's header, its participants with their read watermarks,
+    its newest message id and whether any messages are archived, then the
+    page of messages (see get_message_page). The chat's columns are read
+    once, not repeated on every message row.
+
+    :param chat_id: the id of the chat
+    :param limit: maximum number of messages in the page
+    :param before: cursor token, only messages older than it are shown
+    :param after: cursor token, only messages newer than it are shown
+    :return: a dictionary with the chat's title, created (time_ms),
+    participants (sorted list of names), latest_id (0 if it has no
+    messages), seen_by (the participants who have read the newest message),
+    messages (list of MessageRecord) and the older and newer cursor tokens;
+    None if the chat does not exist
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    cur.execute('''
+        SELECT chat.title AS "title", chat.time_ms AS "created",
+        (SELECT json_group_array(json_array(name, last_read_id)) FROM
+            (SELECT user.name AS "name", chat_rel.last_read_id
+             FROM chat_rel JOIN user ON user.id = chat_rel.user_id
+             WHERE chat_rel.chat_id = chat.id ORDER BY user.name))
+        AS "participants",
+        (SELECT coalesce(last_message_id, 0) FROM chat_summary
+         WHERE chat_summary.chat_id = chat.id) AS "latest_id",
+        EXISTS (SELECT 1 FROM message_archive) AS "archived"
+        FROM chat WHERE chat.id = ?
+    ''', (chat_id,))
+
+    header = cur.fetchone()
+
+    if header is None:
+        return None
+
+    messages, older, newer = get_message_page(
+        chat_id, limit, before=before, after=after,
+        table=None if header['archived'] else 'message')
+
+    participants = json.loads(header['participants'])
+    latest_id = header['latest_id']
+
+    return {'title': header['title'],
+            'created': header['created'],
+            'participants': [name for name, _ in participants],
+            'latest_id': latest_id,
+            'seen_by': [name for name, last_read_id in participants
+                        if latest_id and last_read_id >= latest_id],
+            'messages': messages,
+            'older': older,
+            'newer': newer}
 
-    for row in cur.execute(query, (chat_id, chat_id)):
 
-        message = row['message']
-        name = row['name']
-        time = row['time']
+def fts_query(text):
+    """
+    Turns the words a user typed into an FTS5 query: every word must occur,
+    the last one may be the start of a word. Each word is quoted, so
+    characters that mean something to FTS5 are searched for as text.
 
-        if message not in list_of_messages:
-            list_of_messages[name, message, time] = []
+    :param text: the search box text
+    :return: the FTS5 MATCH expression, None if text has no words
+    """
+    words = ['"{}"'.format(word.replace('"', '""')) for word in text.split()]
 
-        list_of_messages[name, message, time].append(row)
+    if not words:
+        return None
 
-    return list_of_messages
+    words[-1] += ' *'
 
+    return ' '.join(words)
 
+
+def search_messages(text, limit, chat_id=None, after=None, rank_window=None):
+    """
+    Searches the messages through the message_fts index, and the one of
+    every archive file (see archive.py), best match first (FTS5's bm25
+    rank). In a database split into shards every shard is searched and
+    their results are merged by rank.
+
+    Ranking scores every match, so a common word would cost time in
+    proportion to the whole table. With rank_window only the newest
+    rank_window matches (of each shard) are ranked; their lower id bound is
+    the smallest of the first rank_window matches in descending id order,
+    read from the index without scoring or sorting.
+
+    Each result carries a snippet of its message around the matches, HTML
+    escaped, with the matched words in <mark> tags.
+
+    :param text: the words to search for
+    :param limit: maximum number of results in the page
+    :param chat_id: only search the messages of this chat
+    :param after: cursor token of the page to continue from
+    :param rank_window: the most matches ranked, None to rank them all
+    :return: a tuple of the list of dictionaries of the message's columns,
+    its sender's name and snippet, and the cursor token of the next page
+    (None if this is the last page)
+    """
+    match = fts_query(text)
+    if match is None:
+        raise RequestError(422, 'q must contain a word to search for')
+
+    # ranks are not unique integers, so the cursor is the offset
+    offset = decode_cursor(after, 1)[0] if after is not None else 0
+
+    filters = 'AND message.chat_id = ?' if chat_id is not None else ''
+    filter_args = (match, chat_id) if chat_id is not None else (match,)
+
+    def search_file(conn, limit, offset, filters=filters,
+                    filter_args=filter_args):
+        """
+        :return: list of the dictionaries of the matches of one database
+        file and its archives, by rank, with their rank
+        """
+        cur = conn.cursor()
+
+        # one select per file holding messages, each over its own index
+        schemas = ['main'] + attach_archives(conn)
+
+        def union(select, filters, filter_args):
+            """
+            :return: tuple of the UNION ALL of the select over every schema
+            and its arguments
+            """
+            return (' UNION ALL '.join(select.format(schema=schema,
+                                                     filters=filters)
+                                       for schema in schemas),
+                    filter_args * len(schemas))
+
+        lowest_id = None
+        if rank_window is not None:
+            # FTS5 hands out the matches of each file in descending rowid
+            # order and SQLite merges the files, so only rank_window
+            # matches are read and nothing is sorted
+            query, args = union('''
+                SELECT message_fts.rowid AS "id" FROM {schema}.message_fts
+                JOIN {schema}.message ON message.id = message_fts.rowid
+                WHERE message_fts MATCH ? {filters}
+            ''', filters, filter_args)
+            cur.execute('SELECT min("id") FROM (' + query +
+                        ' ORDER BY 1 DESC LIMIT ?)', args + (rank_window,))
+
+            lowest_id = cur.fetchone()[0]
+
+        if lowest_id is not None:
+            filters += ' AND message_fts.rowid >= ?'
+            filter_args += (lowest_id,)
+
+        # user is the global file's table in a shard
+        query, args = union('''
+            SELECT message.id AS "id", message.message AS "message",
+            message.time AS "time", message.time_ms AS "time_ms",
+            message.user_id AS "user_id", message.chat_id AS "chat_id",
+            user.name AS "name",
+            snippet(message_fts, 0, char(2), char(3), '...', 16)
+            AS "snippet",
+            message_fts.rank AS "rank"
+            FROM {schema}.message_fts
+            JOIN {schema}.message ON message.id = message_fts.rowid
+            LEFT JOIN user ON user.id = message.user_id
+            WHERE message_fts MATCH ? {filters}
+        ''', filters, filter_args)
+
+        return [dict(row) for row in
+                cur.execute(query + ' ORDER BY "rank", "id" LIMIT ? OFFSET ?',
+                            args + (limit, offset))]
+
+    if chat_id is not None:
+        dbs = [get_db(chat_id)]
+    else:
+        dbs = get_table_dbs('message')
+
+    if len(dbs) == 1:
+        rows = search_file(dbs[0], limit + 1, offset)
+    else:
+        # the best offset + limit + 1 of each shard hold the page
+        rows = list(itertools.islice(
+            heapq.merge(*[search_file(conn, offset + limit + 1, 0)
+                          for conn in dbs],
+                        key=operator.itemgetter('rank', 'id')),
+            offset, offset + limit + 1))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows.pop()
+        next_cursor = encode_cursor((offset + limit,))
+
+    for row in rows:
+        del row['rank']
+        row['snippet'] = str(escape(row['snippet'])).replace(
+            '\x02', '<mark>').replace('\x03', '</mark>')
+
+    return rows, next_cursor
+
+
+@cached_query(lambda chat_id: ['chat', 'chat:{}'.format(chat_id)])
 def get_chat_room_name(chat_id):
     """
     This function finds the name of a chat room given a specific chat id
@@ -148,7 +639,7 @@ def get_chat_room_name(chat_id):
     :return: name of the chat room
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
     query = '''
@@ -172,67 +663,96 @@ def get_chat_rooms(user_id):
     Gets all of the chat rooms that a user is a part of
 
     :param user_id: ID of the user
-    :return: an ordered dictionary containing the chat rooms
+    :return: a list of ChatRoomRecord, most recently active first;
+    unread is at most UNREAD_COUNT_CAP
     """
+    return get_chat_rooms_page(user_id, None)[0]
 
-    conn = get_db()
-    cur = conn.cursor()
 
-    room_data = OrderedDict()
+def get_chat_rooms_page(user_id, limit, before=None):
+    """
+    Gets one page of the chat rooms that a user is a part of, keyed on
+    (last_activity, id), so a page costs the same however many chats the
+    user has read.
 
-    query = '''
-        SELECT chat.title AS "title", user.name AS "participants",
-        chat.time AS "create_date", chat.id AS "id"
-        FROM chat, chat_rel, user
-        WHERE chat_rel.user_id = user.id
-        AND chat_rel.chat_id = chat.id
-        AND user.id = ?
-        ORDER BY chat.time, chat.title;
-    '''
+    :param user_id: ID of the user
+    :param limit: maximum number of chats in the page, None for all of them
+    :param before: cursor token, only the chats less recently active than it
+    are returned
+    :return: a tuple of the list of ChatRoomRecord, most recently active
+    first (unread is at most UNREAD_COUNT_CAP), and the cursor token of the
+    next page (None if this is the last page)
+    """
+    dbs = get_table_dbs('chat_rel')
+    key = decode_cursor(before, 2) if before is not None else CHAT_ROOMS_START
+    args = (UNREAD_COUNT_CAP, user_id) + key + \
+        (-1 if limit is None else limit + 1,)
+    rooms = []
 
-    for row in cur.execute(query, (user_id,)):
-        room_name = row['title']
-        room_date = row['create_date']
-        room_id = row['id']
+    # the user's chats of every shard
+    for conn in dbs:
+        rooms.extend(fetch_records(conn.cursor(), ChatRoomRecord,
+                                   CHAT_ROOMS_QUERY, args))
 
-        if room_name not in room_data:
-            room_data[room_name, room_date, room_id] = []
+    if len(dbs) > 1:
+        rooms.sort(key=operator.attrgetter('last_activity', 'id'),
+                   reverse=True)
 
-        room_data[room_name, room_date, room_id].append(row)
+    next_cursor = None
+    if limit is not None and len(rooms) > limit:
+        del rooms[limit:]
+        last = rooms[-1]
+        next_cursor = encode_cursor((last.last_activity, last.id))
 
-    return room_data
+    return rooms, next_cursor
 
 
+def get_read_receipts(chat_id):
+    """
+    Gets the read watermark of every member of a chat. A member has read
+    every message with an id up to their last_read_id.
+
+    :param chat_id: the id of the chat
+    :return: list of dictionaries of the user_id, name and last_read_id of
+    the members, by name
+    """
+    conn = get_db(chat_id)
+    cur = conn.cursor()
+
+    cur.execute('''
+        SELECT chat_rel.user_id AS "user_id", user.name AS "name",
+        chat_rel.last_read_id AS "last_read_id"
+        FROM chat_rel JOIN user ON user.id = chat_rel.user_id
+        WHERE chat_rel.chat_id = ?
+        ORDER BY user.name
+    ''', (chat_id,))
+
+    return [dict(row) for row in cur.fetchall()]
+
+
+@cached_query(lambda chat_id: ['user', 'chat_rel',
+                               'chat_rel:{}'.format(chat_id)])
 def get_participants_in_chat(chat_id):
     """
-    A function that returns an ordered dictionary of participants in a chat
+    A function that returns the names of the participants in a chat
 
     :param chat_id: ID of a chat
-    :return: an ordered dictionary of participants
+    :return: a list of participant names, sorted
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
-    participant_data = OrderedDict()
-
     query = '''
-        SELECT user.name AS "name" FROM user, chat_rel
+        SELECT user.name FROM user, chat_rel
         WHERE user.id = chat_rel.user_id AND chat_rel.chat_id = ?
-        ORDER BY name
+        ORDER BY user.name
     '''
 
-    for row in cur.execute(query, (chat_id,)):
-        participant = row['name']
-
-        if participant not in participant_data:
-            participant_data[participant] = []
-
-        participant_data[participant].append(row)
-
-    return participant_data
+    return [name for name, in cur.execute(query, (chat_id,))]
 
 
+@cached_query(lambda chatroom_id: ['chat', 'chat:{}'.format(chatroom_id)])
 def get_room_info(chatroom_id):
     """
     Gets the title and time of creation for a chat room based on a chatroom_id
@@ -241,14 +761,14 @@ def get_room_info(chatroom_id):
     :return: an ordered dictionary of the chat room information
     """
 
-    conn = get_db()
+    conn = get_db(chatroom_id)
     cur = conn.cursor()
 
     room_data = OrderedDict()
 
     query = '''
-        SELECT chat.title AS "title", chat.time AS "time"
-        FROM chat WHERE chat.id = ? ORDER BY time
+        SELECT chat.title AS "title", chat.time_ms AS "time"
+        FROM chat WHERE chat.id = ?
     '''
 
     for row in cur.execute(query, (chatroom_id,)):
@@ -272,7 +792,7 @@ def delete_user_from_chat(username, chat_id):
     :param chat_id: that chat id from which to delete a user
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
     user_id = get_user_id(username)
@@ -280,6 +800,7 @@ def delete_user_from_chat(username, chat_id):
     cur.execute('DELETE FROM chat_rel WHERE user_id = ? AND chat_id = ?',
                 (user_id, chat_id))
     conn.commit()
+    invalidate_cache('chat_rel:{}'.format(chat_id))
 
 
 def insert_chat_room(title, username_list):
@@ -318,7 +839,7 @@ def delete_user_from_chat(username, chat_id):
     :param chat_id: the id of the chat
     """
 
-    conn = get_db()
+    conn = get_db(chat_id)
     cur = conn.cursor()
 
     user_id = get_user_id(username)
@@ -326,6 +847,7 @@ def delete_user_from_chat(username, chat_id):
     cur.execute('DELETE FROM chat_rel WHERE user_id = ? AND chat_id = ?',
                 (user_id, chat_id))
     conn.commit()
+    invalidate_cache('chat_rel:{}'.format(chat_id))
 
 
 def delete_item(table_name, item_id):
@@ -336,12 +858,25 @@ def delete_item(table_name, item_id):
     :param item_id: it item which to delte
     :return: NONE
     """
-    conn = get_db()
+    conn = get_row_db(table_name, item_id)
     cur = conn.cursor()
+    tags = [table_name]
+
+    # the cached reads of a chat's rows are tagged by the chat's id
+    chat_id = item_id if table_name == 'chat' else None
+    if table_name in ('chat_rel', 'message'):
+        cur.execute('SELECT chat_id FROM {} WHERE id = ?'.format(table_name),
+                    (item_id,))
+        row = cur.fetchone()
+        chat_id = row[0] if row is not None else None
+
+    if chat_id is not None:
+        tags += ['chat:{}'.format(chat_id), 'chat_rel:{}'.format(chat_id)]
 
     query = 'DELETE FROM {} WHERE id = ?'.format(table_name)
 
     cur.execute(query, (item_id,))
     conn.commit()
+    invalidate_cache(*tags)
 
     return None
@@ -31,6 +31,10 @@ Yoyoyoy                  02/10/2018 21:49     3
 crack is defintely wack  02/17/2018 21:49     4
 ...
 
+$ python3 query_WooMessage.py follow 1
+04/29/2018 21:49  Morgan: i don't think we should do drugs
+...
+
 $ python3 query_WooMessage.py show api/user
 email                    id  username    name    password
 ---------------------  ----  ----------  ------  -----------------------------
@@ -94,6 +98,11 @@ def show_commands():
         # Convert the JSON content of response to a Python list
         content = response.json()
 
+        # The API returns one page at a time, follow the next page links
+        while 'next' in response.links:
+            response = requests.get(response.links['next']['url'])
+            content.extend(response.json())
+
         # Getting keys from 1st entry
         keys = list()
         for key in content[0].keys():
@@ -107,6 +116,32 @@ def show_commands():
         sys.exit(1)
 
 
+def follow_commands():
+    """
+    Deals with the 'follow' command: prints the messages of a chat as they
+    arrive, long-polling the delta-sync API for only the new ones.
+    :return:
+    """
+    chat_id = sys.argv[2]
+    request_url = '{}api/chat/{}/messages'.format(API_BASE_URL, chat_id)
+    since_id = 0
+
+    while True:
+        response = requests.get(request_url, params={'since_id': since_id,
+                                                     'wait': 25})
+
+        if response.status_code != SUCCESSFUL_RESPONSE:
+            print('Error: the url {} does not exist'.format(request_url))
+            sys.exit(1)
+
+        content = response.json()
+
+        for message in content['messages']:
+            print('{time}  {name}: {message}'.format(**message))
+
+        since_id = content['next_since']
+
+
 def insert_commands():
     print("INSERT")
 
@@ -120,13 +155,15 @@ def main():
     # there must be commands
     if len(sys.argv) < 2:
         sys.exit('Usage:\n$ python3 query_WooMessage.py <command> <table>\n'
-                 'Current commands availible: show\n'
+                 'Current commands availible: show, follow <chat id>\n'
                  'Current tables: api/chat, api/user, api/message')
 
     command = sys.argv[1]
 
     if command == "show":
         show_commands()
+    elif command == "follow":
+        follow_commands()
     # elif command == "add":
     #     insert_commands()
     else:
@@ -0,0 +1,230 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the read cache of queries.py.
+
+Some lookups run on nearly every request although their answer rarely
+changes: the id of the logged in user, the title and members of a chat. The
+QueryCache keeps their results, keyed by function and arguments, in a
+bounded LRU with a time to live.
+
+Every entry is filed under tags naming the data it was read from, e.g.
+'user' or 'chat_rel:3'. The functions that change that data invalidate its
+tags after they commit, which drops the entries at once. A read that was
+already running when its tags were invalidated may have read the old data,
+so its result is not stored (each tag being read has a generation counter
+for this, dropped once no read of it is running).
+
+Tags only see the writes made through this process. For the others (other
+workers, WooMessageDB, by hand), every entry also stores the version of the
+data it was read from, the data_version counters (see migrations.py) read
+before the query ran: a lookup passes the current version, and an entry of
+an older one is dropped and read again. The counters are read once per
+request (get_request_versions in database_class.py), a single primary key
+lookup per file, so the writes of other processes are seen from the next
+request on.
+"""
+
+import collections
+import threading
+import time
+
+
+class QueryCache:
+    """
+    A bounded, thread-safe LRU cache whose entries expire and can be dropped
+    by tag.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        """
+        :param max_entries: the most results kept, the least recently used
+        is evicted first
+        :param ttl: seconds a result is kept, None to keep it until it is
+        invalidated or evicted
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+        # key -> (value, tags, expiry time, version)
+        self._entries = collections.OrderedDict()
+        self._keys_by_tag = collections.defaultdict(set)
+        # tag -> number of loads running, and the invalidations since the
+        # oldest of them started
+        self._loading = collections.Counter()
+        self._generations = collections.Counter()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._stale = 0
+
+    def get_or_load(self, key, tags, load, version=None):
+        """
+        Returns the cached result for key, or calls load() and caches its
+        result under the tags.
+
+        :param key: hashable key of the result, e.g. (function, arguments)
+        :param tags: the names of the data the result is read from
+        :param load: function computing the result
+        :param version: the current version of the data, read before load()
+        would run; a result cached at another version is not returned
+        :return: the result
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, _, expires, cached_version = entry
+
+                if cached_version != version:
+                    self._remove(key)
+                    self._stale += 1
+                elif expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                else:
+                    self._remove(key)
+                    self._expirations += 1
+
+            self._misses += 1
+            generations = [self._generations[tag] for tag in tags]
+            self._loading.update(tags)
+
+        try:
+            value = load()
+        except BaseException:
+            with self._lock:
+                self._end_load(tags)
+            raise
+
+        with self._lock:
+            # an invalidation while loading means value may be stale
+            if generations == [self._generations[tag] for tag in tags]:
+                self._store(key, value, tags, version)
+            self._end_load(tags)
+
+        return value
+
+    def _end_load(self, tags):
+        """
+        Forgets a finished load, and the generations of the tags no load
+        reads anymore. The lock must be held.
+        """
+        self._loading.subtract(tags)
+
+        for tag in tags:
+            if tag in self._loading and self._loading[tag] <= 0:
+                del self._loading[tag]
+                self._generations.pop(tag, None)
+
+    def _store(self, key, value, tags, version=None):
+        """
+        Adds an entry, evicting the least recently used ones if the cache is
+        full. The lock must be held.
+        """
+        if key in self._entries:
+            self._remove(key)
+
+        expires = None
+        if self._ttl is not None:
+            expires = time.monotonic() + self._ttl
+
+        self._entries[key] = (value, tags, expires, version)
+        for tag in tags:
+            self._keys_by_tag[tag].add(key)
+
+        while len(self._entries) > self._max_entries:
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key):
+        """
+        Removes an entry and its tag references. The lock must be held.
+        """
+        _, tags, _, _ = self._entries.pop(key)
+
+        for tag in tags:
+            keys = self._keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tag[tag]
+
+    def invalidate(self, *tags):
+        """
+        Drops every entry filed under any of the tags.
+
+        :param tags: the names of the changed data
+        :return: None
+        """
+        with self._lock:
+            for tag in tags:
+                if tag in self._loading:
+                    self._generations[tag] += 1
+
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self._invalidations += 1
+
+    def clear(self):
+        """
+        Drops every entry, e.g. after the tables were recreated.
+
+        :return: None
+        """
+        with self._lock:
+            for tag in self._loading:
+                self._generations[tag] += 1
+
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def stats(self):
+        """
+        :return: dictionary of the cache's size and counters
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+
+            return {
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'ttl': self._ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'stale': self._stale,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(database, max_entries=1024, ttl=60.0):
+    """
+    Returns the cache of a database file, creating it on first use.
+
+    :param database: the database file name
+    :param max_entries: the most results kept
+    :param ttl: seconds a result is kept
+    :return: a QueryCache
+    """
+    with _caches_lock:
+        cache = _caches.get(database)
+
+        if cache is None:
+            cache = _caches[database] = QueryCache(max_entries, ttl)
+
+    return cache
@@ -0,0 +1,495 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the shard router that splits a WooMessages database into
+several SQLite files by chat_id.
+
+A SQLite file has one writer at a time, so however many cores the server
+has, the messages of all chats are committed one after the other. With N
+shards (the SHARDS setting) the database is split into:
+
+    WooMessages.sqlite          the global file, with the user table
+    WooMessages-shard0.sqlite   the chats of shard 0, with their chat_rel,
+    WooMessages-shard1.sqlite   message, chat_summary and message_fts rows
+    ...
+
+A chat and all of its memberships and messages live in shard
+(chat_id - 1) % N, so the writes to chats of different shards take
+different write locks and run in parallel. A shard file has every table but
+user; its connections ATTACH the global file, so the queries' joins with
+user read it there, unchanged. The triggers of a shard keep its own
+chat_summary, message_fts and data_version rows.
+
+Row ids stay unique across the shards: shard k gives new rows the ids equal
+to k + 1 modulo N above its id floor (NEXT_ID, shard_meta in migrations.py).
+A row is found by its id by probing every shard's primary key.
+
+With one shard (the default) there are no shard files, the global file
+holds everything and the router hands out its connections.
+"""
+
+import os
+import sqlite3
+import threading
+from exception_classes import *
+from connection_pool import get_pool, close_pools
+from group_commit import close_writer
+from migrations import migrate, drop_tables
+
+# the tables whose rows are placed in the shard of their chat
+SHARDED_TABLES = ('chat', 'chat_rel', 'message')
+
+# the id of a new row of a sharded {table}: the smallest one above the
+# table's ids, its high water mark and the floor that is equal to shard + 1
+# modulo shards. An unsplit database, where shard_meta is empty, counts as
+# shard 0 of 1 once the table has a high water mark (id_high_water in
+# migrations.py); without one the id is NULL and SQLite picks it.
+NEXT_ID = '''(
+    SELECT last + 1 + ((shard - last) % shards + shards) % shards FROM
+        (SELECT max(coalesce((SELECT max(id) FROM main.{table}), 0),
+                    coalesce((SELECT high FROM main.id_high_water
+                              WHERE table_name = '{table}'), 0),
+                    id_floor) AS last, shard, shards
+         FROM (SELECT shard, shards, id_floor FROM main.shard_meta
+               UNION ALL
+               SELECT 0, 1, 0 FROM main.id_high_water
+               WHERE table_name = '{table}'
+               AND NOT EXISTS (SELECT 1 FROM main.shard_meta)))
+)'''
+
+
+def get_shard_path(database, shard):
+    """
+    :param database: the file name of the global database
+    :param shard: the shard number
+    :return: the file name of the shard, e.g. WooMessages-shard0.sqlite
+    """
+    stem, extension = os.path.splitext(database)
+
+    return '{}-shard{}{}'.format(stem, shard, extension)
+
+
+def shard_of(chat_id, shards):
+    """
+    :param chat_id: the id of a chat
+    :param shards: the number of shards
+    :return: the shard holding the chat
+    """
+    try:
+        return (int(chat_id) - 1) % shards
+    except ValueError:
+        raise RequestError(404, 'chat does not exist')
+
+
+def get_layout(database, shards):
+    """
+    :param database: the file name of the global database
+    :param shards: the number of shards
+    :return: list of the files holding the chats, by shard number (the
+    global file itself when there is one shard)
+    """
+    if shards == 1:
+        return [database]
+
+    return [get_shard_path(database, shard) for shard in range(shards)]
+
+
+def migrate_shard(conn, shard, shards, id_floor=None):
+    """
+    Upgrades a shard file to the latest schema version, without the user
+    table, and stores its shard_meta row. The connection must not have the
+    global file attached, whose tables the unqualified DROPs would find.
+
+    :param conn: plain sqlite connection to the shard file
+    :param shard: the shard number
+    :param shards: the number of shards
+    :param id_floor: the lowest id of the new rows, None to keep the stored
+    one
+    :return: list of the (version, description) of applied migrations
+    """
+    applied = migrate(conn)
+
+    conn.execute('DROP TABLE IF EXISTS main.user')
+
+    row = conn.execute('SELECT id_floor FROM shard_meta').fetchone()
+    if id_floor is None:
+        id_floor = row[0] if row is not None else 0
+
+    conn.execute('DELETE FROM shard_meta')
+    conn.execute('INSERT INTO shard_meta(shard, shards, id_floor) '
+                 'VALUES (?, ?, ?)', (shard, shards, id_floor))
+    conn.commit()
+
+    return applied
+
+
+class ShardRouter:
+    """
+    The connection pools of a database split into shards by chat_id.
+    """
+
+    def __init__(self, database, shards, max_size=8, timeout=5.0,
+                 pragmas=(), checkpoint_interval=None,
+                 checkpoint_mode='TRUNCATE'):
+        """
+        Constructs the router, the pools open their connections when needed.
+
+        :param database: the file name of the global database
+        :param shards: the number of shards
+        :param max_size: the maximum number of open connections per file
+        :param timeout: seconds a connection is waited for
+        :param pragmas: sequence of (name, value) PRAGMAs of the connections
+        :param checkpoint_interval: seconds between WAL checkpoints, or None
+        :param checkpoint_mode: PASSIVE, FULL, RESTART or TRUNCATE
+        """
+        if shards < 1:
+            raise RequestError(500, 'SHARDS must be at least 1')
+
+        self.database = database
+        self.shards = shards
+
+        self._settings = dict(max_size=max_size, timeout=timeout,
+                              pragmas=tuple(pragmas),
+                              checkpoint_interval=checkpoint_interval,
+                              checkpoint_mode=checkpoint_mode)
+
+    # the pools are looked up on every use, so that the router never holds
+    # a pool closed by close_pools()
+    @property
+    def pool(self):
+        """
+        The connection pool of the global file.
+        """
+        return get_pool(self.database, **self._settings)
+
+    @property
+    def shard_pools(self):
+        """
+        List of the connection pools of the shard files, by shard number,
+        whose connections have the global file attached as global.
+        """
+        return [self.get_shard_pool(shard) for shard in range(self.shards)]
+
+    def get_shard_pool(self, shard):
+        """
+        :param shard: the shard number
+        :return: the connection pool of the shard file, the global one if
+        the database is not split
+        """
+        if not self.is_sharded:
+            return self.pool
+
+        return get_pool(self.get_shard_path(shard),
+                        attach=[('global', self.database)], **self._settings)
+
+    @property
+    def is_sharded(self):
+        return self.shards > 1
+
+    def shard_of(self, chat_id):
+        """
+        :param chat_id: the id of a chat
+        :return: the shard holding the chat
+        """
+        return shard_of(chat_id, self.shards)
+
+    def get_shard_path(self, shard):
+        """
+        :param shard: the shard number
+        :return: the file holding the chats of the shard
+        """
+        return get_layout(self.database, self.shards)[shard]
+
+    def create_shards(self):
+        """
+        Drops and recreates the tables of every shard file, empty.
+
+        :return: None
+        """
+        if not self.is_sharded:
+            return
+
+        for shard, path in enumerate(get_layout(self.database,
+                                                self.shards)):
+            conn = sqlite3.connect(path)
+            try:
+                drop_tables(conn)
+                migrate_shard(conn, shard, self.shards, 0)
+            finally:
+                conn.close()
+
+    def migrate_shards(self):
+        """
+        Upgrades every shard file to the latest schema version. A missing
+        shard file, or one of a different split, is an error.
+
+        :return: None
+        """
+        if not self.is_sharded:
+            return
+
+        for shard, path in enumerate(get_layout(self.database,
+                                                self.shards)):
+            if not os.path.isfile(path):
+                raise RequestError(500, '{} is missing, the database is not '
+                                        'split into {} shards'.format(
+                                            path, self.shards))
+
+            conn = sqlite3.connect(path)
+            try:
+                migrate_shard(conn, shard, self.shards)
+                stored = conn.execute('SELECT shard, shards '
+                                      'FROM shard_meta').fetchone()
+            finally:
+                conn.close()
+
+            if stored != (shard, self.shards):
+                raise RequestError(500, '{} is shard {} of {}, not {} of {}'
+                                   .format(path, stored[0], stored[1],
+                                           shard, self.shards))
+
+    def stats(self):
+        """
+        :return: list of the usage statistics of the pools, global first
+        """
+        pools = [self.pool] + (self.shard_pools if self.is_sharded else [])
+
+        return [pool.stats() for pool in pools]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(database, shards, **settings):
+    """
+    Returns the shared router of a database file and number of shards,
+    creating it on first use. The pool settings only apply when it is
+    created.
+
+    :param database: the file name of the global database
+    :param shards: the number of shards
+    :param settings: the pool settings of ShardRouter
+    :return: a ShardRouter
+    """
+    key = (database, shards, tuple(settings.get('pragmas', ())))
+
+    with _routers_lock:
+        router = _routers.get(key)
+
+        if router is None:
+            router = ShardRouter(database, shards, **settings)
+            _routers[key] = router
+
+    return router
+
+
+def _copy_columns(conn, table):
+    """
+    :return: the column list of a table of the main database
+    """
+    return ', '.join(row[1] for row in conn.execute(
+        'PRAGMA main.table_info({})'.format(table)))
+
+
+def _remove_files(path):
+    """
+    Removes a database file and its -wal and -shm files, if they exist.
+
+    :param path: the database file name
+    :return: None
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _finish_reshard(database, old_shards, new_shards):
+    """
+    Moves the complete .resharding files of a reshard over their targets,
+    then drops the chats left in the sources, and removes the journal. Each
+    step can be run again, so a swap interrupted by a crash is finished by
+    the next reshard().
+
+    :param database: the file name of the global database
+    :param old_shards: the number of shards the database was split into
+    :param new_shards: the number of shards it is split into
+    :return: None
+    """
+    targets = get_layout(database, new_shards)
+
+    for target in targets:
+        if os.path.exists(target + '.resharding'):
+            # the old file's WAL must not be applied to the new one
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+
+            os.replace(target + '.resharding', target)
+
+    if old_shards == 1:
+        conn = sqlite3.connect(database)
+        try:
+            conn.executescript('''
+                DELETE FROM message;
+                DELETE FROM chat_rel;
+                DELETE FROM chat;
+            ''')
+        finally:
+            conn.close()
+    else:
+        for path in get_layout(database, old_shards):
+            if path not in targets:
+                _remove_files(path)
+
+    os.remove(database + '.reshard-journal')
+
+
+def reshard(database, old_shards, new_shards):
+    """
+    Moves the chats, memberships and messages of a database split into
+    old_shards files into new_shards files. The app must be stopped, and
+    archived messages (see archive.py) must not exist.
+
+    The new files are built next to the old ones as .resharding files,
+    which the app never reads. Once all of them are complete, a journal
+    file records the swap, they replace their targets, and only then are the
+    chats dropped from the old files. A reshard interrupted by a crash
+    leaves either the old files intact, or a journal: the next reshard()
+    finishes that swap first.
+
+    The triggers of the new files rebuild the chat summaries, full-text
+    indexes and version counters as the rows are copied. The id floor of
+    the new shards is the largest id of the old ones, so new ids never
+    collide with the copied ones.
+
+    :param database: the file name of the global database
+    :param old_shards: the number of shards the database is split into
+    :param new_shards: the number of shards to split it into
+    :return: list of the number of chats moved into each new shard
+    """
+    if new_shards < 1:
+        raise RequestError(422, 'there must be at least 1 shard')
+
+    journal = database + '.reshard-journal'
+    if os.path.exists(journal):
+        with open(journal) as journal_file:
+            done_old, done_new = map(int, journal_file.read().split())
+
+        for path in set(get_layout(database, done_old) +
+                        get_layout(database, done_new) + [database]):
+            close_pools(path)
+            close_writer(path)
+
+        _finish_reshard(database, done_old, done_new)
+
+        if (done_old, done_new) != (old_shards, new_shards):
+            raise RequestError(409, 'finished an interrupted reshard into {0} '
+                                    'shards, set SHARDS = {0}'.format(
+                                        done_new))
+
+        return _count_chats(get_layout(database, new_shards))
+
+    if new_shards == old_shards:
+        raise RequestError(422, 'the database is already split into {} '
+                                'shards'.format(new_shards))
+
+    sources = get_layout(database, old_shards)
+    targets = get_layout(database, new_shards)
+
+    for path in set(sources + targets + [database]):
+        close_pools(path)
+        close_writer(path)
+
+    id_floor = 0
+    for path in sources:
+        conn = sqlite3.connect(path)
+        try:
+            if conn.execute('SELECT count(*) FROM message_archive'
+                            ).fetchone()[0]:
+                raise RequestError(409, '{} has archived messages, a '
+                                        'database with archives can not be '
+                                        'resharded'.format(path))
+
+            for table in SHARDED_TABLES:
+                id_floor = max(id_floor, conn.execute(
+                    'SELECT coalesce(max(id), 0) FROM {}'.format(table)
+                ).fetchone()[0])
+        finally:
+            conn.close()
+
+    for shard, target in enumerate(targets):
+        building = target + '.resharding'
+        _remove_files(building)
+
+        conn = sqlite3.connect(building)
+        try:
+            if new_shards > 1:
+                migrate_shard(conn, shard, new_shards, id_floor)
+            else:
+                # the global file, with its users, minus the chats it may
+                # still hold from an earlier interrupted swap
+                source = sqlite3.connect(database)
+                try:
+                    source.backup(conn)
+                finally:
+                    source.close()
+
+                conn.executescript('''
+                    DELETE FROM message;
+                    DELETE FROM chat_rel;
+                    DELETE FROM chat;
+                ''')
+
+            where = '(({column} - 1) % {shards}) = {shard}'
+            for path in sources:
+                conn.execute('ATTACH DATABASE ? AS source', (path,))
+
+                # chats first, so that the summary triggers find their rows
+                for table, column in (('chat', 'id'),
+                                      ('chat_rel', 'chat_id'),
+                                      ('message', 'chat_id')):
+                    columns = _copy_columns(conn, table)
+                    conn.execute(
+                        'INSERT INTO main.{table}({columns}) '
+                        'SELECT {columns} FROM source.{table} '
+                        'WHERE {where}'.format(
+                            table=table, columns=columns,
+                            where=where.format(column=column,
+                                               shards=new_shards,
+                                               shard=shard)))
+                conn.commit()
+                conn.execute('DETACH DATABASE source')
+        finally:
+            conn.close()
+
+    with open(journal + '.tmp', 'w') as journal_file:
+        journal_file.write('{} {}\n'.format(old_shards, new_shards))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    os.replace(journal + '.tmp', journal)
+
+    _finish_reshard(database, old_shards, new_shards)
+
+    return _count_chats(targets)
+
+
+def _count_chats(paths):
+    """
+    :param paths: list of database file names
+    :return: list of the number of chats in each file
+    """
+    counts = []
+
+    for path in paths:
+        conn = sqlite3.connect(path)
+        try:
+            counts.append(conn.execute('SELECT count(*) FROM main.chat'
+                                       ).fetchone()[0])
+        finally:
+            conn.close()
+
+    return counts
@@ -0,0 +1,299 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the synthetic dataset generator behind `flask
+gen_synthetic`.
+
+It fills an empty database with a production-like data set:
+
+    - users who all share the password PASSWORD, hashed once at
+    TEST_ROUNDS, so that logging in works without a hash per user,
+    - chats whose popularity follows a Zipf law: the chat of popularity
+    rank k gets a share of the messages proportional to 1 / k ** zipf_s,
+    - memberships of log-normal sizes around a median, the sizes found in
+    group chats, with the more popular chats the larger,
+    - messages sent by members of their chat, at the times of a Poisson
+    process (exponential gaps) over the given number of days, ending at
+    end_ms.
+
+The same seed always gives the same data, at the same times before the
+newest message. The rows are written with executemany in transactions of
+chunk_size rows. Row by row, the triggers of the message table (full-text
+index, chat summaries, version counters) and its indexes would cost more than
+the inserts, so they are dropped for the load and rebuilt once at the end, in
+bulk.
+"""
+
+import bisect
+import itertools
+import math
+import random
+import time
+from exception_classes import *
+from password_hashing import hash_password, crypt_settings, TEST_ROUNDS
+from timestamps import now_ms, format_time_ms
+
+# the password of every generated user
+PASSWORD = 'password'
+
+CHUNK_SIZE = 100000
+
+# the default time of the newest message, 01/01/2025 00:00 UTC, fixed so
+# that the same seed gives the same times on every run
+END_MS = 1735689600000
+
+FIRST_NAMES = ('Avi', 'Jemal', 'Isaac', 'Morgan', 'Ada', 'Grace', 'Alan',
+               'Linus', 'Barbara', 'Ken', 'Dennis', 'Margaret', 'Edsger',
+               'Frances', 'John', 'Radia', 'Tim', 'Hedy', 'Donald',
+               'Katherine')
+LAST_NAMES = ('Vajpeyi', 'Jemal', 'Weiss', 'Thompson', 'Lovelace', 'Hopper',
+              'Turing', 'Torvalds', 'Liskov', 'Thompson', 'Ritchie',
+              'Hamilton', 'Dijkstra', 'Allen', 'McCarthy', 'Perlman',
+              'Berners-Lee', 'Lamarr', 'Knuth', 'Johnson')
+TOPICS = ('CS 232', 'Project', 'Lunch', 'Soccer', 'Study group', 'Roommates',
+          'Choir', 'Chess club', 'Hackathon', 'Book club', 'Lab', 'Trip')
+WORDS = ('the', 'a', 'to', 'and', 'is', 'are', 'we', 'you', 'I', 'it', 'in',
+         'on', 'at', 'for', 'meeting', 'tomorrow', 'today', 'tonight',
+         'class', 'homework', 'lab', 'test', 'code', 'bug', 'fixed', 'push',
+         'merge', 'database', 'query', 'lunch', 'dinner', 'coffee', 'library',
+         'see', 'there', 'soon', 'late', 'thanks', 'ok', 'sure', 'maybe',
+         'great', 'haha', 'what', 'when', 'where', 'who', 'why', 'how',
+         'donkey', 'wooster', 'kauke', 'game', 'practice', 'room', 'notes')
+
+# the tables whose triggers and indexes are dropped during the load
+LOADED_TABLES = ('user', 'chat', 'chat_rel', 'message')
+
+
+def zipf_cum_weights(count, zipf_s):
+    """
+    :param count: the number of items
+    :param zipf_s: the exponent of the Zipf law
+    :return: list of the cumulative weights of the popularity ranks
+    """
+    return list(itertools.accumulate(1 / rank ** zipf_s
+                                     for rank in range(1, count + 1)))
+
+
+def membership_size(chooser, users, median, popularity):
+    """
+    :param chooser: the random.Random of the generator
+    :param users: the number of users
+    :param median: the median number of members of a chat
+    :param popularity: the chat's share of the messages times the number of
+    chats, 1 for a chat of average popularity
+    :return: the number of members of a chat, from 2 to users
+    """
+    size = chooser.lognormvariate(math.log(median), 0.8) * \
+        max(1.0, popularity) ** 0.25
+
+    return max(2, min(users, int(size)))
+
+
+def _suspend(conn):
+    """
+    Drops the triggers and secondary indexes of the loaded tables.
+
+    :param conn: sqlite connection
+    :return: list of the SQL recreating them
+    """
+    saved = conn.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE type IN ('trigger', 'index') AND sql IS NOT NULL
+        AND tbl_name IN ({})
+        ORDER BY type = 'trigger'
+    '''.format(', '.join('?' * len(LOADED_TABLES))), LOADED_TABLES)
+    saved = [sql for sql, in saved]
+
+    for kind, name in conn.execute('''
+        SELECT type, name FROM sqlite_master
+        WHERE type IN ('trigger', 'index') AND sql IS NOT NULL
+        AND tbl_name IN ({})
+    '''.format(', '.join('?' * len(LOADED_TABLES))),
+            LOADED_TABLES).fetchall():
+        conn.execute('DROP {} {}'.format(kind.upper(), name))
+
+    return saved
+
+
+def _rebuild(conn, saved):
+    """
+    Recreates the dropped indexes and triggers, after rebuilding what the
+    triggers would have maintained: the full-text index, the chat summaries
+    and the version counters.
+
+    :param conn: sqlite connection
+    :param saved: the SQL returned by _suspend()
+    :return: None
+    """
+    for sql in saved:
+        if not sql.lstrip().upper().startswith('CREATE TRIGGER'):
+            conn.execute(sql)
+
+    conn.execute("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+    conn.execute('DELETE FROM chat_summary')
+    conn.execute('''
+        INSERT INTO chat_summary(chat_id, last_message_id, last_activity,
+                                 message_count, participant_count)
+        SELECT chat.id, sent.last_id,
+        max(coalesce(chat.time_ms, 0), coalesce(sent.last_time_ms, 0)),
+        coalesce(sent.messages, 0), coalesce(members.members, 0)
+        FROM chat
+        LEFT JOIN (SELECT chat_id, max(id) AS last_id,
+                   max(time_ms) AS last_time_ms, count(*) AS messages
+                   FROM message GROUP BY chat_id) AS sent
+        ON sent.chat_id = chat.id
+        LEFT JOIN (SELECT chat_id, count(*) AS members
+                   FROM chat_rel GROUP BY chat_id) AS members
+        ON members.chat_id = chat.id
+    ''')
+
+    conn.execute('''
+        INSERT INTO data_version(scope, version, modified_ms)
+        SELECT scope, 1, ? FROM
+            (SELECT value AS scope FROM json_each(?)
+             UNION ALL SELECT 'chat:' || id FROM chat)
+        WHERE true
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1,
+        modified_ms = excluded.modified_ms
+    ''', (now_ms(), '["user", "chat", "chat_rel", "message"]'))
+
+    for sql in saved:
+        if sql.lstrip().upper().startswith('CREATE TRIGGER'):
+            conn.execute(sql)
+
+
+def generate(conn, users, chats, messages, seed=0, zipf_s=1.1,
+             median_members=6, days=365, end_ms=END_MS,
+             chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Fills an empty database at the latest schema version with synthetic
+    users, chats, memberships and messages.
+
+    :param conn: sqlite connection
+    :param users: the number of users
+    :param chats: the number of chats
+    :param messages: the number of messages
+    :param seed: the seed of the random choices
+    :param zipf_s: the exponent of the chats' Zipf popularity
+    :param median_members: the median number of members of a chat
+    :param days: the messages are sent over the days before end_ms
+    :param end_ms: the time of the newest message; the same seed and end_ms
+    always give the same data
+    :param chunk_size: rows written per transaction
+    :param progress: function(stats) called after every message chunk
+    :return: dictionary of the generated counts and the seconds taken
+    """
+    if users < 2 or chats < 1:
+        raise RequestError(422, 'there must be at least 2 users and 1 chat')
+
+    if conn.execute('SELECT EXISTS(SELECT 1 FROM user)').fetchone()[0]:
+        raise RequestError(409, 'the database is not empty')
+
+    start = time.perf_counter()
+    chooser = random.Random(seed)
+    conn.commit()
+    # a crash leaves a half generated database either way
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+    conn.execute('PRAGMA synchronous = OFF')
+    saved = _suspend(conn)
+
+    try:
+        password_hash = hash_password(PASSWORD,
+                                      crypt_settings(rounds=TEST_ROUNDS))
+        conn.executemany(
+            'INSERT INTO user(id, name, email, username, password) '
+            'VALUES (?, ?, ?, ?, ?)',
+            ((user_id, '{} {}'.format(chooser.choice(FIRST_NAMES),
+                                      chooser.choice(LAST_NAMES)),
+              'user{}@woomessages.edu'.format(user_id),
+              'user{}'.format(user_id), password_hash)
+             for user_id in range(1, users + 1)))
+
+        start_ms = end_ms - days * 86400000
+
+        # chat_ranks[k] is the chat of popularity rank k + 1
+        chat_ranks = list(range(1, chats + 1))
+        chooser.shuffle(chat_ranks)
+        cum_weights = zipf_cum_weights(chats, zipf_s)
+        total = cum_weights[-1]
+
+        created = [start_ms - chooser.randrange(30 * 86400000)
+                   for _ in range(chats)]
+        conn.executemany(
+            'INSERT INTO chat(id, title, time, time_ms) VALUES (?, ?, ?, ?)',
+            ((chat_id, '{} {}'.format(chooser.choice(TOPICS), chat_id),
+              format_time_ms(created[chat_id - 1]), created[chat_id - 1])
+             for chat_id in range(1, chats + 1)))
+
+        members = {}
+        previous = 0.0
+        for rank, chat_id in enumerate(chat_ranks):
+            share = (cum_weights[rank] - previous) / total
+            previous = cum_weights[rank]
+            size = membership_size(chooser, users, median_members,
+                                   share * chats)
+            members[chat_id] = chooser.sample(range(1, users + 1), size)
+
+        conn.executemany(
+            'INSERT INTO chat_rel(user_id, chat_id) VALUES (?, ?)',
+            ((user_id, chat_id) for chat_id in range(1, chats + 1)
+             for user_id in members[chat_id]))
+        conn.commit()
+
+        stats = {'users': users, 'chats': chats,
+                 'chat_rels': sum(map(len, members.values())),
+                 'messages': 0, 'seconds': 0.0}
+
+        # a Poisson process with the given number of messages over the days
+        # sends them at the sorted times of as many uniform draws, made here
+        # in increasing order: each one is the minimum of the draws left
+        span_ms = end_ms - start_ms
+        elapsed = 0.0
+        minute, minute_text = None, None
+        message_id = 0
+
+        while message_id < messages:
+            count = min(chunk_size, messages - message_id)
+            ranks = [bisect.bisect(cum_weights, chooser.random() * total)
+                     for _ in range(count)]
+            rows = []
+
+            for rank in ranks:
+                message_id += 1
+                elapsed += (1.0 - elapsed) * (1.0 - chooser.random() ** (
+                    1.0 / (messages - message_id + 1)))
+                time_ms = start_ms + int(elapsed * span_ms)
+
+                # the time text has minutes, neighbours share it
+                if time_ms // 60000 != minute:
+                    minute = time_ms // 60000
+                    minute_text = format_time_ms(time_ms)
+
+                chat_id = chat_ranks[min(rank, chats - 1)]
+                rows.append((message_id,
+                             ' '.join(chooser.choices(
+                                 WORDS, k=chooser.randint(2, 12))),
+                             minute_text, chooser.choice(members[chat_id]),
+                             chat_id, time_ms))
+
+            conn.executemany('INSERT INTO message(id, message, time, '
+                             'user_id, chat_id, time_ms) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            conn.commit()
+
+            stats['messages'] = message_id
+            stats['seconds'] = time.perf_counter() - start
+            if progress is not None:
+                progress(stats)
+    finally:
+        _rebuild(conn, saved)
+        conn.commit()
+        conn.execute('PRAGMA synchronous = {}'.format(synchronous))
+
+    stats['seconds'] = time.perf_counter() - start
+
+    return stats
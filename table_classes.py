@@ -1,24 +1,120 @@
-
-class Message:
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing the model classes of the WooMessages tables and the data
+mapper between them and the database.
+
+Every model is a Record: one slot per column of its table, in the table's
+column order, and no per-object __dict__. The mapper reads rows as plain
+cursor tuples and hydrates a record straight from each (Record._make, used
+by fetch_records in database_class.py), and writes records straight to JSON
+text (to_json, records_to_json), so no dictionary is built for a row on the
+way from the database to the client.
+"""
+
+import json
+import operator
+from json.encoder import encode_basestring_ascii
+
+# the JSON encoding of the types sqlite returns, the same text json.dumps
+# makes for them; any other value (e.g. a float inf) goes through json.dumps
+_ENCODERS = {str: encode_basestring_ascii,
+             int: int.__repr__,
+             type(None): lambda value: 'null'}
+
+
+class Record:
     """
-    An object from this class represents a message. In particular it stores the
-    message content, the user sender, the time and chat the message is sent to.
+    The base class of the models. A subclass lists its table's columns in
+    __slots__ (at least two, so that attrgetter returns a tuple) and names
+    its table in table.
     """
 
-    def __init__(self, message, time, chat, user):
+    __slots__ = ()
+    table = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls.columns = tuple(cls.__slots__)
+        cls._get_values = operator.attrgetter(*cls.columns)
+        # '{"id":%s,"title":%s}', the keys are encoded once per model
+        cls._json_template = '{' + ','.join(json.dumps(column) + ':%s'
+                                            for column in cls.columns) + '}'
+
+    def __init__(self, *values, **columns):
+        """
+        Construct a record from its column values, in column order or by
+        name. Missing columns are None.
+        """
+        for column, value in zip(self.columns, values):
+            setattr(self, column, value)
+
+        for column in self.columns[len(values):]:
+            setattr(self, column, columns.pop(column, None))
+
+        if columns:
+            raise TypeError('{} has no column {}'.format(
+                type(self).__name__, ', '.join(columns)))
+
+    @classmethod
+    def _make(cls, row):
+        """
+        Hydrates a record from a cursor tuple holding its columns in order.
+
+        :param row: tuple of column values
+        :return: the record
         """
-        Construct a Message object using its message content,
-        the sender user, and the chat and time the message is sent.
+        record = cls.__new__(cls)
 
-        :param message: message content being sent
-        :param time: time the message is sent
-        :param chat: chat the message is sent in
-        :param user: the user sending the message
+        for column, value in zip(cls.columns, row):
+            setattr(record, column, value)
+
+        return record
+
+    @classmethod
+    def select(cls):
+        """
+        :return: the SELECT ... FROM clause reading the model's columns in
+        order
+        """
+        return 'SELECT {} FROM {}'.format(', '.join(cls.columns), cls.table)
+
+    def values(self):
+        """
+        :return: tuple of the record's column values, in column order
+        """
+        return self._get_values(self)
+
+    def to_dict(self):
+        """
+        :return: dictionary of the record's columns
+        """
+        return dict(zip(self.columns, self.values()))
+
+    def to_json(self):
+        """
+        :return: the record as a JSON object, e.g. '{"id":1,"title":"x"}'
         """
-        self._message = message
-        self._time = time
-        self._chat = chat
-        self._user = user
+        return self._json_template % tuple([
+            _ENCODERS[type(value)](value) if type(value) in _ENCODERS
+            else json.dumps(value) for value in self._get_values(self)])
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+
+class Message(Record):
+    """
+    An object from this class represents a message. In particular it stores the
+    message content, the user sender, the time and chat the message is sent to.
+    """
+
+    __slots__ = ('id', 'message', 'time', 'user_id', 'chat_id', 'time_ms')
+    table = 'message'
 
     def __repr__(self):
         """
@@ -26,41 +122,34 @@ class Message:
 
         The format is as follows:
 
-           <user>: "<message>" @ <time> in <chat>
+           <user_id>: "<message>" @ <time> in <chat_id>
 
         :return: the string representation of the message
         """
-        return '{}: \"{}\" @ {} in {}'.format(self._user, self._message,
-                                              self._time, self._chat)
+        return '{}: \"{}\" @ {} in {}'.format(self.user_id, self.message,
+                                              self.time, self.chat_id)
 
     def get_user(self):
-        return self._user
+        return self.user_id
 
     def get_message(self):
-        return self._message
+        return self.message
 
     def get_time(self):
-        return self._time
+        return self.time
 
     def get_chat(self):
-        return self._chat
+        return self.chat_id
 
 
-class Chat:
+class Chat(Record):
     """
     An object from this class represents a chat. In particular it stores the
     title and time of a chat.
     """
 
-    def __init__(self, title, time):
-        """
-        Construct a Chat object using its title and time of creation
-
-        :param title: title of chat
-        :param time: time of creation for chat
-        """
-        self._title = title
-        self._time = time
+    __slots__ = ('id', 'title', 'time', 'time_ms')
+    table = 'chat'
 
     def __repr__(self):
         """
@@ -72,78 +161,60 @@ class Chat:
 
         :return: the string representation of the chat
         """
-        return '{}, a chat created on {}'.format(self._title, self._time)
+        return '{}, a chat created on {}'.format(self.title, self.time)
 
     def get_title(self):
-        return self._title
+        return self.title
 
     def get_time(self):
-        return self._time
+        return self.time
 
 
-class User:
+class User(Record):
     """
     An object from this class represents a user. In particular it stores the
     name, email, username and password (ENRYPTED) of the user.
     """
 
-    def __init__(self, name, email, username, password):
-        """
-        Construct a User object using its name, email, username, password.
-
-        :param name: name of the user
-        :param email: email of the user
-        :param username: unique username of the user
-        :param password: the password of the user
-        """
-        self._name = name
-        self._email = email
-        self._username = username
-        self._password = password
+    __slots__ = ('id', 'name', 'email', 'username', 'password')
+    table = 'user'
 
     def __repr__(self):
         """
-        Create a string representation of a user.
+        Create a string representation of a user. The password hash is left
+        out.
 
         The format is as follows:
 
-           <username>: <name> whose email is <email> and password is <password>
+           <username>: <name> whose email is <email>
 
         :return: the string representation of the user
         """
-        return '<username>: <name> whose email is <email>' \
-               ' and password is <password>'.format(self._username, self._name,
-                                                    self._email,
-                                                    self._password)
+        return '{}: {} whose email is {}'.format(self.username, self.name,
+                                                 self.email)
 
     def get_username(self):
-        return self._username
+        return self.username
 
     def get_name(self):
-        return self._name
+        return self.name
 
     def get_email(self):
-        return self._email
+        return self.email
 
     def get_password(self):
-        return self._password
+        return self.password
 
 
-class ChatRel:
+class ChatRel(Record):
     """
     An object from this class represents a chat relationship. In particular
-    it stores the ID's that represent which user belongs to which chat
+    it stores the ID's that represent which user belongs to which chat, and
+    the id of the newest message of the chat the user has read
     """
 
-    def __init__(self, user, chat):
-        """
-        Construct a Chat Relationship object using user id and chat id
-
-        :param user: ID of user
-        :param chat: ID of chat
-        """
-        self._user = user
-        self._chat = chat
+    __slots__ = ('id', 'user_id', 'chat_id', 'last_read_id')
+    table = 'chat_rel'
 
     def __repr__(self):
         """
@@ -151,14 +222,29 @@ class ChatRel:
 
         The format is as follows:
 
-           <user> belongs to <chat>
+           <user_id> belongs to <chat_id>
 
         :return: the string representation of the chat relationship
         """
-        return '{} belongs to {}'.format(self._user, self._chat)
+        return '{} belongs to {}'.format(self.user_id, self.chat_id)
 
     def get_user_id(self):
-        return self._user
+        return self.user_id
 
     def get_chat_id(self):
-        return self._chat
+        return self.chat_id
+
+    def get_last_read_id(self):
+        return self.last_read_id
+
+
+# the model of each table
+MODELS = {model.table: model for model in (Message, Chat, User, ChatRel)}
+
+
+def records_to_json(records):
+    """
+    :param records: iterable of records
+    :return: the records as a JSON list
+    """
+    return '[' + ','.join(record.to_json() for record in records) + ']'
@@ -0,0 +1,105 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import datetime
+import os
+import app_main
+from timestamps import to_time_ms, now_ms
+
+
+def test_archive_keeps_history_readable(fresh_client, tmp_path):
+    """
+    Tests that the archive job moves the old messages into one file per
+    year, keeps the chat summaries, and that the chat pages and the search
+    still read the archived messages, from any pooled connection.
+
+    :param fresh_client: flask test client on an empty database
+    :param tmp_path: pytest temporary directory
+    """
+    times = [to_time_ms(datetime.datetime(2017, 3, 1)) + i for i in range(3)]
+    times += [to_time_ms(datetime.datetime(2018, 6, 1)) + i for i in range(2)]
+    times += [now_ms() + i for i in range(2)]
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, 1, ?)',
+                         [('donkey number {}'.format(i), '', time_ms)
+                          for i, time_ms in enumerate(times)])
+        conn.commit()
+        summary = conn.execute('SELECT * FROM chat_summary').fetchall()
+
+        assert app_main.archive_old_messages(days=30) == {'2017': 3,
+                                                          '2018': 2}
+        assert app_main.archive_old_messages(days=30) == {}
+
+        assert conn.execute('SELECT count(*) FROM main.message'
+                            ).fetchone()[0] == 2
+        assert [tuple(row) for row in conn.execute(
+            'SELECT period, path, message_count FROM message_archive')] == \
+            [('2017', 'WooMessages-2017.sqlite', 3),
+             ('2018', 'WooMessages-2018.sqlite', 2)]
+        assert os.path.exists(str(tmp_path / 'WooMessages-2017.sqlite'))
+        assert conn.execute('SELECT * FROM chat_summary').fetchall() == \
+            summary
+
+    # a second connection attaches the archives on its first read
+    with app_main.app.app_context():
+        app_main.get_db()
+        with app_main.app.app_context():
+            messages, older, _ = app_main.get_message_page(1, 4)
+            assert [message.message for message in messages] == \
+                ['donkey number {}'.format(i) for i in range(3, 7)]
+
+            messages, older, _ = app_main.get_message_page(1, 4,
+                                                           before=older)
+            assert [message.message for message in messages] == \
+                ['donkey number {}'.format(i) for i in range(3)]
+            assert older is None
+
+    page = fresh_client.get('/chat_room/1/?before=' +
+                            app_main.encode_cursor((times[3], 4))).data
+    assert b'donkey number 2' in page
+
+    results = fresh_client.get('/api/message/search?q=donkey').get_json()
+    assert sorted(row['id'] for row in results) == list(range(1, 8))
+    assert results[0]['snippet'] == '<mark>donkey</mark> number {}'.format(
+        results[0]['id'] - 1)
+
+
+def test_archive_keeps_ids_unique(fresh_client):
+    """
+    Tests that archiving the newest messages does not let a new message
+    take the id of an archived one.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    old_ms = to_time_ms(datetime.datetime(2017, 3, 1))
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, 1, ?)',
+                         [('old {}'.format(i), '', old_ms + i)
+                          for i in range(3)])
+        conn.commit()
+
+        assert app_main.archive_old_messages(days=30) == {'2017': 3}
+        archived = [row[0] for row in conn.execute(
+            'SELECT id FROM message_history')]
+        assert conn.execute('SELECT count(*) FROM main.message'
+                            ).fetchone()[0] == 0
+
+    fresh_client.post('/api/message/', data={
+        'message': 'new', 'time': '04/25/2018 21:50', 'user_id': 1,
+        'chat_id': 1})
+
+    with app_main.app.app_context():
+        new_id, = app_main.get_db().execute(
+            "SELECT id FROM main.message WHERE message = 'new'").fetchone()
+        assert new_id > max(archived)
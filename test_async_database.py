@@ -0,0 +1,62 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import asyncio
+import threading
+import pytest
+import connection_pool
+from async_database import AsyncWooMessageDB
+from exception_classes import RequestError
+
+
+def test_async_database(tmp_path):
+    """
+    Tests that the awaitable methods run concurrently on at most pool_size
+    connections off the event loop's thread, and that iter_rows walks a
+    whole table in batches.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = str(tmp_path / 'async.sqlite')
+
+    async def main():
+        async with AsyncWooMessageDB(path, pool_size=2) as db:
+            user = await db.insert_user('A', 'a@a.a', 'a', 'x')
+            chat = await db.insert_chat('Async chat', '04/25/2018 21:49')
+            await db.insert_chat_rel(user['id'], chat['id'])
+
+            # more concurrent inserts than connections
+            await asyncio.gather(*[
+                db.insert_message('message {}'.format(number), '',
+                                  user['id'], chat['id'], number)
+                for number in range(50)])
+            assert db.pool_stats()['created'] <= 2
+
+            messages = await db.get_messages_in_chatroom(chat['id'])
+            assert [message.time for message in messages] == \
+                list(range(50))
+            assert (await db.get_chat_rooms(user['id']))[0].message_count \
+                == 50
+
+            rows = [row async for row in db.iter_rows('message',
+                                                      batch_size=7)]
+            assert [row['id'] for row in rows] == list(range(1, 51))
+            records = [row async for row in db.iter_rows(
+                'message', batch_size=50, as_records=True)]
+            assert [record.id for record in records] == list(range(1, 51))
+
+            assert await db.query_by_id('message', 1000) is None
+            return db
+
+    db = asyncio.run(main())
+    assert threading.active_count() < 10
+
+    with pytest.raises(RequestError):
+        asyncio.run(db.get_user_id('a'))
+
+    connection_pool.close_pools(path)
@@ -0,0 +1,102 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import csv
+import pytest
+from passlib.hash import sha256_crypt
+from database_class import WooMessageDB
+
+
+def write_csv(path, count):
+    """
+    Writes a CSV export of count messages from three users in two chats,
+    plus one user whose email is already taken.
+
+    :param path: the CSV file to write
+    :param count: the number of messages
+    """
+    with open(str(path), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Username', 'Password', 'Name', 'Email',
+                         'Chat_Title', 'Message', 'Time'])
+        for i in range(count):
+            user = i % 3
+            writer.writerow(['user{}'.format(user), 'pw{}'.format(user),
+                             'User {}'.format(user),
+                             'u{}@wooster.edu'.format(user),
+                             'chat {}'.format(i % 2),
+                             'message {}'.format(i),
+                             '04/25/2018 21:{:02d}'.format(i % 60)])
+        writer.writerow(['copycat', 'pw', 'Copycat', 'u0@wooster.edu',
+                         'chat 0', 'skipped', '04/25/2018 22:00'])
+
+
+def table_counts(db):
+    """
+    :param db: a WooMessageDB
+    :return: the number of rows of user, chat, chat_rel and message
+    """
+    return [db._conn.execute('SELECT count(*) FROM ' + table).fetchone()[0]
+            for table in ('user', 'chat', 'chat_rel', 'message')]
+
+
+def test_bulk_import(tmp_path):
+    """
+    Tests that the importer creates each user and chat once, hashes the
+    passwords in worker processes and skips rows with a taken email.
+
+    :param tmp_path: pytest temporary directory
+    """
+    write_csv(tmp_path / 'export.csv', 10)
+
+    with WooMessageDB(str(tmp_path / 'import.sqlite')) as db:
+        stats = db.convert_csv_to_sqlite(str(tmp_path / 'export.csv'),
+                                         chunk_size=4, workers=2)
+
+        assert table_counts(db) == [3, 2, 6, 10]
+        assert stats['rows'] == 11
+        assert stats['skipped'] == 1
+        assert stats['chunks'] == 3
+
+        password = db._conn.execute("SELECT password FROM user "
+                                    "WHERE username = 'user1'").fetchone()[0]
+        assert sha256_crypt.verify('pw1', password)
+
+        assert db._conn.execute('SELECT count(*) FROM message '
+                                'WHERE time_ms IS NULL').fetchone()[0] == 0
+
+
+def test_bulk_import_resumes(tmp_path):
+    """
+    Tests that an import interrupted after its first chunk continues from
+    its checkpoint and ends up with the same rows as an uninterrupted one.
+
+    :param tmp_path: pytest temporary directory
+    """
+    write_csv(tmp_path / 'export.csv', 10)
+
+    def interrupt(stats):
+        raise KeyboardInterrupt
+
+    with WooMessageDB(str(tmp_path / 'import.sqlite')) as db:
+        with pytest.raises(KeyboardInterrupt):
+            db.convert_csv_to_sqlite(str(tmp_path / 'export.csv'),
+                                     chunk_size=4, workers=0,
+                                     progress=interrupt)
+        assert table_counts(db)[3] == 4
+
+        stats = db.convert_csv_to_sqlite(str(tmp_path / 'export.csv'),
+                                         resume=True, chunk_size=4,
+                                         workers=0)
+
+        assert stats['resumed_at'] == 4
+        assert stats['rows'] == 11
+        assert table_counts(db) == [3, 2, 6, 10]
+        assert [text for text, in db._conn.execute(
+            'SELECT message FROM message ORDER BY id')] == \
+            ['message {}'.format(i) for i in range(10)]
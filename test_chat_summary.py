@@ -0,0 +1,105 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import app_main
+from test_pagination import add_messages
+
+# the chat summaries aggregated from the message and chat_rel tables
+AGGREGATED_SUMMARIES = '''
+    SELECT chat.id,
+    (SELECT max(id) FROM message WHERE chat_id = chat.id),
+    max(chat.time_ms, coalesce((SELECT max(time_ms) FROM message
+                                WHERE chat_id = chat.id), 0)),
+    (SELECT count(*) FROM message WHERE chat_id = chat.id),
+    (SELECT count(*) FROM chat_rel WHERE chat_id = chat.id)
+    FROM chat ORDER BY chat.id
+'''
+
+
+def test_summaries_follow_changes(fresh_client):
+    """
+    Tests that the triggers keep chat_summary equal to the aggregates of the
+    message and chat_rel tables through inserts, updates and deletes, and
+    that the dashboard lists the chats by their last activity.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(4)
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+
+        def assert_summaries():
+            summaries = conn.execute(
+                'SELECT * FROM chat_summary ORDER BY chat_id').fetchall()
+            assert [tuple(row) for row in summaries] == \
+                [tuple(row) for row in conn.execute(AGGREGATED_SUMMARIES)]
+
+        assert_summaries()
+
+        app_main.insert_chat_room('Quiet chat', ['tester'])
+        assert_summaries()
+        assert [chat.title for chat in app_main.get_chat_rooms(1)] == \
+            ['Quiet chat', 'Test chat']
+
+        app_main.insert_message('hello', '', 1, 2, 10 ** 13)
+        conn.execute('UPDATE message SET chat_id = 2 WHERE id = 4')
+        conn.execute('UPDATE message SET time_ms = 100000000000000 WHERE id = 1')
+        conn.commit()
+        assert_summaries()
+        assert [chat.title for chat in app_main.get_chat_rooms(1)] == \
+            ['Test chat', 'Quiet chat']
+
+        app_main.delete_item('message', 1)
+        app_main.delete_item('message', 5)
+        app_main.delete_user_from_chat('tester', 2)
+        assert_summaries()
+
+        app_main.delete_item('chat', 2)
+        assert_summaries()
+
+        chat = app_main.get_chat_rooms(1)[0]
+        assert (chat.message_count, chat.participant_count,
+                chat.last_message, chat.last_sender) == \
+            (2, 1, 'message 2', 'Tester')
+
+    page = fresh_client.get('/dashboard').data
+    assert b'message 2' in page
+
+
+def test_dashboard_pages(fresh_client, monkeypatch):
+    """
+    Tests that the dashboard lists DASHBOARD_PAGE_SIZE chats at a time,
+    most recently active first, and that its cursor leads to the rest.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    with app_main.app.app_context():
+        for number in range(4):
+            app_main.insert_chat_room('Chat {}'.format(number), ['tester'])
+
+        rooms, older = app_main.get_chat_rooms_page(1, 2)
+        assert [room.title for room in rooms] == ['Chat 3', 'Chat 2']
+
+        rooms, older = app_main.get_chat_rooms_page(1, 2, before=older)
+        assert [room.title for room in rooms] == ['Chat 1', 'Chat 0']
+
+        rooms, older = app_main.get_chat_rooms_page(1, 2, before=older)
+        assert [room.title for room in rooms] == ['Test chat']
+        assert older is None
+
+    monkeypatch.setitem(app_main.app.config, 'DASHBOARD_PAGE_SIZE', 3)
+    page = fresh_client.get('/dashboard').data
+    assert b'Chat 1' in page and b'Chat 0' not in page
+
+    start = page.index(b'/dashboard?before=')
+    link = page[start:page.index(b'"', start)].decode()
+    page = fresh_client.get(link).data
+    assert b'Chat 0' in page and b'Test chat' in page
+    assert b'Chat 1' not in page
@@ -0,0 +1,77 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import app_main
+from test_pagination import add_messages
+
+
+def test_api_etags(fresh_client):
+    """
+    Tests that a repeated GET with If-None-Match is answered with 304 until
+    the table changes, and that other arguments get other tags.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(3)
+
+    response = fresh_client.get('/api/message/')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response = fresh_client.get('/api/message/',
+                                headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = fresh_client.get('/api/message/?limit=1',
+                                headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    # the date has whole seconds, only the ETag tells versions apart
+    response = fresh_client.get('/api/message/', headers={
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+
+    # a new user does not change the messages
+    fresh_client.post('/api/user/', data={
+        'name': 'Ada', 'email': 'ada@wooster.edu', 'username': 'ada',
+        'password': 'lovelace'})
+    assert fresh_client.get('/api/message/', headers={
+        'If-None-Match': etag}).status_code == 304
+
+    fresh_client.delete('/api/message/1')
+    response = fresh_client.get('/api/message/',
+                                headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_chat_room_etags(fresh_client):
+    """
+    Tests that a chat page is only sent again when its own chat changes.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    with app_main.app.app_context():
+        app_main.insert_chat('Other chat', '04/25/2018 21:49')
+
+    etag = fresh_client.get('/chat_room/1/').headers['ETag']
+    conditional = {'If-None-Match': etag}
+
+    fresh_client.post('/api/message/', data={
+        'message': 'elsewhere', 'time': '04/25/2018 21:50', 'user_id': 1,
+        'chat_id': 2})
+    assert fresh_client.get('/chat_room/1/',
+                            headers=conditional).status_code == 304
+
+    fresh_client.post('/api/message/', data={
+        'message': 'here', 'time': '04/25/2018 21:50', 'user_id': 1,
+        'chat_id': 1})
+    response = fresh_client.get('/chat_room/1/', headers=conditional)
+    assert response.status_code == 200
+    assert b'here' in response.data
@@ -0,0 +1,134 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import os
+import threading
+import time
+import pytest
+import app_main
+from connection_pool import ConnectionPool, WAL_PROFILE, trace_statements
+from exception_classes import RequestError
+
+
+def test_pool_reuses_and_bounds_connections(tmp_path):
+    """
+    Tests that released connections are reused, that their PRAGMAs are set
+    once, and that a full pool times out with a 503.
+
+    :param tmp_path: pytest temporary directory
+    """
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'), max_size=2,
+                          timeout=0.05, pragmas=[('foreign_keys', 'ON')])
+
+    for _ in range(5):
+        with pool.connection() as conn:
+            assert conn.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+    assert pool.stats()['created'] == 1
+
+    first = pool.acquire()
+    second = pool.acquire()
+    with pytest.raises(RequestError) as error:
+        pool.acquire()
+    assert error.value.status_code == '503'
+
+    # a waiting thread gets the connection as soon as it is released
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    pool._timeout = 5
+    waiter.start()
+    pool.release(first)
+    waiter.join()
+
+    assert got == [first]
+    stats = pool.stats()
+    assert stats['created'] == 2
+    assert stats['in_use'] == 2
+    assert stats['timeouts'] == 1
+    assert stats['waits'] == 1
+
+    pool.release(second)
+    pool.release(got[0])
+    pool.close()
+    assert pool.stats()['created'] == 0
+
+
+def test_requests_share_pooled_connections(fresh_client):
+    """
+    Tests that consecutive requests borrow the same pooled connection and
+    give it back at teardown.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    for _ in range(3):
+        assert fresh_client.get('/api/chat/1').status_code == 200
+
+    stats = fresh_client.get('/api/metrics/').get_json()['db_pool']
+
+    assert stats['created'] == 1
+    assert stats['in_use'] == 0
+    assert stats['acquired'] >= 3
+
+
+def test_storage_profile_and_checkpoints(tmp_path):
+    """
+    Tests that the WAL storage profile is applied to pooled connections and
+    that the periodic checkpoints empty the -wal file on the pool's own
+    thread, not when a connection is released.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = str(tmp_path / 'wal.sqlite')
+    pool = ConnectionPool(path, pragmas=WAL_PROFILE.items(),
+                          checkpoint_interval=0.05)
+
+    with pool.connection() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert conn.execute('PRAGMA temp_store').fetchone()[0] == 2
+
+        conn.execute('CREATE TABLE t (x)')
+        conn.executemany('INSERT INTO t VALUES (?)',
+                         [(i,) for i in range(1000)])
+        conn.commit()
+        assert os.path.getsize(path + '-wal') > 0
+
+    deadline = time.monotonic() + 5
+    while (not pool.stats()['checkpoints'] or
+           os.path.getsize(path + '-wal') > 0) and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert pool.stats()['checkpoints'] >= 1
+    assert pool.stats()['last_checkpoint'][0] == 0  # not blocked
+    assert os.path.getsize(path + '-wal') == 0
+    pool.close()
+
+
+def test_trace_statements(tmp_path):
+    """
+    Tests that trace_statements sees the SQL of every borrowed connection
+    until it is turned off.
+
+    :param tmp_path: pytest temporary directory
+    """
+    pool = ConnectionPool(str(tmp_path / 'trace.sqlite'))
+    statements = []
+
+    trace_statements(statements.append)
+    try:
+        with pool.connection() as conn:
+            conn.execute('SELECT 1')
+    finally:
+        trace_statements(None)
+
+    with pool.connection() as conn:
+        conn.execute('SELECT 2')
+    pool.close()
+
+    assert statements == ['SELECT 1']
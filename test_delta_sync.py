@@ -0,0 +1,73 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import threading
+import time
+import app_main
+from test_pagination import add_messages
+
+
+def test_since_id_and_since_time(fresh_client):
+    """
+    Tests that only newer messages are returned, that next_since walks
+    through them and that bad arguments are rejected.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(5)
+
+    content = fresh_client.get('/api/chat/1/messages?since_id=1&limit=3')\
+        .get_json()
+    assert [row['id'] for row in content['messages']] == [2, 3, 4]
+    assert content['more']
+
+    content = fresh_client.get('/api/chat/1/messages?since_id={}'.format(
+        content['next_since'])).get_json()
+    assert [row['id'] for row in content['messages']] == [5]
+    assert not content['more']
+
+    content = fresh_client.get('/api/chat/1/messages?since_id=5').get_json()
+    assert content == {'messages': [], 'next_since': 5, 'more': False}
+
+    # add_messages gives messages 3 and 4 time_ms 1001
+    content = fresh_client.get('/api/chat/1/messages?since_time=1000')\
+        .get_json()
+    assert [row['id'] for row in content['messages']] == [3, 4, 5]
+
+    assert fresh_client.get('/api/chat/1/messages?since_id=x')\
+        .status_code == 422
+    assert fresh_client.get('/api/chat/1/messages?wait=-1')\
+        .status_code == 422
+
+
+def test_long_poll(fresh_client):
+    """
+    Tests that a long-poll is answered as soon as a message arrives, and
+    that it gives up after wait seconds otherwise.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    start = time.monotonic()
+    content = fresh_client.get('/api/chat/1/messages?since_id=0&wait=1')\
+        .get_json()
+    assert content['messages'] == []
+    assert time.monotonic() - start >= 0.9
+
+    def send():
+        app_main.app.test_client().post('/api/message/', data={
+            'message': 'polled', 'time': '04/25/2018 21:50', 'user_id': 1,
+            'chat_id': 1})
+
+    threading.Timer(0.1, send).start()
+    start = time.monotonic()
+    content = fresh_client.get('/api/chat/1/messages?since_id=0&wait=10')\
+        .get_json()
+
+    assert time.monotonic() - start < 5
+    assert [row['message'] for row in content['messages']] == ['polled']
+    assert content['next_since'] == content['messages'][0]['id']
@@ -0,0 +1,111 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import json
+import threading
+import app_main
+from events import MessageBroker
+from test_pagination import add_messages
+
+
+def test_broker_wakes_subscribers():
+    """
+    Tests that a subscriber sleeps until a newer message of its own chat is
+    published.
+    """
+    broker = MessageBroker()
+
+    assert not broker.wait(1, 0, 0.05)
+
+    timer = threading.Timer(0.05, broker.publish, args=(2, 7))
+    timer.start()
+    assert not broker.wait(1, 0, 0.2)  # another chat
+    timer.join()
+
+    threading.Timer(0.05, broker.publish, args=(1, 8)).start()
+    assert broker.wait(1, 7, 5)
+    assert not broker.wait(1, 8, 0.01)
+    assert broker.stats()['published'] == 2
+
+
+def test_broker_forgets_old_chats():
+    """
+    Tests that the broker drops a chat's channel when its last waiter leaves
+    and remembers the latest ids of a bounded number of chats.
+    """
+    broker = MessageBroker(max_chats=3)
+
+    for chat_id in range(1, 11):
+        broker.publish(chat_id, chat_id)
+        assert not broker.wait(chat_id, chat_id, 0.001)
+
+    assert broker.wait(10, 0, 0)  # newer than what the caller has seen
+    stats = broker.stats()
+    assert (stats['chats'], stats['channels'], stats['waiting']) == (3, 0, 0)
+
+
+def read_events(response, count):
+    """
+    Reads events from a streamed SSE response, skipping comments.
+
+    :param response: a response returned with buffered=False
+    :param count: the number of events to read
+    :return: list of the events' (id, data) as they were sent
+    """
+    events = []
+
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        fields = dict(line.split(': ', 1) for line in chunk.splitlines()
+                      if line and not line.startswith(':'))
+        if 'data' in fields:
+            events.append((int(fields['id']), json.loads(fields['data'])))
+            if len(events) == count:
+                break
+
+    return events
+
+
+def test_chat_room_stream(fresh_client, monkeypatch):
+    """
+    Tests that the stream replays the messages after Last-Event-ID and then
+    pushes a message as soon as it is inserted.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setitem(app_main.app.config, 'SSE_KEEPALIVE', 0.05)
+    add_messages(3)
+
+    response = fresh_client.get('/chat_room/1/stream', buffered=False,
+                                headers={'Last-Event-ID': '1'})
+    assert response.mimetype == 'text/event-stream'
+
+    events = read_events(response, 2)
+    assert [event_id for event_id, _ in events] == [2, 3]
+    assert events[0][1]['message'] == 'message 1'
+    assert events[0][1]['name'] == 'Tester'
+
+    def send():
+        app_main.app.test_client().post('/api/message/', data={
+            'message': 'pushed', 'time': '04/25/2018 21:50', 'user_id': 1,
+            'chat_id': 1})
+
+    threading.Timer(0.1, send).start()
+    events = read_events(response, 1)
+    response.close()
+
+    assert events[0][0] == 4
+    assert events[0][1]['message'] == 'pushed'
+
+    stats = fresh_client.get('/api/metrics/').get_json()
+    assert stats['events']['published'] >= 1
+    assert stats['db_pool']['in_use'] == 0
+
+    # the chat id is an integer before anything is streamed
+    assert fresh_client.get('/chat_room/abc/stream').status_code == 404
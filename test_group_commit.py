@@ -0,0 +1,138 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import sqlite3
+import threading
+import pytest
+import app_main
+from group_commit import GroupCommitWriter, close_writer
+from database_class import insert_message_row
+
+
+def test_writer_batches_and_isolates_failures(tmp_path):
+    """
+    Tests that concurrent submits are committed in shared batches, that
+    every row is visible once its future resolves and that a failing
+    operation does not undo the rest of its batch.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = str(tmp_path / 'group.sqlite')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x UNIQUE)')
+    conn.commit()
+
+    def insert(cur, x):
+        cur.execute('INSERT INTO t VALUES (?)', (x,))
+        return x
+
+    writer = GroupCommitWriter(path, window=0.05)
+    results = []
+
+    def sender(x):
+        results.append(writer.submit(insert, x).result())
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == list(range(20))
+    assert conn.execute('SELECT count(*) FROM t').fetchone()[0] == 20
+
+    good = writer.submit(insert, 100)
+    duplicate = writer.submit(insert, 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result()
+    assert good.result() == 100
+
+    stats = writer.stats()
+    writer.close()
+
+    assert stats['operations'] == 22
+    assert stats['failures'] == 1
+    assert stats['batches'] < 22
+    assert conn.execute('SELECT count(*) FROM t').fetchone()[0] == 21
+
+
+def test_app_inserts_through_writer(fresh_client, monkeypatch):
+    """
+    Tests that with GROUP_COMMIT on, the API inserts go through the writer
+    and show up in its metrics.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setitem(app_main.app.config, 'GROUP_COMMIT', True)
+
+    try:
+        response = fresh_client.post('/api/message/', data={
+            'message': 'batched', 'time': '04/25/2018 21:49', 'user_id': 1,
+            'chat_id': 1})
+        assert response.status_code == 200
+        assert response.get_json()['message'] == 'batched'
+
+        # joining a chat twice keeps one membership
+        for _ in range(2):
+            response = fresh_client.post('/api/chatrel/', data={
+                'user_id': 1, 'chat_id': 1})
+            assert response.get_json()['id'] == 1
+
+        stats = fresh_client.get('/api/metrics/').get_json()['group_commit']
+        assert stats['operations'] == 3
+        assert stats['failures'] == 0
+    finally:
+        close_writer(app_main.app.config['DATABASE'])
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        assert conn.execute("SELECT count(*) FROM message WHERE "
+                            "message = 'batched'").fetchone()[0] == 1
+
+
+def test_timed_out_write_is_not_committed(fresh_client, monkeypatch):
+    """
+    Tests that a write that times out waiting for the writer is answered
+    with a 503 and cancelled, so that it is never committed.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setitem(app_main.app.config, 'GROUP_COMMIT', True)
+    monkeypatch.setitem(app_main.app.config, 'GROUP_COMMIT_TIMEOUT', 0.1)
+    with app_main.app.app_context():
+        writer = app_main.get_group_commit_writer(1)
+    started = threading.Event()
+    blocked = threading.Event()
+
+    def block(cur):
+        started.set()
+        blocked.wait()
+
+    try:
+        # keep the writer busy past the timeout
+        writer.submit(block)
+        started.wait()
+
+        response = fresh_client.post('/api/message/', data={
+            'message': 'timed out', 'time': '04/25/2018 21:49',
+            'user_id': 1, 'chat_id': 1})
+        assert response.status_code == 503
+
+        blocked.set()
+        assert writer.submit(insert_message_row, 'after', '', 1, 1,
+                             2).result()['message'] == 'after'
+    finally:
+        blocked.set()
+        close_writer(app_main.app.config['DATABASE'])
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        assert [row[0] for row in conn.execute('SELECT message FROM message')
+                ] == ['after']
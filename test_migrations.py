@@ -0,0 +1,121 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import sqlite3
+from migrations import SCHEMA_VERSION, migrate, get_schema_version
+from database_class import WooMessageDB
+from timestamps import parse_time, format_time_ms
+
+
+def make_legacy_db(path):
+    """
+    Creates a database with the unversioned schema that the old init_db()
+    used to create, holding one chat with a duplicated chat_rel row.
+
+    :param path: the file to create the database in
+    """
+    conn = sqlite3.connect(str(path))
+    conn.executescript('''
+        CREATE TABLE user (id INTEGER PRIMARY KEY, name TEXT,
+                           email TEXT UNIQUE, username TEXT UNIQUE,
+                           password TEXT);
+        CREATE TABLE chat_rel(id INTEGER PRIMARY KEY, user_id INTEGER,
+                              chat_id INTEGER);
+        CREATE TABLE chat(id INTEGER PRIMARY KEY, title TEXT, time TEXT);
+        CREATE TABLE message (id INTEGER PRIMARY KEY, message TEXT,
+                              time TEXT, user_id INTEGER, chat_id INTEGER);
+        INSERT INTO user VALUES (1, 'Jemal', 'j@w.edu', 'jemal', 'x');
+        INSERT INTO chat VALUES (1, 'School is good', '04/25/2018 21:49');
+        INSERT INTO chat_rel VALUES (1, 1, 1);
+        INSERT INTO chat_rel VALUES (2, 1, 1);
+        INSERT INTO message VALUES (1, 'Boy I like school',
+                                    '04/25/2018 21:49', 1, 1);
+    ''')
+    conn.close()
+
+
+def test_migrate_legacy_db_keeps_data(tmp_path):
+    """
+    Tests that an unversioned database is upgraded in place: the data
+    survives, duplicate memberships are removed and the version is stored.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = tmp_path / 'legacy.sqlite'
+    make_legacy_db(path)
+
+    conn = sqlite3.connect(str(path))
+    applied = migrate(conn)
+
+    assert [version for version, _ in applied] == \
+        list(range(1, SCHEMA_VERSION + 1))
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert conn.execute('SELECT count(*) FROM message').fetchone()[0] == 1
+    assert conn.execute('SELECT id FROM chat_rel').fetchall() == [(1,)]
+    assert conn.execute('SELECT * FROM chat_summary').fetchall() == \
+        [(1, 1, parse_time('04/25/2018 21:49'), 1, 1)]
+
+    # running it again is a no-op
+    assert migrate(conn) == []
+
+
+def test_time_ms_backfill(tmp_path):
+    """
+    Tests that the month-first time text of existing rows is backfilled into
+    time_ms, so that ordering by time_ms is chronological across years.
+
+    :param tmp_path: pytest temporary directory
+    """
+    path = tmp_path / 'legacy.sqlite'
+    make_legacy_db(path)
+
+    conn = sqlite3.connect(str(path))
+    conn.executescript('''
+        INSERT INTO message VALUES (2, 'older', '12/31/2017 23:59', 1, 1);
+        INSERT INTO message VALUES (3, 'unknown', 'noon', 1, 1);
+    ''')
+    migrate(conn)
+
+    rows = conn.execute('SELECT id, time_ms FROM message '
+                        'ORDER BY time_ms, id').fetchall()
+
+    assert [row_id for row_id, _ in rows] == [3, 2, 1]
+    assert rows[0][1] == 0
+    assert rows[2][1] == parse_time('04/25/2018 21:49')
+    assert format_time_ms(rows[2][1]) == '04/25/2018 21:49'
+    assert conn.execute('SELECT time_ms FROM chat').fetchone()[0] == \
+        parse_time('4/25/18 21:49')
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    """
+    Tests that the lookups done by queries.py are served by an index instead
+    of a full table scan.
+
+    :param tmp_path: pytest temporary directory
+    """
+    db = WooMessageDB(str(tmp_path / 'new.sqlite'))
+    conn = db._conn
+
+    queries = [
+        ('SELECT * FROM message WHERE chat_id = ? '
+         'ORDER BY time_ms, id', (1,)),
+        ('SELECT * FROM message WHERE chat_id = ? AND time_ms > ? '
+         'ORDER BY time_ms, id', (1, 0)),
+        ('SELECT * FROM message WHERE chat_id = ? AND id > ? '
+         'ORDER BY id', (1, 0)),
+        ('SELECT * FROM chat_rel WHERE user_id = ? AND chat_id = ?', (1, 1)),
+        ('SELECT * FROM chat_rel WHERE chat_id = ?', (1,)),
+        ('SELECT * FROM chat WHERE title = ?', ('School is good',)),
+    ]
+
+    for query, args in queries:
+        plan = ' '.join(row[-1] for row in
+                        conn.execute('EXPLAIN QUERY PLAN ' + query, args))
+        assert 'USING' in plan and 'INDEX' in plan, plan
+        assert 'TEMP B-TREE' not in plan, plan
@@ -0,0 +1,176 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import json
+import app_main
+
+
+def add_messages(count):
+    """
+    Inserts count messages from user 1 into chat 1. The times repeat, so that
+    the pagination has to break ties on the message id.
+
+    :param count: the number of messages to insert
+    """
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, 1, ?)',
+                         [('message {}'.format(i), '', 1000 + i // 2)
+                          for i in range(count)])
+        conn.commit()
+
+
+def test_api_pages(fresh_client):
+    """
+    Tests that following X-Next-Cursor in either direction visits every row
+    exactly once and that bad parameters are rejected.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(7)
+
+    ids = []
+    response = fresh_client.get('/api/message/?limit=3')
+    while True:
+        assert response.status_code == 200
+        ids.extend(row['id'] for row in response.get_json())
+        if 'X-Next-Cursor' not in response.headers:
+            break
+        assert 'rel="next"' in response.headers['Link']
+        response = fresh_client.get('/api/message/?limit=3&after=' +
+                                    response.headers['X-Next-Cursor'])
+
+    assert ids == list(range(1, 8))
+
+    response = fresh_client.get('/api/message/?limit=3&before=' +
+                                app_main.encode_cursor((6,)))
+    assert [row['id'] for row in response.get_json()] == [3, 4, 5]
+
+    assert fresh_client.get('/api/message/?limit=0').status_code == 422
+    assert fresh_client.get('/api/message/?after=nope').status_code == 422
+
+
+def test_chat_room_pages(fresh_client):
+    """
+    Tests that the chat room shows the newest page first and that the load
+    older cursors walk back through the whole history in order.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(7)
+
+    with app_main.app.test_request_context():
+        messages, older, newer = app_main.get_message_page(1, 3)
+        assert [text for _, text, _ in messages] == \
+            ['message 4', 'message 5', 'message 6']
+        assert newer is None
+
+        history = messages
+        while older is not None:
+            messages, older, newer = app_main.get_message_page(1, 3,
+                                                               before=older)
+            history = messages + history
+            assert newer is not None
+
+        assert [text for _, text, _ in history] == \
+            ['message {}'.format(i) for i in range(7)]
+
+    response = fresh_client.get('/chat_room/1/')
+    assert response.status_code == 200
+    assert b'message 6' in response.data
+    assert b'Load older messages' not in response.data
+
+
+def test_chat_page_loader(fresh_client):
+    """
+    Tests that load_chat_page reads the header, members and a page of
+    messages of a chat in two statements, and that a missing chat is a 404.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(5)
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.execute("INSERT INTO user(name, email, username, password) "
+                     "VALUES ('Ada', 'a@a.a', 'ada', 'x')")
+        conn.execute('INSERT INTO chat_rel(user_id, chat_id) VALUES (2, 1)')
+        conn.commit()
+
+        statements = []
+        conn.set_trace_callback(statements.append)
+        page = app_main.load_chat_page(1, 3)
+        conn.set_trace_callback(None)
+
+        assert len(statements) == 2
+        assert page['title'] == 'Test chat'
+        assert page['created'] == 1
+        assert page['participants'] == ['Ada', 'Tester']
+        assert page['latest_id'] == 5
+        assert [text for _, text, _ in page['messages']] == \
+            ['message 2', 'message 3', 'message 4']
+        assert page['older'] is not None and page['newer'] is None
+
+        assert app_main.load_chat_page(2, 3) is None
+
+    response = fresh_client.get('/chat_room/1/')
+    assert b'Ada, Tester' in response.data
+    assert b'last_id=5' in response.data
+    assert fresh_client.get('/chat_room/2/').status_code == 404
+
+
+def test_compact_rows(fresh_client):
+    """
+    Tests that the chat lists are lists of records with just the columns the
+    templates use, and that the dashboard renders them.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(2)
+
+    with app_main.app.app_context():
+        assert app_main.get_chat_rooms(1) == \
+            [app_main.ChatRoomRecord('Test chat', 1, 1, 2, 1000, 2, 1,
+                                     'message 1', 'Tester')]
+        assert app_main.get_participants_in_chat(1) == ['Tester']
+
+        messages = app_main.get_messages_in_chatroom(1)
+        assert [message.message for message in messages] == \
+            ['message 0', 'message 1']
+        assert messages[0]._fields == ('name', 'message', 'time')
+
+    response = fresh_client.get('/dashboard')
+    assert b'Test chat' in response.data
+    assert b'No active chats' not in response.data
+
+
+def test_api_streams(fresh_client, monkeypatch):
+    """
+    Tests that ?stream=1 returns the whole table as one JSON list and that
+    Accept: application/x-ndjson returns one row per line.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    monkeypatch.setitem(app_main.app.config, 'STREAM_BATCH_SIZE', 2)
+    add_messages(5)
+
+    response = fresh_client.get('/api/message/?stream=1&limit=1')
+    assert response.status_code == 200
+    assert [row['id'] for row in response.get_json()] == [1, 2, 3, 4, 5]
+
+    response = fresh_client.get('/api/message/',
+                                headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [1, 2, 3, 4, 5]
+
+    response = fresh_client.get('/api/chatrel/?stream=1')
+    assert response.get_json() == [{'id': 1, 'user_id': 1, 'chat_id': 1,
+                                    'last_read_id': 0}]
@@ -0,0 +1,102 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import threading
+import time
+import pytest
+import app_main
+from password_hashing import HashPool, hash_password, crypt_settings, \
+    TEST_ROUNDS
+from exception_classes import RequestError
+
+
+def test_full_pool_is_refused_with_retry_after():
+    """
+    Tests that a hash arriving while the pool is full is refused at once
+    with a 503 and a Retry-After header, and that the slot is freed again.
+    """
+    pool = HashPool(workers=1, max_queue=1)
+
+    try:
+        busy = threading.Thread(target=pool.run, args=(time.sleep, 1.0))
+        busy.start()
+        while pool.stats()['pending'] == 0:
+            time.sleep(0.01)
+
+        start = time.perf_counter()
+        with pytest.raises(RequestError) as error:
+            pool.hash('secret')
+        assert time.perf_counter() - start < 0.5
+        assert error.value.status_code == '503'
+        assert int(error.value.headers['Retry-After']) >= 1
+
+        busy.join()
+        assert pool.verify('secret', pool.hash('secret'))
+
+        stats = pool.stats()
+        assert stats['rejected'] == 1
+        assert stats['completed'] == 3
+        assert stats['pending'] == 0
+        assert stats['peak_pending'] == 1
+    finally:
+        pool.close()
+
+
+def test_login_verifies_in_worker(fresh_client):
+    """
+    Tests that registering through the API and logging in hash and verify
+    the password in the hash pool.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    response = fresh_client.post('/api/user/', data={
+        'name': 'Ada', 'email': 'ada@wooster.edu', 'username': 'ada',
+        'password': 'lovelace'})
+    assert response.status_code == 200
+
+    response = fresh_client.post('/login', data={'username': 'ada',
+                                                 'password': 'lovelace'})
+    assert response.status_code == 302
+
+    response = fresh_client.post('/login', data={'username': 'ada',
+                                                 'password': 'babbage'})
+    assert b'Invalid password' in response.data
+
+    stats = fresh_client.get('/api/metrics/').get_json()['password_hashing']
+    assert stats['completed'] >= 3
+    assert stats['pending'] == 0
+
+
+def test_login_rehashes_outdated_password(fresh_client):
+    """
+    Tests that the test profile's cheap policy is in use and that logging in
+    with a hash made under another policy replaces it with a current one.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    old_hash = hash_password('lovelace', crypt_settings(rounds=2000))
+
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.execute("INSERT INTO user(name, email, username, password) "
+                     "VALUES ('Ada', 'ada@wooster.edu', 'ada', ?)",
+                     (old_hash,))
+        conn.commit()
+
+    response = fresh_client.post('/login', data={'username': 'ada',
+                                                 'password': 'lovelace'})
+    assert response.status_code == 302
+
+    with app_main.app.app_context():
+        new_hash = app_main.get_user_by_username('ada')['password']
+
+    assert new_hash != old_hash
+    assert new_hash.startswith('$5$rounds={}$'.format(TEST_ROUNDS))
+
+    stats = fresh_client.get('/api/metrics/').get_json()['password_hashing']
+    assert stats['rehashed'] == 1
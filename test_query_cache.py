@@ -0,0 +1,187 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import sqlite3
+import threading
+import pytest
+import app_main
+from test_pagination import add_messages
+from query_cache import QueryCache
+
+
+def test_cache_evicts_expires_and_invalidates(monkeypatch):
+    """
+    Tests the LRU bound, the time to live, tag invalidation and that a load
+    racing with an invalidation is not stored.
+
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    cache = QueryCache(max_entries=2, ttl=60)
+    loads = []
+
+    def load(value):
+        loads.append(value)
+        return value
+
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get_or_load(key, [key], lambda: load(key))
+    assert loads == ['a', 'b', 'c']  # 'b' was least recently used
+
+    cache.get_or_load('b', ['b'], lambda: load('b'))
+    assert loads[-1] == 'b'
+
+    cache.invalidate('c')
+    cache.get_or_load('c', ['c'], lambda: load('c'))
+    assert loads.count('c') == 2
+
+    def racing_load():
+        cache.invalidate('d')  # a write commits while we read
+        return load('stale d')
+
+    cache.get_or_load('d', ['d'], racing_load)
+    cache.get_or_load('d', ['d'], lambda: load('fresh d'))
+    assert loads[-1] == 'fresh d'
+
+    monkeypatch.setattr(cache, '_ttl', 0)
+    cache.get_or_load('e', ['e'], lambda: load('e'))
+    cache.get_or_load('e', ['e'], lambda: load('e'))
+    assert loads.count('e') == 2
+
+    stats = cache.stats()
+    assert stats['evictions'] >= 2
+    assert stats['expirations'] == 1
+    assert stats['hits'] == 1
+
+
+def test_cache_forgets_idle_tags():
+    """
+    Tests that the cache keeps no bookkeeping for the tags of the data that
+    was changed, once no load of them is running.
+    """
+    cache = QueryCache(max_entries=2, ttl=60)
+
+    def racing_load():
+        cache.invalidate('chat:1')
+        return 'stale'
+
+    cache.get_or_load('a', ['chat:1'], racing_load)
+    assert 'a' not in cache._entries
+
+    for chat_id in range(1000):
+        cache.get_or_load(chat_id, ['chat:{}'.format(chat_id)],
+                          lambda: chat_id)
+        cache.invalidate('chat:{}'.format(chat_id), 'chat_rel:{}'.format(
+            chat_id))
+
+    with pytest.raises(ZeroDivisionError):
+        cache.get_or_load('b', ['user'], lambda: 1 / 0)
+
+    assert not cache._generations and not cache._loading
+    assert not cache._keys_by_tag
+
+
+def test_writes_invalidate_lookups(fresh_client):
+    """
+    Tests that chat lookups are served from the cache and that renames and
+    membership changes are visible right after they are made.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    with app_main.app.app_context():
+        app_main.insert_user('Ada', 'ada@wooster.edu', 'ada', 'lovelace')
+
+    assert b'Tester' in fresh_client.get('/chat_room/1/').data
+
+    with app_main.app.app_context():
+        for _ in range(2):
+            app_main.get_room_info(1)
+            app_main.get_participants_in_chat(1)
+
+        stats = app_main.get_query_cache().stats()
+        assert stats['hits'] >= 2
+
+        assert 'Ada' not in app_main.get_participants_in_chat(1)
+        app_main.insert_chat_rel(app_main.get_user_id('ada'), 1)
+        assert 'Ada' in app_main.get_participants_in_chat(1)
+
+        app_main.update_user(app_main.get_user_id('ada'), 'Countess')
+        assert list(app_main.get_participants_in_chat(1)) == \
+            ['Countess', 'Tester']
+
+        app_main.update_chat(1, 'Renamed chat')
+        assert app_main.get_chat_room_name(1) == 'Renamed chat'
+
+        app_main.delete_user_from_chat('ada', 1)
+        assert list(app_main.get_participants_in_chat(1)) == ['Tester']
+
+    metrics = fresh_client.get('/api/metrics/').get_json()['query_cache']
+    assert metrics['invalidations'] > 0
+
+
+def test_other_writers_are_seen(fresh_client):
+    """
+    Tests that writes made outside the cache's process (here, on a separate
+    connection) are visible from the next request on, before any time to
+    live, and that a request reads the version counters once.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    with app_main.app.app_context():
+        assert app_main.get_participants_in_chat(1) == ['Tester']
+        assert app_main.get_chat_room_name(1) == 'Test chat'
+
+        other = sqlite3.connect(app_main.app.config['DATABASE'])
+        other.execute("INSERT INTO user(name, email, username, password) "
+                      "VALUES ('Ada', 'ada@wooster.edu', 'ada', 'x')")
+        other.execute('INSERT INTO chat_rel(user_id, chat_id) VALUES (2, 1)')
+        other.execute("UPDATE chat SET title = 'Renamed' WHERE id = 1")
+        other.commit()
+
+        # this request already read the versions
+        assert app_main.get_participants_in_chat(1) == ['Tester']
+
+    with app_main.app.app_context():
+        assert app_main.get_participants_in_chat(1) == ['Ada', 'Tester']
+        assert app_main.get_chat_room_name(1) == 'Renamed'
+        assert app_main.get_user_id('ada') == 2
+
+        other.execute("UPDATE user SET name = 'Countess' WHERE id = 2")
+        other.commit()
+        other.close()
+
+    with app_main.app.app_context():
+        assert app_main.get_participants_in_chat(1) == ['Countess', 'Tester']
+        assert app_main.get_query_cache().stats()['stale'] >= 3
+
+
+def test_deletes_invalidate_their_chat(fresh_client):
+    """
+    Tests that deleting a message or a membership drops the cached reads of
+    its chat, and that the chat page changes.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(2)
+    etag = fresh_client.get('/chat_room/1/').headers['ETag']
+
+    with app_main.app.app_context():
+        app_main.get_room_info(1)
+        app_main.get_participants_in_chat(1)
+        entries = app_main.get_query_cache()._entries
+        assert ('get_room_info', '1') in entries
+
+    assert fresh_client.delete('/api/message/2').status_code == 200
+
+    with app_main.app.app_context():
+        assert ('get_room_info', '1') not in entries
+        assert ('get_participants_in_chat', '1') not in entries
+
+    response = fresh_client.get('/chat_room/1/',
+                                headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'message 1' not in response.data
@@ -0,0 +1,104 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import sqlite3
+import app_main
+from test_pagination import add_messages
+
+
+def test_watermarks_and_unread_counts(fresh_client):
+    """
+    Tests that opening a chat and the read API move the watermarks forward
+    only, that the dashboard counts unread messages up to the cap through
+    the message(chat_id, id) index, and that the receipts follow.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(3)
+
+    with app_main.app.app_context():
+        ada = app_main.insert_user('Ada', 'ada@wooster.edu', 'ada',
+                                   'lovelace')['id']
+        app_main.insert_chat_rel(ada, 1)
+
+        assert app_main.get_chat_rooms(1)[0].unread == 3
+
+        plan = ' '.join(row['detail'] for row in app_main.get_db().execute(
+            'EXPLAIN QUERY PLAN ' + app_main.CHAT_ROOMS_QUERY,
+            (100, 1) + app_main.CHAT_ROOMS_START + (-1,)))
+        assert 'message_chat_id' in plan
+        assert 'chat_rel_user_chat' in plan
+        assert app_main.get_db().execute(
+            "SELECT count(*) FROM sqlite_master "
+            "WHERE name = 'chat_summary_activity'").fetchone()[0] == 0
+
+    assert b'<span class="badge">3</span>' in \
+        fresh_client.get('/dashboard').data
+
+    page = fresh_client.get('/chat_room/1/').data
+    assert b'Seen by Tester' in page
+
+    with app_main.app.app_context():
+        assert app_main.get_chat_rooms(1)[0].unread == 0
+        chat_rel = app_main.get_data_versions(['chat_rel'])
+
+    response = fresh_client.post('/api/chat/1/read',
+                                 data={'user_id': ada, 'message_id': 2})
+    assert response.get_json()['last_read_id'] == 2
+    response = fresh_client.post('/api/chat/1/read',
+                                 data={'user_id': ada, 'message_id': 1})
+    assert response.get_json()['last_read_id'] == 2
+
+    assert fresh_client.get('/api/chat/1/read').get_json() == [
+        {'user_id': ada, 'name': 'Ada', 'last_read_id': 2},
+        {'user_id': 1, 'name': 'Tester', 'last_read_id': 3}]
+    assert fresh_client.post('/api/chat/2/read',
+                             data={'user_id': ada}).status_code == 404
+
+    with app_main.app.app_context():
+        # moving a watermark does not change the chat_rel responses
+        assert app_main.get_data_versions(['chat_rel']) == chat_rel
+
+    add_messages(150)
+
+    etag = fresh_client.get('/dashboard').headers['ETag']
+    assert b'<span class="badge">99+</span>' in \
+        fresh_client.get('/dashboard').data
+
+    fresh_client.post('/chat_room/1/read', data={'message_id': 153})
+    response = fresh_client.get('/dashboard',
+                                headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'badge' not in response.data
+
+
+def test_reading_again_does_not_write(fresh_client):
+    """
+    Tests that opening a chat whose newest message is already read neither
+    writes nor waits for the write lock, so a poll answered with 304 works
+    while another connection is writing.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    add_messages(3)
+    etag = fresh_client.get('/chat_room/1/').headers['ETag']
+
+    writer = sqlite3.connect(app_main.app.config['DATABASE'], timeout=0)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        response = fresh_client.get('/chat_room/1/',
+                                    headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    finally:
+        writer.rollback()
+        writer.close()
+
+    with app_main.app.app_context():
+        assert app_main.mark_read(1, 1) == 3
+        assert app_main.mark_read(1, 1, 2) == 3
+        assert app_main.mark_read(1, 2) is None
@@ -0,0 +1,85 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import app_main
+
+
+def test_search_follows_writes(fresh_client):
+    """
+    Tests that the message_fts index follows inserts, updates and deletes,
+    and that the search API ranks, filters, pages and highlights.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.execute("INSERT INTO chat(title, time, time_ms) "
+                     "VALUES ('Other chat', '', 2)")
+        conn.executemany('INSERT INTO message(message, time, user_id, '
+                         'chat_id, time_ms) VALUES (?, ?, 1, ?, ?)',
+                         [('school is <b>good</b>', '', 1, 1),
+                          ('school school school', '', 1, 2),
+                          ('I like donkeys', '', 1, 3),
+                          ('schooling elsewhere', '', 2, 4)])
+        conn.commit()
+
+    def search(query):
+        response = fresh_client.get('/api/message/search?' + query)
+        assert response.status_code == 200
+        return response
+
+    results = search('q=school').get_json()
+    assert results[0]['id'] == 2  # the most matches rank first
+    assert sorted(row['id'] for row in results) == [1, 2, 4]
+    snippets = {row['id']: row['snippet'] for row in results}
+    assert snippets[1] == '<mark>school</mark> is &lt;b&gt;good&lt;/b&gt;'
+    assert snippets[4] == '<mark>schooling</mark> elsewhere'
+    assert results[0]['name'] == 'Tester'
+
+    assert [row['id'] for row in search('q=school&chat_id=1').get_json()] \
+        == [2, 1]
+    assert search('q=schoo').get_json() == results
+
+    with app_main.app.app_context():
+        statements = []
+        app_main.get_db().set_trace_callback(statements.append)
+        newest, _ = app_main.search_messages('school', 10, rank_window=2)
+        app_main.get_db().set_trace_callback(None)
+        assert sorted(row['id'] for row in newest) == [2, 4]
+
+        # the bound of the window is read in index order, without a sort
+        bound = next(sql for sql in statements
+                     if sql.startswith('SELECT min('))
+        plan = ' '.join(row['detail'] for row in app_main.get_db().execute(
+            'EXPLAIN QUERY PLAN ' + bound))
+        assert 'TEMP B-TREE' not in plan
+    assert search('q=%22school%22+is').get_json()[0]['id'] == 1
+
+    response = search('q=school&limit=2')
+    assert 'X-Next-Cursor' in response.headers
+    response = fresh_client.get(response.headers['Link'][1:].split('>')[0])
+    assert response.get_json() == results[2:]
+
+    with app_main.app.app_context():
+        app_main.update_message('I like mules', 1, 3)
+        app_main.delete_item('message', 2)
+
+    assert search('q=donkeys').get_json() == []
+    assert [row['id'] for row in search('q=mule').get_json()] == [3]
+    assert sorted(row['id'] for row in search('q=school').get_json()) == \
+        [1, 4]
+
+    with app_main.app.app_context():
+        assert app_main.rebuild_search_index() == 3
+    assert len(search('q=school').get_json()) == 2
+
+    assert fresh_client.get('/api/message/search?q=+').status_code == 422
+
+    page = fresh_client.get('/chat_room/1/search?q=school').data
+    assert b'<mark>school</mark>' in page
+    assert b'elsewhere' not in page
@@ -0,0 +1,199 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import os
+import sqlite3
+import pytest
+import app_main
+import connection_pool
+import shard_router
+from exception_classes import RequestError
+
+
+def add_chats(count, first=0):
+    """
+    Creates count chats with one member (user 1) and one message each.
+
+    :param count: the number of chats
+    :param first: the number in the title of the first chat
+    :return: list of the ids of the chats
+    """
+    chat_ids = []
+
+    with app_main.app.app_context():
+        for number in range(first, first + count):
+            chat_id = app_main.insert_chat_room('Chat {}'.format(number),
+                                                ['tester'])
+            app_main.insert_message('hello donkey {}'.format(number), '', 1,
+                                    chat_id, 1000 + number)
+            chat_ids.append(chat_id)
+
+    return chat_ids
+
+
+def dump(client):
+    """
+    :return: the chats, memberships and messages the API lists
+    """
+    return [client.get('/api/{}/'.format(table)).get_json()
+            for table in ('chat', 'chatrel', 'message')]
+
+
+def test_sharded_database(fresh_client):
+    """
+    Tests that the chats of a sharded database are written to the shard of
+    their id, with ids unique across the shards, and that the pages and the
+    API read them back from every shard.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    config = app_main.app.config
+    database = config['DATABASE']
+    config['SHARDS'] = 3
+
+    try:
+        with app_main.app.app_context():
+            app_main.init_db()
+            app_main.get_db().execute(
+                "INSERT INTO user(name, email, username, password) "
+                "VALUES ('Tester', 't@t.t', 'tester', 'x')")
+            app_main.get_db().commit()
+
+        chat_ids = add_chats(12)
+        assert len(set(chat_ids)) == 12
+
+        for shard in range(3):
+            conn = sqlite3.connect(shard_router.get_shard_path(database,
+                                                               shard))
+            for table, column in (('chat', 'id'), ('chat_rel', 'chat_id'),
+                                  ('message', 'chat_id')):
+                assert all((chat_id - 1) % 3 == shard for chat_id, in
+                           conn.execute('SELECT {} FROM {}'.format(column,
+                                                                   table)))
+            assert conn.execute("SELECT name FROM sqlite_master "
+                                "WHERE name = 'user'").fetchone() is None
+            conn.close()
+
+        chats, chat_rels, messages = dump(fresh_client)
+        assert sorted(chat['id'] for chat in chats) == sorted(chat_ids)
+        assert [message['id'] for message in messages] == \
+            sorted({message['id'] for message in messages})
+        assert len(chat_rels) == 12
+
+        page = fresh_client.get('/api/message/?limit=5')
+        assert [message['id'] for message in page.get_json()] == \
+            [message['id'] for message in messages[:5]]
+
+        dashboard = fresh_client.get('/dashboard').data
+        assert all('Chat {}'.format(number).encode() in dashboard
+                   for number in range(12))
+        assert b'hello donkey 11' in fresh_client.get(
+            '/chat_room/{}/'.format(chat_ids[11])).data
+
+        results = fresh_client.get('/api/message/search?q=donkey&limit=5')
+        assert len(results.get_json()) == 5
+        next_page = results.headers['Link'][1:].split('>')[0]
+        assert len(fresh_client.get(next_page).get_json()) == 5
+
+        etag = fresh_client.get('/api/message/').headers['ETag']
+        assert fresh_client.get('/api/message/', headers={
+            'If-None-Match': etag}).status_code == 304
+        with app_main.app.app_context():
+            app_main.insert_message('later', '', 1, chat_ids[0], 5000)
+        assert fresh_client.get('/api/message/', headers={
+            'If-None-Match': etag}).status_code == 200
+    finally:
+        config['SHARDS'] = 1
+        for shard in range(3):
+            connection_pool.close_pools(shard_router.get_shard_path(database,
+                                                                    shard))
+
+
+def test_reshard(fresh_client):
+    """
+    Tests that resharding 1 -> 3 -> 2 -> 1 keeps every row, and that new
+    rows get ids no other shard uses.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    config = app_main.app.config
+    database = config['DATABASE']
+
+    add_chats(8)
+    before = dump(fresh_client)
+
+    try:
+        for old_shards, new_shards in ((1, 3), (3, 2), (2, 1)):
+            assert sum(shard_router.reshard(database, old_shards,
+                                            new_shards)) == 9
+            config['SHARDS'] = new_shards
+
+            assert dump(fresh_client) == before
+
+        config['SHARDS'] = 2
+        shard_router.reshard(database, 1, 2)
+        chat_ids = add_chats(4, first=8)
+        chats, _, messages = dump(fresh_client)
+        assert len({chat['id'] for chat in chats}) == 13
+        assert len({message['id'] for message in messages}) == 12
+        assert min(chat_ids) > max(chat['id'] for chat in before[0])
+    finally:
+        config['SHARDS'] = 1
+        for shards in (2, 3):
+            for shard in range(shards):
+                connection_pool.close_pools(
+                    shard_router.get_shard_path(database, shard))
+
+
+def test_interrupted_reshard(fresh_client, monkeypatch):
+    """
+    Tests that a reshard interrupted while it swaps in the new files keeps
+    the data, and that the next reshard finishes it.
+
+    :param fresh_client: flask test client on an empty database
+    :param monkeypatch: pytest monkeypatch fixture
+    """
+    config = app_main.app.config
+    database = config['DATABASE']
+
+    add_chats(8)
+    before = dump(fresh_client)
+    replace = os.replace
+    replaced = []
+
+    def crash_on_second_shard(source, target):
+        if source.endswith('.resharding'):
+            replaced.append(target)
+            if len(replaced) == 2:
+                raise OSError('crash')
+        replace(source, target)
+
+    try:
+        shard_router.reshard(database, 1, 3)
+        config['SHARDS'] = 3
+
+        monkeypatch.setattr(os, 'replace', crash_on_second_shard)
+        with pytest.raises(OSError):
+            shard_router.reshard(database, 3, 2)
+        monkeypatch.setattr(os, 'replace', replace)
+
+        with pytest.raises(RequestError):
+            shard_router.reshard(database, 3, 1)
+        config['SHARDS'] = 2
+        assert dump(fresh_client) == before
+
+        assert not os.path.exists(shard_router.get_shard_path(database, 2))
+        assert sum(shard_router.reshard(database, 2, 1)) == 9
+        config['SHARDS'] = 1
+        assert dump(fresh_client) == before
+    finally:
+        config['SHARDS'] = 1
+        for shards in (2, 3):
+            for shard in range(shards):
+                connection_pool.close_pools(
+                    shard_router.get_shard_path(database, shard))
@@ -0,0 +1,116 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import sqlite3
+import pytest
+import app_main
+import connection_pool
+from exception_classes import RequestError
+from migrations import migrate
+from synthetic_data import generate, PASSWORD
+from test_chat_summary import AGGREGATED_SUMMARIES
+
+
+def generated(path, seed):
+    """
+    :param path: the database file name
+    :param seed: the seed of the generator
+    :return: the sqlite connection of a new generated database
+    """
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    generate(conn, 50, 20, 3000, seed, end_ms=1500000000000, chunk_size=700)
+
+    return conn
+
+
+def test_generate(tmp_path):
+    """
+    Tests that a seed gives the same data, that the chats' popularity is
+    skewed, that the messages come from members of their chat and that the
+    summaries, search index and triggers are rebuilt after the load.
+
+    :param tmp_path: pytest temporary directory
+    """
+    conn = generated(str(tmp_path / 'a.sqlite'), 1)
+    same = generated(str(tmp_path / 'b.sqlite'), 1)
+    other = generated(str(tmp_path / 'c.sqlite'), 2)
+
+    dump = 'SELECT * FROM message ORDER BY id'
+    assert conn.execute(dump).fetchall() == same.execute(dump).fetchall()
+    assert conn.execute(dump).fetchall() != other.execute(dump).fetchall()
+
+    assert conn.execute('SELECT count(*) FROM message').fetchone()[0] == 3000
+    times = [time_ms for time_ms, in conn.execute(
+        'SELECT time_ms FROM message ORDER BY id')]
+    assert times == sorted(times) and times[-1] <= 1500000000000
+
+    counts = [count for count, in conn.execute(
+        'SELECT count(*) AS c FROM message GROUP BY chat_id ORDER BY c DESC')]
+    assert counts[0] > 5 * 3000 / 20
+
+    assert conn.execute('''
+        SELECT count(*) FROM message WHERE NOT EXISTS (
+            SELECT 1 FROM chat_rel WHERE chat_rel.user_id = message.user_id
+            AND chat_rel.chat_id = message.chat_id)
+    ''').fetchone()[0] == 0
+
+    assert conn.execute('SELECT * FROM chat_summary ORDER BY chat_id'
+                        ).fetchall() == \
+        conn.execute(AGGREGATED_SUMMARIES).fetchall()
+    assert conn.execute(
+        "SELECT count(*) FROM message_fts WHERE message_fts MATCH 'donkey'"
+    ).fetchone()[0] == conn.execute(
+        "SELECT count(*) FROM message WHERE ' ' || message || ' ' "
+        "LIKE '% donkey %'").fetchone()[0]
+
+    # the triggers are back
+    version = conn.execute("SELECT version FROM data_version "
+                           "WHERE scope = 'chat:1'").fetchone()[0]
+    conn.execute("INSERT INTO message(message, time, user_id, chat_id, "
+                 "time_ms) VALUES ('zebra', '', 1, 1, 1600000000000)")
+    assert conn.execute("SELECT version FROM data_version "
+                        "WHERE scope = 'chat:1'").fetchone()[0] == version + 1
+    assert conn.execute('SELECT last_activity FROM chat_summary '
+                        'WHERE chat_id = 1').fetchone()[0] == 1600000000000
+    assert conn.execute("SELECT count(*) FROM message_fts "
+                        "WHERE message_fts MATCH 'zebra'").fetchone()[0] == 1
+
+    with pytest.raises(RequestError):
+        generate(conn, 50, 20, 10)
+
+
+def test_gen_synthetic_command(fresh_client):
+    """
+    Tests that flask gen_synthetic recreates the database with the same data
+    for the same seed, with users who can log in with the generated
+    password.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    dumps = []
+    for _ in range(2):
+        result = app_main.app.test_cli_runner().invoke(args=[
+            'gen_synthetic', '--users', '10', '--chats', '4', '--messages',
+            '100', '--seed', '3'])
+        assert result.exit_code == 0, result.output
+        assert '100 messages generated in' in result.output
+
+        with app_main.app.app_context():
+            dumps.append([tuple(row) for row in app_main.get_db().execute(
+                'SELECT * FROM message ORDER BY id')])
+
+    # the same seed gives the same messages at the same times
+    assert dumps[0] == dumps[1]
+
+    response = fresh_client.post('/login', data={'username': 'user1',
+                                                 'password': PASSWORD})
+    assert response.status_code == 302
+
+    with app_main.app.app_context():
+        assert len(app_main.get_all_rows('user')) == 10
@@ -0,0 +1,47 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+"""
+
+import json
+import app_main
+from table_classes import MODELS, Message, records_to_json
+
+
+def test_models_match_tables(fresh_client):
+    """
+    Tests that every model has a slot per column of its table, in order, and
+    that records hydrate from and serialize to the same values as the dict
+    rows.
+
+    :param fresh_client: flask test client on an empty database
+    """
+    with app_main.app.app_context():
+        conn = app_main.get_db()
+        conn.execute("INSERT INTO message(message, time, user_id, chat_id, "
+                     "time_ms) VALUES ('a \"quoted\" message', '', 1, 1, 5)")
+        conn.commit()
+
+        for table, model in MODELS.items():
+            columns = [row['name'] for row in
+                       conn.execute('PRAGMA table_info({})'.format(table))]
+            assert list(model.columns) == columns
+
+            records = app_main.get_all_rows(table, as_records=True)
+            assert [record.to_dict() for record in records] == \
+                app_main.get_all_rows(table)
+            assert json.loads(records_to_json(records)) == \
+                app_main.get_all_rows(table)
+
+        message = app_main.query_by_id('message', 1, as_record=True)
+        assert message == Message(1, 'a "quoted" message', '', 1, 1, 5)
+        assert not hasattr(message, '__dict__')
+        assert app_main.query_by_id('message', 2, as_record=True) is None
+
+    response = fresh_client.get('/api/message/1')
+    assert response.get_json() == message.to_dict()
+    assert fresh_client.get('/api/message/?limit=1').get_json() == \
+        [message.to_dict()]
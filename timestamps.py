@@ -0,0 +1,86 @@
+"""
+WooMessages
+CS 232
+Final Project
+AVI VAJPEYI, JEMAL JEMAL, ISAAC WEISS, MORGAN THOMPSON
+
+A file containing helpers for the epoch-millisecond timestamps stored in the
+time_ms columns of the message and chat tables.
+
+The time columns hold month-first text such as "04/25/2018 21:49", which does
+not sort chronologically. Every row therefore also stores time_ms, an integer
+number of milliseconds since the epoch (local time, like get_date()), which is
+what the queries sort and range-scan on. Templates turn time_ms back into
+readable text with format_time_ms().
+"""
+
+import datetime
+
+# the formats written by get_date(), the CSV import and the API examples
+TIME_FORMATS = (
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%y %H:%M',
+    '%m/%d/%Y %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+)
+
+DISPLAY_FORMAT = '%m/%d/%Y %H:%M'
+
+
+def now_ms():
+    """
+    Returns the current time in milliseconds since the epoch
+    """
+    return to_time_ms(datetime.datetime.now())
+
+
+def to_time_ms(moment):
+    """
+    Converts a datetime to milliseconds since the epoch.
+
+    :param moment: a datetime, naive datetimes are taken as local time
+    :return: the number of milliseconds since the epoch
+    """
+    return int(moment.timestamp() * 1000)
+
+
+def parse_time(text):
+    """
+    Parses the text of a time column into milliseconds since the epoch.
+
+    :param text: a time string in one of TIME_FORMATS, or a number of
+    milliseconds
+    :return: the number of milliseconds, or None if the text can't be parsed
+    """
+    if text is None:
+        return None
+
+    text = str(text).strip()
+
+    if text.isdigit():
+        return int(text)
+
+    for time_format in TIME_FORMATS:
+        try:
+            return to_time_ms(datetime.datetime.strptime(text, time_format))
+        except ValueError:
+            pass
+
+    return None
+
+
+def format_time_ms(time_ms, time_format=DISPLAY_FORMAT):
+    """
+    Formats milliseconds since the epoch for display.
+
+    :param time_ms: the number of milliseconds since the epoch
+    :param time_format: strftime format of the result
+    :return: the formatted time, an empty string for unknown times
+    """
+    if not time_ms:
+        return ''
+
+    return datetime.datetime.fromtimestamp(time_ms / 1000).strftime(
+        time_format)